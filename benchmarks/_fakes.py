@@ -0,0 +1,264 @@
+"""
+ابزار مشترک بنچمارک‌ها: آپدیت/context جعلی (بدون شبکه)، Bot API جعلی برای Application واقعی
+و شمارنده کوئری‌های DB.
+"""
+from __future__ import annotations
+
+import asyncio
+import itertools
+import json
+import time
+from collections import Counter
+from contextvars import ContextVar
+from types import SimpleNamespace
+
+from sqlalchemy import event
+from telegram.request import BaseRequest
+
+
+_update_ids = itertools.count(1)
+
+
+class FakeMessage:
+    def __init__(self, chat_id: int, text: str | None = None, photo=None, document=None):
+        self.chat_id = chat_id
+        self.text = text
+        self.photo = photo
+        self.document = document
+        self.replies: list[str] = []
+
+    async def reply_text(self, text, **kwargs):
+        self.replies.append(text)
+
+    async def reply_photo(self, photo=None, caption=None, **kwargs):
+        self.replies.append(caption or "")
+
+
+class FakeCallbackQuery:
+    def __init__(self, data: str, message: FakeMessage):
+        self.data = data
+        self.message = message
+
+    async def answer(self, *args, **kwargs):
+        return True
+
+
+class FakeUpdate:
+    def __init__(self, user_id: int, message: FakeMessage, callback_query: FakeCallbackQuery | None = None):
+        self.update_id = next(_update_ids)
+        self.effective_user = SimpleNamespace(id=user_id, username=f"u{user_id}")
+        self.effective_message = message
+        self.message = message if callback_query is None else None
+        self.callback_query = callback_query
+
+
+class FakeContext:
+    """مثل CallbackContext: برای هر آپدیت یک نمونه تازه، user_data بین آپدیت‌ها مشترک."""
+
+    def __init__(self, user_data: dict, bot=None):
+        self.user_data = user_data
+        self.bot = bot
+
+
+def text_update(user_id: int, text: str) -> FakeUpdate:
+    return FakeUpdate(user_id, FakeMessage(user_id, text=text))
+
+
+def photo_update(user_id: int, file_id: str) -> FakeUpdate:
+    photo = [SimpleNamespace(file_id=file_id, file_unique_id=f"u-{file_id}")]
+    return FakeUpdate(user_id, FakeMessage(user_id, photo=photo))
+
+
+def callback_update(user_id: int, data: str) -> FakeUpdate:
+    msg = FakeMessage(user_id)
+    return FakeUpdate(user_id, msg, FakeCallbackQuery(data, msg))
+
+
+class Tally:
+    """شمارنده‌های یک آپدیت؛ با TALLY.set داخل همان task، کوئری‌ها و فراخوانی‌های Bot API به آن می‌رسند."""
+
+    __slots__ = ("statements", "api_calls")
+
+    def __init__(self):
+        self.statements = 0
+        self.api_calls = 0
+
+
+TALLY: ContextVar[Tally | None] = ContextVar("bench_tally", default=None)
+
+
+# -------- Bot API جعلی --------
+BOT_USER = {"id": 7_000_000_001, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+
+
+class FakeBotRequest(BaseRequest):
+    """
+    جایگزین HTTPXRequest: هر متد Bot API بدون شبکه یک پاسخ حداقلیِ معتبر می‌گیرد
+    (Message برای send*/edit*، True برای بقیه). latency اختیاری برای شبیه‌سازی رفت‌وبرگشت.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls: Counter[str] = Counter()
+        self._message_ids = itertools.count(1)
+
+    @property
+    def read_timeout(self) -> float | None:
+        return None
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None) -> tuple[int, bytes]:
+        endpoint = url.rsplit("/", 1)[-1]
+        self.calls[endpoint] += 1
+        tally = TALLY.get()
+        if tally is not None:
+            tally.api_calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        params = request_data.parameters if request_data is not None else {}
+        return 200, json.dumps({"ok": True, "result": self._result(endpoint, params)}).encode()
+
+    def _message(self, params: dict) -> dict:
+        msg = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": params.get("chat_id", 0), "type": "private"},
+            "from": BOT_USER,
+        }
+        if "text" in params:
+            msg["text"] = params["text"]
+        return msg
+
+    def _result(self, endpoint: str, params: dict):
+        if endpoint == "getMe":
+            return BOT_USER
+        if endpoint == "getUpdates":
+            return []
+        if endpoint == "getFile":
+            return {"file_id": params.get("file_id"), "file_unique_id": "f", "file_path": "photos/file.jpg"}
+        if endpoint == "getChatMember":
+            return {"status": "member", "user": {"id": params.get("user_id", 0), "is_bot": False, "first_name": "u"}}
+        if endpoint == "sendMediaGroup":
+            return [self._message(params) for _ in params.get("media") or [None]]
+        if endpoint.startswith(("send", "copyMessage", "forwardMessage", "edit")):
+            return self._message(params)
+        return True
+
+
+class FakeUpdateFeed(FakeBotRequest):
+    """
+    getUpdates جعلی مثل تلگرام: آپدیت‌هایی که update_id >= offset دارند، حداکثر limit تا.
+    visible(now) تعیین می‌کند تا این لحظه چند آپدیت "رسیده" (برای نرخ ورود ثابت)؛ پیش‌فرض همه.
+    """
+
+    def __init__(self, updates: list[dict], latency: float = 0.0, empty_wait: float = 0.02, visible=None):
+        super().__init__(latency)
+        self.updates = updates  # مرتب بر اساس update_id
+        self.empty_wait = empty_wait
+        self.visible = visible or (lambda: len(updates))
+        self._pos = 0
+
+    async def do_request(self, url, method, request_data=None, *args, **kwargs) -> tuple[int, bytes]:
+        if not url.endswith("/getUpdates"):
+            return await super().do_request(url, method, request_data, *args, **kwargs)
+        self.calls["getUpdates"] += 1
+        params = request_data.parameters if request_data is not None else {}
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        while self._pos < len(self.updates) and self.updates[self._pos]["update_id"] < offset:
+            self._pos += 1
+        batch = self.updates[self._pos: min(self._pos + limit, self.visible())]
+        # long polling: بدون آپدیت کمی صبر، با آپدیت یک رفت‌وبرگشت
+        await asyncio.sleep(self.latency if batch else self.empty_wait)
+        return 200, json.dumps({"ok": True, "result": batch}).encode()
+
+
+class UpdateFactory:
+    """dict آپدیت‌های تلگرام (همان JSON که getUpdates یا webhook تحویل می‌دهد)."""
+
+    def __init__(self):
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+
+    @staticmethod
+    def _user(uid: int) -> dict:
+        return {"id": uid, "is_bot": False, "first_name": f"u{uid}", "username": f"u{uid}", "language_code": "fa"}
+
+    def _message(self, uid: int, **fields) -> dict:
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": uid, "type": "private"},
+            "from": self._user(uid),
+            **fields,
+        }
+
+    def text(self, uid: int, text: str) -> dict:
+        fields: dict = {"text": text}
+        if text.startswith("/"):
+            fields["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return {"update_id": next(self._update_ids), "message": self._message(uid, **fields)}
+
+    def photo(self, uid: int, file_id: str, media_group_id: str | None = None) -> dict:
+        sizes = [
+            {"file_id": f"{file_id}-s", "file_unique_id": f"u-{file_id}-s", "width": 90, "height": 90},
+            {"file_id": file_id, "file_unique_id": f"u-{file_id}", "width": 1280, "height": 1280, "file_size": 250_000},
+        ]
+        fields: dict = {"photo": sizes}
+        if media_group_id:
+            fields["media_group_id"] = media_group_id
+        return {"update_id": next(self._update_ids), "message": self._message(uid, **fields)}
+
+    def callback(self, uid: int, data: str) -> dict:
+        # پیام دکمه‌دار از طرف خود bot
+        message = self._message(uid, text="…")
+        message["from"] = BOT_USER
+        return {
+            "update_id": next(self._update_ids),
+            "callback_query": {
+                "id": str(next(self._update_ids)),
+                "from": self._user(uid),
+                "chat_instance": str(uid),
+                "data": data,
+                "message": message,
+            },
+        }
+
+
+class QueryCounter:
+    """تعداد statementهای ارسال‌شده به DB (به‌علاوه commitها) روی یک engine؛ اگر TALLY ست باشد سهم آن آپدیت هم."""
+
+    def __init__(self, engine):
+        self._sync_engine = engine.sync_engine
+        self.statements = 0
+        self.commits = 0
+
+    def _on_execute(self, *args, **kwargs):
+        self.statements += 1
+        tally = TALLY.get()
+        if tally is not None:
+            tally.statements += 1
+
+    def _on_commit(self, *args, **kwargs):
+        self.commits += 1
+
+    def __enter__(self):
+        event.listen(self._sync_engine, "before_cursor_execute", self._on_execute)
+        event.listen(self._sync_engine, "commit", self._on_commit)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self._sync_engine, "before_cursor_execute", self._on_execute)
+        event.remove(self._sync_engine, "commit", self._on_commit)
+
+    def reset(self) -> tuple[int, int]:
+        out = (self.statements, self.commits)
+        self.statements = 0
+        self.commits = 0
+        return out
@@ -0,0 +1,91 @@
+"""
+بنچمارک: throughput و tail latency کلاینت Gemini روی سرور fake محلی (retry، deadline، circuit breaker).
+
+اجرا:
+    python -m benchmarks.ai_client_load --calls 500 --concurrency 32 --latency-ms 300 --error-rate 0.05 --rate-429 0.05
+    python -m benchmarks.ai_client_load --calls 300 --outage-after 100 --outage-seconds 5   # رفتار breaker
+"""
+from __future__ import annotations
+
+from dotenv import load_dotenv
+load_dotenv()
+
+import argparse
+import asyncio
+import time
+from collections import Counter
+
+from benchmarks.fake_gemini import FakeGemini, add_fake_args, config_from_args
+from config.ai_client import AIError, CircuitBreaker, GeminiClient
+from services.httpserver import HttpServer
+from services.stats import RollingStats
+
+_IMAGE = b"\xff\xd8\xff" + b"\x00" * (200 * 1024)  # ~200KB مثل خروجی preprocess
+
+
+async def run(args: argparse.Namespace) -> None:
+    fake = FakeGemini(config_from_args(args))
+    server = HttpServer(fake.handle)
+    await server.start()
+
+    client = GeminiClient(
+        api_key="local",
+        model="fake-model",
+        base_url=server.url,
+        attempt_timeout=args.attempt_timeout,
+        deadline=args.deadline,
+        max_retries=args.retries,
+        backoff_base=args.backoff_base,
+        backoff_max=5.0,
+        max_connections=args.concurrency,
+        breaker=CircuitBreaker(args.breaker_threshold, args.breaker_reset),
+    )
+
+    latency = RollingStats(args.calls)
+    outcomes: Counter[str] = Counter()
+    sem = asyncio.Semaphore(args.concurrency)
+
+    async def one() -> None:
+        async with sem:
+            # مثل dispatcher: وقتی circuit باز است کار جدید شروع نشود
+            await client.breaker.wait_until_available()
+            t0 = time.perf_counter()
+            try:
+                await client.edit_image([(_IMAGE, "image/jpeg")], "make it blue")
+                outcomes["ok"] += 1
+            except AIError as e:
+                outcomes[type(e).__name__ if e.status is None else f"{type(e).__name__}:{e.status}"] += 1
+            latency.add(time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(args.calls)))
+    elapsed = time.perf_counter() - t0
+
+    await client.close()
+    await server.stop()
+
+    s = latency.summary()
+    print(f"calls={args.calls} concurrency={args.concurrency} elapsed={elapsed:.2f}s -> {args.calls / elapsed:.1f} calls/s")
+    print(f"latency ms: p50={s['p50'] * 1e3:.0f} p95={s['p95'] * 1e3:.0f} p99={s['p99'] * 1e3:.0f} mean={s['mean'] * 1e3:.0f}")
+    print(f"outcomes: {dict(outcomes)}")
+    print(f"client: {client.stats()}")
+    print(f"upstream: requests={fake.requests} errors={fake.errors} max_in_flight={fake.max_in_flight}")
+
+
+def main() -> None:
+    p = argparse.ArgumentParser()
+    p.add_argument("--calls", type=int, default=300)
+    p.add_argument("--concurrency", type=int, default=32)
+    p.add_argument("--attempt-timeout", type=float, default=5.0)
+    p.add_argument("--deadline", type=float, default=20.0)
+    p.add_argument("--retries", type=int, default=3)
+    p.add_argument("--backoff-base", type=float, default=0.2)
+    p.add_argument("--breaker-threshold", type=int, default=5)
+    p.add_argument("--breaker-reset", type=float, default=2.0)
+    add_fake_args(p)
+    p.set_defaults(latency_ms=300.0, jitter_ms=150.0)
+    asyncio.run(run(p.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
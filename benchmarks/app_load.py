@@ -0,0 +1,250 @@
+"""
+بنچمارک بار: Application واقعی main.build_app با Bot API جعلی (بدون شبکه) و هزاران کاربر شبیه‌سازی‌شده.
+
+هر کاربر یک جلسه کامل دارد: /start، دکمه‌های منو، حساب و تاریخچه، مرور تمپلیت‌ها، آلبوم عکس،
+پرامپت و edit:go؛ چند کاربر اول ادمین‌اند (/admin، لیست تمپلیت‌ها، /queue، /set).
+آپدیت‌ها JSON واقعی تلگرام‌اند (Update.de_json) و از app.process_update رد می‌شوند؛
+آپدیت‌های هر کاربر به ترتیب، کاربرها با --concurrency هم‌زمان.
+
+گزارش: آپدیت در ثانیه، صدک‌های latency برای هر مرحله (handler)، statementهای DB و فراخوانی‌های
+Bot API برای هر آپدیت.
+
+اجرا (نیاز به PostgreSQL محلی طبق DATABASE_URL؛ repository از امکانات پستگرس استفاده می‌کند):
+    python -m benchmarks.app_load --users 2000 --concurrency 100 --album 3
+در آخر هر چه این اجرا ساخته پاک می‌شود (کاربرهای bench و همه ردیف‌های وابسته‌شان: jobها تا workerی که به همین
+DB وصل است سراغشان نرود، requestها و timingها، شمارنده‌ها، rate limitها؛ و تمپلیت‌هایی که seed شدند).
+"""
+from __future__ import annotations
+
+from dotenv import load_dotenv
+load_dotenv()
+
+import argparse
+import asyncio
+import logging
+import random
+import time
+from collections import defaultdict
+
+from sqlalchemy import BigInteger, delete, func, select
+from telegram import Update
+from telegram.ext import Application
+
+import main as bot_main
+from config import settings
+from config.database import engine, get_session
+from config.runtime import get_runtime_config
+from db import repository as repo
+from db.models import Base, Job, RateLimitState, Request, RequestTiming, Template, User, UserRequestStats
+from services import ratelimit
+from services.last_seen import get_last_seen_buffer
+from services.outbound import OutboundRateLimiter
+from services.stats import Histogram
+from services.templates import get_template_catalog
+from benchmarks._fakes import TALLY, FakeBotRequest, QueryCounter, Tally, UpdateFactory
+
+BASE_UID = 9_000_000_000
+
+
+def user_script(f: UpdateFactory, uid: int, template_ids: list[int], album: int, rnd: random.Random) -> list[tuple[str, dict]]:
+    steps = [
+        ("start", f.text(uid, "/start")),
+        ("menu:about", f.text(uid, "ℹ️ درباره ما")),
+        ("menu:account", f.text(uid, "👤 حساب کاربری")),
+        ("cb:acc:history", f.callback(uid, "acc:history")),
+        ("cb:acc:back", f.callback(uid, "acc:back")),
+        ("menu:templates", f.text(uid, "🎨 تمپلیت‌ها")),
+    ]
+    if template_ids:
+        tid = rnd.choice(template_ids)
+        steps += [
+            ("cb:tpl:view", f.callback(uid, f"tpl:view:{tid}")),
+            ("cb:tpl:list", f.callback(uid, "tpl:list")),
+            ("cb:tpl:use", f.callback(uid, f"tpl:use:{tid}")),
+        ]
+    steps.append(("menu:edit", f.text(uid, "🧠 ویرایش تصویر")))
+    group = f"album-{uid}" if album > 1 else None
+    steps += [("edit:photo", f.photo(uid, f"bench-{uid}-{i}", group)) for i in range(album)]
+    steps += [
+        ("cb:edit:images:confirm", f.callback(uid, "edit:images:confirm")),
+        ("edit:prompt", f.text(uid, "make it brighter")),
+        ("cb:edit:go", f.callback(uid, "edit:go")),
+    ]
+    return steps
+
+
+def admin_script(f: UpdateFactory, uid: int) -> list[tuple[str, dict]]:
+    return [
+        ("start", f.text(uid, "/start")),
+        ("admin:/admin", f.text(uid, "/admin")),
+        ("admin:cb:tpl:list", f.callback(uid, "adm:tpl:list")),
+        ("admin:/queue", f.text(uid, "/queue")),
+        ("admin:/set", f.text(uid, "/set")),
+    ]
+
+
+class StepStats:
+    __slots__ = ("latency", "statements", "api_calls")
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.statements = 0
+        self.api_calls = 0
+
+
+async def seed_templates(count: int) -> tuple[list[int], list[int]]:
+    """
+    (idهای تمپلیت‌های فعال عمومی، idهایی که همین اجرا ساخت).
+    فقط وقتی جدول تمپلیت خالی است seed می‌شود؛ تمپلیت‌های موجود دست نمی‌خورند.
+    """
+    created: list[int] = []
+    async with get_session() as session:
+        if not await repo.list_all_templates(session):
+            tpls = [
+                await repo.create_template(session, f"bench-{i}", "benchmark template", f"style {i}", None)
+                for i in range(count)
+            ]
+            await session.flush()
+            created = [t.id for t in tpls]
+            await session.commit()
+    get_template_catalog().invalidate()
+    snap = await get_template_catalog().snapshot()
+    return [t.id for t in snap.active_public], created
+
+
+async def cleanup(first_uid: int, last_uid: int, template_ids: list[int] | None = None) -> None:
+    """کاربرهای first_uid..last_uid با همه ردیف‌های وابسته، و تمپلیت‌های seedشده."""
+    async with get_session() as session:
+        request_ids = select(Request.id).where(Request.user_tg_id.between(first_uid, last_uid))
+        await session.execute(delete(RequestTiming).where(RequestTiming.request_id.in_(request_ids)))
+        for model in (Job, Request, UserRequestStats):
+            await session.execute(delete(model).where(model.user_tg_id.between(first_uid, last_uid)))
+        await session.execute(delete(User).where(User.tg_id.between(first_uid, last_uid)))
+        # کلید rate limit: action:tg_id
+        subject = func.substring(RateLimitState.key, r":(\d+)$").cast(BigInteger)
+        await session.execute(delete(RateLimitState).where(subject.between(first_uid, last_uid)))
+        if template_ids:
+            await session.execute(delete(Template).where(Template.id.in_(template_ids)))
+        await session.commit()
+    get_template_catalog().invalidate()
+
+
+async def run(args: argparse.Namespace) -> None:
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    overrides = {"FORCE_JOIN_ENABLED": "false", "FREE_DAILY_EDITS": "1000000"}
+    get_runtime_config().apply(overrides)
+    if not args.ratelimit:
+        # بودجه‌های rate limit کاربر اینجا مد نظر نیستند (همه آپدیت‌ها باید به handler برسند)
+        ratelimit._LIMITER = ratelimit.RateLimiter(ratelimit.MemoryBackend(1), budgets={})
+
+    uids = [BASE_UID + i for i in range(args.users)]
+    admins = uids[: args.admins]
+    settings.ADMIN_IDS.extend(admins)
+    template_ids, seeded = await seed_templates(args.templates)
+
+    fake = FakeBotRequest(latency=args.api_latency_ms / 1000)
+    builder = (
+        Application.builder()
+        .token("123456:bench")
+        .request(fake)
+        .get_updates_request(FakeBotRequest())
+        # مسیر واقعی rate limiter بدون سقف (rate 0)؛ وگرنه throughput همان سقف 30 پیام در ثانیه است
+        .rate_limiter(OutboundRateLimiter(0, 0, 0, max_retries=0))
+    )
+    app = bot_main.build_app(builder)
+
+    errors = 0
+
+    async def on_error(update: object, context) -> None:
+        nonlocal errors
+        errors += 1
+        if errors <= 3:
+            logging.getLogger("app_load").error("handler error", exc_info=context.error)
+
+    app.add_error_handler(on_error)
+
+    rnd = random.Random(args.seed)
+    f = UpdateFactory()
+    scripts = [
+        admin_script(f, uid) if uid in admins else user_script(f, uid, template_ids, args.album, rnd)
+        for uid in uids
+    ]
+    total_updates = sum(len(s) for s in scripts)
+
+    stats: dict[str, StepStats] = defaultdict(StepStats)
+    sem = asyncio.Semaphore(args.concurrency)
+
+    async def simulate(script: list[tuple[str, dict]]) -> None:
+        async with sem:
+            for step, data in script:
+                update = Update.de_json(data, app.bot)
+                tally = Tally()
+                token = TALLY.set(tally)
+                started = time.perf_counter()
+                try:
+                    await app.process_update(update)
+                finally:
+                    elapsed = time.perf_counter() - started
+                    TALLY.reset(token)
+                st = stats[step]
+                st.latency.add(elapsed)
+                st.statements += tally.statements
+                st.api_calls += tally.api_calls
+
+    get_last_seen_buffer().start()
+    async with app:
+        with QueryCounter(engine) as counter:
+            started = time.perf_counter()
+            await asyncio.gather(*(simulate(s) for s in scripts))
+            elapsed = time.perf_counter() - started
+            statements, commits = counter.reset()
+            await get_last_seen_buffer().stop()
+            flush_statements, _ = counter.reset()
+
+    if not args.keep:
+        await cleanup(uids[0], uids[-1], seeded)
+    await engine.dispose()
+
+    print(
+        f"{args.users} users ({len(admins)} admins), concurrency={args.concurrency}, "
+        f"album={args.album}, api latency={args.api_latency_ms:.0f}ms"
+    )
+    print(
+        f"{total_updates} updates in {elapsed:.2f}s -> {total_updates / elapsed:.0f} updates/s | "
+        f"{statements / total_updates:.2f} stmts/update, {commits / total_updates:.2f} commits/update, "
+        f"{sum(fake.calls.values()) / total_updates:.2f} Bot API calls/update | errors={errors}"
+    )
+    print(f"last_seen final flush: {flush_statements} stmts")
+    print()
+    print(f"{'step':<24} {'n':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8} {'stmts/upd':>10} {'api/upd':>8}")
+    for step, st in stats.items():
+        s = st.latency.summary()
+        n = s["n"]
+        print(
+            f"{step:<24} {n:>7} {s['p50'] * 1000:>8.2f} {s['p95'] * 1000:>8.2f} {s['p99'] * 1000:>8.2f} "
+            f"{s['max'] * 1000:>8.2f} {st.statements / n:>10.2f} {st.api_calls / n:>8.2f}"
+        )
+    print()
+    print("Bot API calls: " + ", ".join(f"{k}={v}" for k, v in fake.calls.most_common()))
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--users", type=int, default=2000)
+    p.add_argument("--concurrency", type=int, default=100, help="کاربرهای هم‌زمان (1 یعنی کاملاً ترتیبی)")
+    p.add_argument("--album", type=int, default=3, help="تعداد عکس‌های آلبوم هر کاربر")
+    p.add_argument("--admins", type=int, default=5)
+    p.add_argument("--templates", type=int, default=5, help="اگر جدول تمپلیت خالی است این تعداد ساخته می‌شود")
+    p.add_argument("--api-latency-ms", type=float, default=0.0, help="تأخیر شبیه‌سازی‌شده هر فراخوانی Bot API")
+    p.add_argument("--ratelimit", action="store_true", help="rate limit کاربر طبق تنظیمات فعلی (پیش‌فرض خاموش)")
+    p.add_argument("--keep", action="store_true", help="کاربرها، requestها، jobها و تمپلیت‌های ساخته‌شده پاک نشوند")
+    p.add_argument("--seed", type=int, default=1)
+    args = p.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
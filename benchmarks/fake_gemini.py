@@ -0,0 +1,173 @@
+"""
+سرور fake برای Gemini generateContent؛ برای تست throughput و tail latency بدون شبکه و بدون هزینه.
+
+اجرا:
+    python -m benchmarks.fake_gemini --port 8089 --latency-ms 800 --jitter-ms 400 --error-rate 0.05 --rate-429 0.05
+و بعد در .env:
+    GEMINI_BASE_URL=http://127.0.0.1:8089
+
+پاسخ: اولین عکس ورودی را به عنوان "نتیجه" برمی‌گرداند (همان حجم واقعی).
+--outage-after/--outage-seconds: بعد از N درخواست، یک قطعی کامل (503) برای تست circuit breaker.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import base64
+import json
+import random
+import time
+from dataclasses import dataclass
+
+from services.httpserver import HttpRequest, HttpResponse, HttpServer
+
+# PNG یک پیکسلی برای وقتی که ورودی عکس ندارد
+_PIXEL_PNG = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mP8z8BQDwAEhQGAhKmMIQAAAABJRU5ErkJggg=="
+)
+
+
+@dataclass
+class FakeConfig:
+    latency_ms: float = 800.0
+    jitter_ms: float = 400.0
+    error_rate: float = 0.0  # 500/503
+    rate_429: float = 0.0
+    slow_rate: float = 0.0  # درصد درخواست‌هایی که slow_ms طول می‌کشند (دم توزیع)
+    slow_ms: float = 10_000.0
+    outage_after: int = 0
+    outage_seconds: float = 0.0
+    seed: int | None = None
+
+
+class FakeGemini:
+    def __init__(self, cfg: FakeConfig):
+        self.cfg = cfg
+        self._rnd = random.Random(cfg.seed)
+        self._outage_until = 0.0
+
+        self.requests = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def _error(self, code: int, status: str, retry_after: float | None = None) -> HttpResponse:
+        self.errors += 1
+        body = json.dumps({"error": {"code": code, "message": f"fake {status}", "status": status}}).encode()
+        headers = {"Retry-After": f"{retry_after:.0f}"} if retry_after else {}
+        return HttpResponse(code, body, headers=headers)
+
+    async def handle(self, req: HttpRequest) -> HttpResponse:
+        if req.method != "POST" or not req.path.endswith(":generateContent"):
+            return HttpResponse(404, b'{"error":{"code":404,"message":"not found","status":"NOT_FOUND"}}')
+
+        self.requests += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            return await self._generate(req)
+        finally:
+            self.in_flight -= 1
+
+    async def _generate(self, req: HttpRequest) -> HttpResponse:
+        cfg = self.cfg
+        now = time.monotonic()
+        if cfg.outage_after and self.requests == cfg.outage_after:
+            self._outage_until = now + cfg.outage_seconds
+        if now < self._outage_until:
+            await asyncio.sleep(0.01)
+            return self._error(503, "UNAVAILABLE")
+
+        delay = cfg.slow_ms if self._rnd.random() < cfg.slow_rate else cfg.latency_ms + self._rnd.uniform(-1, 1) * cfg.jitter_ms
+        await asyncio.sleep(max(0.0, delay) / 1000)
+
+        roll = self._rnd.random()
+        if roll < cfg.rate_429:
+            return self._error(429, "RESOURCE_EXHAUSTED", retry_after=1)
+        if roll < cfg.rate_429 + cfg.error_rate:
+            return self._error(self._rnd.choice((500, 503)), "INTERNAL")
+
+        try:
+            payload = json.loads(req.body or b"{}")
+        except ValueError:
+            return self._error(400, "INVALID_ARGUMENT")
+
+        image, mime = _PIXEL_PNG, "image/png"
+        for content in payload.get("contents") or []:
+            for part in content.get("parts") or []:
+                inline = part.get("inlineData") or part.get("inline_data")
+                if inline and inline.get("data"):
+                    # SDK با base64 urlsafe می‌فرستد؛ API هر دو را قبول می‌کند
+                    data = inline["data"].replace("-", "+").replace("_", "/")
+                    image = base64.b64decode(data + "=" * (-len(data) % 4))
+                    mime = inline.get("mimeType") or inline.get("mime_type") or mime
+                    break
+            else:
+                continue
+            break
+
+        body = {
+            "candidates": [{
+                "content": {"role": "model", "parts": [
+                    {"inlineData": {"mimeType": mime, "data": base64.b64encode(image).decode()}},
+                ]},
+                "finishReason": "STOP",
+                "index": 0,
+            }],
+            "usageMetadata": {"promptTokenCount": 258, "candidatesTokenCount": 1290, "totalTokenCount": 1548},
+            "modelVersion": "fake",
+        }
+        return HttpResponse(200, json.dumps(body).encode())
+
+
+async def serve(cfg: FakeConfig, host: str, port: int) -> None:
+    fake = FakeGemini(cfg)
+    server = HttpServer(fake.handle, host, port)
+    await server.start()
+    print(f"fake Gemini on {server.url} (GEMINI_BASE_URL={server.url})")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+
+def config_from_args(args: argparse.Namespace) -> FakeConfig:
+    return FakeConfig(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        rate_429=args.rate_429,
+        slow_rate=args.slow_rate,
+        slow_ms=args.slow_ms,
+        outage_after=args.outage_after,
+        outage_seconds=args.outage_seconds,
+        seed=args.seed,
+    )
+
+
+def add_fake_args(p: argparse.ArgumentParser) -> None:
+    p.add_argument("--latency-ms", type=float, default=800.0)
+    p.add_argument("--jitter-ms", type=float, default=400.0)
+    p.add_argument("--error-rate", type=float, default=0.0, help="سهم پاسخ‌های 500/503")
+    p.add_argument("--rate-429", type=float, default=0.0, help="سهم پاسخ‌های 429")
+    p.add_argument("--slow-rate", type=float, default=0.0, help="سهم درخواست‌های خیلی کند")
+    p.add_argument("--slow-ms", type=float, default=10_000.0)
+    p.add_argument("--outage-after", type=int, default=0, help="بعد از N درخواست قطعی کامل")
+    p.add_argument("--outage-seconds", type=float, default=0.0)
+    p.add_argument("--seed", type=int, default=None)
+
+
+def main() -> None:
+    p = argparse.ArgumentParser()
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8089)
+    add_fake_args(p)
+    args = p.parse_args()
+    try:
+        asyncio.run(serve(config_from_args(args), args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+بنچمارک: throughput پیش‌پردازش عکس به ازای هر هسته (process pool + shared memory).
+
+اجرا:
+    python -m benchmarks.image_throughput --images 48 --workers 1,2,4 --size 4000x3000
+"""
+from __future__ import annotations
+
+from dotenv import load_dotenv
+load_dotenv()
+
+import argparse
+import asyncio
+import io
+import os
+import time
+
+from PIL import Image
+
+from services.imaging import ImageProcessor, PreprocessOptions, preprocess_bytes
+
+
+def _sample_jpeg(width: int, height: int) -> bytes:
+    """عکس مصنوعی با جزئیات (نه رنگ یکدست) و EXIF orientation=6 مثل عکس موبایل."""
+    img = Image.effect_mandelbrot((width, height), (-2.0, -1.5, 1.0, 1.5), 64).convert("RGB")
+    noise = Image.effect_noise((width, height), 40).convert("RGB")
+    img = Image.blend(img, noise, 0.3)
+    exif = Image.Exif()
+    exif[0x0112] = 6
+    buf = io.BytesIO()
+    img.save(buf, "JPEG", quality=92, exif=exif)
+    return buf.getvalue()
+
+
+async def _pool_run(data: bytes, n: int, workers: int, opts: PreprocessOptions) -> float:
+    proc = ImageProcessor(workers, opts)
+    try:
+        # گرم کردن: spawn پروسه‌ها جزو زمان‌گیری نباشد
+        await proc.preprocess_all([data] * workers)
+        t0 = time.perf_counter()
+        await proc.preprocess_all([data] * n)
+        return time.perf_counter() - t0
+    finally:
+        await proc.close()
+
+
+def run(n: int, workers: list[int], width: int, height: int) -> None:
+    data = _sample_jpeg(width, height)
+    print(f"input: {width}x{height} JPEG, {len(data) // 1024} KB, cores={os.cpu_count()}")
+    print(f"{'mode':<22} {'workers':>7} {'img/s':>8} {'img/s/core':>11} {'ms/img':>8}")
+
+    for fast in (True, False):
+        opts = PreprocessOptions(fast_decode=fast)
+        label = "draft+reduce" if fast else "full decode"
+
+        t0 = time.perf_counter()
+        for _ in range(max(1, n // 4)):
+            preprocess_bytes(data, opts)
+        per = (time.perf_counter() - t0) / max(1, n // 4)
+        print(f"{label + ' (inline)':<22} {1:>7} {1 / per:>8.1f} {1 / per:>11.1f} {per * 1e3:>8.1f}")
+
+        for w in workers:
+            elapsed = asyncio.run(_pool_run(data, n, w, opts))
+            rate = n / elapsed
+            print(f"{label + ' (pool)':<22} {w:>7} {rate:>8.1f} {rate / w:>11.1f} {elapsed * 1e3 / n:>8.1f}")
+
+
+def main() -> None:
+    p = argparse.ArgumentParser()
+    p.add_argument("--images", type=int, default=48)
+    p.add_argument("--workers", default="1,2,4", help="لیست تعداد پروسه‌ها، جدا با کاما")
+    p.add_argument("--size", default="4000x3000")
+    args = p.parse_args()
+    width, height = (int(x) for x in args.size.lower().split("x"))
+    run(args.images, [int(w) for w in args.workers.split(",") if w.strip()], width, height)
+
+
+if __name__ == "__main__":
+    main()
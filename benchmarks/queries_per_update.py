@@ -0,0 +1,80 @@
+"""
+بنچمارک: تعداد رفت‌وبرگشت DB برای هر نوع آپدیت.
+
+اجرا (نیاز به PostgreSQL محلی طبق DATABASE_URL):
+    python -m benchmarks.queries_per_update --users 200
+"""
+from __future__ import annotations
+
+from dotenv import load_dotenv
+load_dotenv()
+
+import argparse
+import asyncio
+import time
+
+from config.runtime import get_runtime_config
+from config.database import engine
+from db.models import Base
+from bot import handlers
+from services.last_seen import get_last_seen_buffer
+from services import ratelimit
+from benchmarks._fakes import FakeContext, QueryCounter, text_update, photo_update, callback_update
+
+
+# اسم سناریو -> (سازنده آپدیت، هندلر)
+SCENARIOS = {
+    "start": (lambda uid: text_update(uid, "/start"), handlers.start),
+    "menu:about": (lambda uid: text_update(uid, "ℹ️ درباره ما"), handlers.home_router),
+    "menu:account": (lambda uid: text_update(uid, "👤 حساب کاربری"), handlers.home_router),
+    "menu:templates": (lambda uid: text_update(uid, "🎨 تمپلیت‌ها"), handlers.home_router),
+    "menu:edit": (lambda uid: text_update(uid, "🧠 ویرایش تصویر"), handlers.home_router),
+    "edit:photo": (lambda uid: photo_update(uid, f"file-{uid}"), handlers.edit_wait_images),
+    "edit:prompt": (lambda uid: text_update(uid, "make it brighter"), handlers.edit_wait_prompt),
+    "cb:edit:go": (lambda uid: callback_update(uid, "edit:go"), handlers.callbacks),
+}
+
+
+async def run(users: int) -> None:
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    # چک‌های rate limit/force-join اینجا مد نظر نیستند
+    get_runtime_config().apply({"FORCE_JOIN_ENABLED": "false"})
+    ratelimit._LIMITER = ratelimit.RateLimiter(ratelimit.MemoryBackend(1), budgets={})
+
+    base_uid = 9_000_000_000
+    user_data = {base_uid + i: {} for i in range(users)}
+
+    print(f"{'scenario':<16} {'stmts/update':>13} {'commits/update':>15} {'ms/update':>10}")
+    with QueryCounter(engine) as counter:
+        for name, (make_update, handler) in SCENARIOS.items():
+            counter.reset()
+            t0 = time.perf_counter()
+            for uid, data in user_data.items():
+                if name == "cb:edit:go":
+                    data.setdefault("edit_images", ["file"])
+                    data.setdefault("edit_prompt", "make it brighter")
+                await handler(make_update(uid), FakeContext(data))
+            elapsed = time.perf_counter() - t0
+            stmts, commits = counter.reset()
+            print(f"{name:<16} {stmts / users:>13.2f} {commits / users:>15.2f} {elapsed * 1000 / users:>10.2f}")
+
+        # هزینه write-behind last_seen برای همه آپدیت‌های بالا
+        pending = get_last_seen_buffer().pending()
+        await get_last_seen_buffer().flush()
+        stmts, commits = counter.reset()
+        print(f"last_seen flush: {pending} users -> {stmts} stmts, {commits} commits")
+
+    await engine.dispose()
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--users", type=int, default=200)
+    args = p.parse_args()
+    asyncio.run(run(args.users))
+
+
+if __name__ == "__main__":
+    main()
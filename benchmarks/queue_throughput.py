@@ -0,0 +1,117 @@
+"""
+بنچمارک: throughput صف پایدار (enqueue و claim+ack) وقتی صف عمیق است.
+
+اجرا (نیاز به PostgreSQL محلی):
+    python -m benchmarks.queue_throughput --depth 50000 --jobs 5000 --workers 8 --batch 1
+"""
+from __future__ import annotations
+
+from dotenv import load_dotenv
+load_dotenv()
+
+import argparse
+import asyncio
+import time
+
+from sqlalchemy import delete
+
+from config.database import engine, get_session
+from db import repository as repo
+from db.models import Base, Job
+from services.queue import EditJob, PostgresQueue
+
+# request_idهای مصنوعی؛ جدول jobs به requests کلید خارجی ندارد
+BASE_ID = 2_000_000_000
+
+
+async def _fill(depth: int, start: int) -> None:
+    """پر کردن صف تا عمق موردنظر با insertهای دسته‌ای (خارج از زمان‌گیری)."""
+    chunk = 5000
+    for off in range(0, depth, chunk):
+        async with get_session() as session:
+            session.add_all([
+                Job(
+                    request_id=start + i,
+                    user_tg_id=i % 1000,
+                    chat_id=i % 1000,
+                    payload={"image_file_ids": ["x"], "prompt": "bench"},
+                    status="ready",
+                    attempts=0,
+                )
+                for i in range(off, min(depth, off + chunk))
+            ])
+            await session.commit()
+
+
+async def _enqueue(q: PostgresQueue, n: int, start: int) -> float:
+    t0 = time.perf_counter()
+    for i in range(n):
+        await q.put(EditJob(
+            request_id=start + i,
+            user_tg_id=i % 1000,
+            chat_id=i % 1000,
+            image_file_ids=["x"],
+            prompt="bench",
+        ))
+    return time.perf_counter() - t0
+
+
+async def _drain(q: PostgresQueue, n: int, workers: int, batch: int) -> float:
+    left = n
+
+    async def worker() -> None:
+        nonlocal left
+        while left > 0:
+            jobs = await q.claim(batch)
+            if not jobs:
+                return
+            left -= len(jobs)
+            for job in jobs:
+                await q.ack(job)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(workers)))
+    return time.perf_counter() - t0
+
+
+async def run(depth: int, jobs: int, workers: int, batch: int) -> None:
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    async with get_session() as session:
+        await session.execute(delete(Job).where(Job.request_id >= BASE_ID))
+        await session.commit()
+
+    q = PostgresQueue(lease_seconds=60, max_attempts=3, backoff_seconds=1, poll_seconds=1)
+    try:
+        await _fill(depth, BASE_ID)
+
+        enq = await _enqueue(q, jobs, BASE_ID + depth)
+        drain = await _drain(q, jobs, workers, batch)
+
+        async with get_session() as session:
+            remaining = await repo.count_jobs(session)
+
+        print(f"depth={depth} jobs={jobs} workers={workers} batch={batch}")
+        print(f"{'enqueue':<10} {jobs / enq:>10.0f} jobs/s {enq * 1e3 / jobs:>8.2f} ms/job")
+        print(f"{'claim+ack':<10} {jobs / drain:>10.0f} jobs/s {drain * 1e3 / jobs * workers:>8.2f} ms/job/worker")
+        print(f"depth after: {remaining}")
+    finally:
+        async with get_session() as session:
+            await session.execute(delete(Job).where(Job.request_id >= BASE_ID))
+            await session.commit()
+        await engine.dispose()
+
+
+def main() -> None:
+    p = argparse.ArgumentParser()
+    p.add_argument("--depth", type=int, default=50_000, help="jobهای آماده‌ای که از قبل در صف هستند")
+    p.add_argument("--jobs", type=int, default=5_000)
+    p.add_argument("--workers", type=int, default=8)
+    p.add_argument("--batch", type=int, default=1, help="تعداد job در هر claim")
+    args = p.parse_args()
+    asyncio.run(run(args.depth, args.jobs, args.workers, args.batch))
+
+
+if __name__ == "__main__":
+    main()
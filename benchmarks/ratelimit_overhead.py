@@ -0,0 +1,63 @@
+"""
+بنچمارک: هزینه هر چک rate limiter.
+
+اجرا:
+    python -m benchmarks.ratelimit_overhead --checks 200000 --users 10000
+    python -m benchmarks.ratelimit_overhead --postgres --checks 2000   # نیاز به PostgreSQL محلی
+"""
+from __future__ import annotations
+
+from dotenv import load_dotenv
+load_dotenv()
+
+import argparse
+import asyncio
+import random
+import time
+
+from services.ratelimit import (
+    Budget, MemoryBackend, PostgresBackend, RateLimiter,
+    TOKEN_BUCKET, SLIDING_WINDOW, ACTION_MENU,
+)
+
+
+async def _bench(limiter: RateLimiter, checks: int, users: int) -> tuple[float, int]:
+    rnd = random.Random(1)
+    subjects = [rnd.randrange(users) for _ in range(checks)]
+    t0 = time.perf_counter()
+    for uid in subjects:
+        await limiter.hit(ACTION_MENU, uid)
+    return time.perf_counter() - t0, limiter.denied
+
+
+async def run(checks: int, users: int, postgres: bool) -> None:
+    if postgres:
+        from config.database import engine
+        from db.models import Base
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+    print(f"{'backend':<10} {'algorithm':<15} {'us/check':>10} {'denied':>8}")
+    for algo in (TOKEN_BUCKET, SLIDING_WINDOW):
+        budget = Budget(limit=5, window=10, algorithm=algo)
+        backend = PostgresBackend(budget.window) if postgres else MemoryBackend(max_keys=users)
+        limiter = RateLimiter(backend, {ACTION_MENU: budget})
+        elapsed, denied = await _bench(limiter, checks, users)
+        name = "postgres" if postgres else "memory"
+        print(f"{name:<10} {algo:<15} {elapsed * 1e6 / checks:>10.2f} {denied:>8}")
+
+    if postgres:
+        await engine.dispose()
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--checks", type=int, default=200_000)
+    p.add_argument("--users", type=int, default=10_000)
+    p.add_argument("--postgres", action="store_true")
+    args = p.parse_args()
+    asyncio.run(run(args.checks, args.users, args.postgres))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+"""
+بنچمارک ورودی: polling (پردازش ترتیبی) در برابر webhook (هم‌زمان، ترتیبی برای هر کاربر) با تلگرام جعلی محلی.
+
+هر دو حالت Application واقعی main.build_app را با Bot API جعلی اجرا می‌کنند و همان جریان آپدیت
+(جلسه کامل هر کاربر از benchmarks.app_load، آپدیت‌های کاربرها در هم) را می‌گیرند:
+- polling: getUpdates جعلی با offset/limit، همان Updater خود PTB
+- webhook: services.webhook.WebhookIngress روی پورت محلی؛ فرستنده جعلی مثل تلگرام با --connections
+  کانکشن POST می‌کند (آپدیت‌های هر کاربر روی یک کانکشن و به ترتیب) و 503 را بعداً دوباره می‌فرستد
+
+--rate 0 یعنی همه آپدیت‌ها یک‌جا (burst)؛ وگرنه نرخ ورود ثابت (آپدیت در ثانیه).
+latency = از لحظه رسیدن آپدیت (زمان برنامه‌ریزی‌شده) تا پایان handlerهایش.
+--api-latency-ms رفت‌وبرگشت هر فراخوانی Bot API است؛ همان چیزی که پردازش ترتیبی را کند می‌کند.
+
+اجرا (نیاز به PostgreSQL محلی طبق DATABASE_URL):
+    python -m benchmarks.webhook_vs_polling --users 500 --api-latency-ms 50 --concurrency 32
+"""
+from __future__ import annotations
+
+from dotenv import load_dotenv
+load_dotenv()
+
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time
+from dataclasses import dataclass, field
+
+from telegram import Update
+from telegram.ext import Application, TypeHandler
+
+import main as bot_main
+from config.database import engine
+from config.runtime import get_runtime_config
+from db.models import Base
+from services import ratelimit
+from services.outbound import OutboundRateLimiter
+from services.stats import Histogram
+from services.webhook import SECRET_HEADER, PerUserUpdateProcessor, WebhookIngress
+from benchmarks._fakes import FakeBotRequest, FakeUpdateFeed, UpdateFactory
+from benchmarks.app_load import BASE_UID, cleanup, seed_templates, user_script
+
+SECRET = "bench-secret"
+
+
+def interleaved_updates(first_uid: int, users: int, template_ids: list[int], album: int, seed: int) -> list[dict]:
+    """جلسه‌های کاربرها در هم (قدم i همه، بعد قدم i+1) با update_idهای پشت‌سرهم از 1."""
+    f = UpdateFactory()
+    rnd = random.Random(seed)
+    scripts = [[data for _, data in user_script(f, first_uid + i, template_ids, album, rnd)] for i in range(users)]
+    out: list[dict] = []
+    for step in range(max(len(s) for s in scripts)):
+        out += [s[step] for s in scripts if step < len(s)]
+    for i, data in enumerate(out, start=1):
+        data["update_id"] = i
+    return out
+
+
+@dataclass
+class Tracker:
+    """group=1 بعد از conv اجرا می‌شود: زمان پایان هر آپدیت."""
+
+    total: int
+    rate: float
+    t0: float = 0.0
+    latency: Histogram = field(default_factory=Histogram)
+    done: asyncio.Event = field(default_factory=asyncio.Event)
+    finished_at: float = 0.0
+    count: int = 0
+    errors: int = 0
+
+    def scheduled(self, update_id: int) -> float:
+        return self.t0 + ((update_id - 1) / self.rate if self.rate > 0 else 0.0)
+
+    def visible(self) -> int:
+        if self.rate <= 0:
+            return self.total
+        return min(self.total, int((time.perf_counter() - self.t0) * self.rate) + 1)
+
+    async def on_update(self, update: Update, context) -> None:
+        now = time.perf_counter()
+        self.latency.add(max(0.0, now - self.scheduled(update.update_id)))
+        self.count += 1
+        if self.count >= self.total:
+            self.finished_at = now
+            self.done.set()
+
+    async def on_error(self, update: object, context) -> None:
+        self.errors += 1
+        if self.errors <= 3:
+            logging.getLogger("webhook_vs_polling").error("handler error", exc_info=context.error)
+
+
+class FakeTelegramConnection:
+    """
+    یک کانکشن keep-alive فرستنده جعلی (مثل کانکشن‌های تلگرام به webhook).
+    httpx عمداً نه: هزینه CPU کلاینتش در همین پروسه از خود ingress بیشتر می‌شد و عدد را خراب می‌کرد.
+    """
+
+    def __init__(self, host: str, port: int, path: str):
+        self.host, self.port, self.path = host, port, path
+        self._reader: asyncio.StreamReader | None = None
+        self._writer: asyncio.StreamWriter | None = None
+
+    async def post(self, payload: dict) -> int:
+        if self._writer is None:
+            self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        body = json.dumps(payload).encode()
+        head = (
+            f"POST {self.path} HTTP/1.1\r\nHost: {self.host}\r\nContent-Type: application/json\r\n"
+            f"{SECRET_HEADER}: {SECRET}\r\nContent-Length: {len(body)}\r\n\r\n"
+        )
+        self._writer.write(head.encode() + body)
+        status = int((await self._reader.readline()).split()[1])
+        length = 0
+        while (line := await self._reader.readline()) not in (b"\r\n", b""):
+            name, _, value = line.decode("latin-1").partition(":")
+            if name.strip().lower() == "content-length":
+                length = int(value)
+        if length:
+            await self._reader.readexactly(length)
+        return status
+
+    async def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+def _builder(api_latency: float) -> tuple:
+    fake = FakeBotRequest(latency=api_latency)
+    builder = (
+        Application.builder()
+        .token("123456:bench")
+        .request(fake)
+        # مسیر واقعی rate limiter بدون سقف؛ سقف 30 پیام در ثانیه هر دو حالت را یکسان می‌بُرد
+        .rate_limiter(OutboundRateLimiter(0, 0, 0, max_retries=0))
+    )
+    return builder, fake
+
+
+def _app(builder, tracker: Tracker) -> Application:
+    app = bot_main.build_app(builder)
+    app.add_handler(TypeHandler(Update, tracker.on_update), group=1)
+    app.add_error_handler(tracker.on_error)
+    return app
+
+
+async def run_polling(updates: list[dict], args: argparse.Namespace) -> dict:
+    tracker = Tracker(len(updates), args.rate)
+    builder, fake = _builder(args.api_latency_ms / 1000)
+    feed = FakeUpdateFeed(updates, latency=args.api_latency_ms / 1000, visible=tracker.visible)
+    app = _app(builder.get_updates_request(feed), tracker)
+
+    async with app:
+        tracker.t0 = time.perf_counter()
+        await app.updater.start_polling(poll_interval=0, timeout=0)
+        await app.start()
+        await tracker.done.wait()
+        await app.updater.stop()
+        await app.stop()
+    return {"tracker": tracker, "api_calls": sum(fake.calls.values()) - fake.calls["getUpdates"], "getUpdates": feed.calls["getUpdates"]}
+
+
+async def run_webhook(updates: list[dict], args: argparse.Namespace) -> dict:
+    tracker = Tracker(len(updates), args.rate)
+    builder, fake = _builder(args.api_latency_ms / 1000)
+    processor = PerUserUpdateProcessor(args.concurrency, args.max_in_flight)
+    app = _app(builder.concurrent_updates(processor).updater(None), tracker)
+    ingress = WebhookIngress(app, "https://bench.invalid/telegram", "127.0.0.1", 0, secret=SECRET,
+                             max_connections=args.connections)
+
+    # هر کاربر روی یک کانکشن ثابت: ترتیب آپدیت‌های هر کاربر حفظ می‌شود
+    lanes: list[list[dict]] = [[] for _ in range(args.connections)]
+    for data in updates:
+        uid = (data.get("message") or data.get("callback_query"))["from"]["id"]
+        lanes[uid % args.connections].append(data)
+
+    ack = Histogram()
+    retries = 0
+
+    async def connection(lane: list[dict]) -> None:
+        nonlocal retries
+        conn = FakeTelegramConnection("127.0.0.1", ingress.port, ingress.path)
+        try:
+            for data in lane:
+                delay = tracker.scheduled(data["update_id"]) - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                while True:
+                    started = time.perf_counter()
+                    status = await conn.post(data)
+                    ack.add(time.perf_counter() - started)
+                    if status == 200:
+                        break
+                    # 503 (سقف in-flight): تلگرام هم بعداً دوباره می‌فرستد
+                    retries += 1
+                    await asyncio.sleep(0.1)
+        finally:
+            await conn.close()
+
+    async with app:
+        await app.start()
+        await ingress.start()
+        tracker.t0 = time.perf_counter()
+        await asyncio.gather(*(connection(lane) for lane in lanes if lane))
+        await tracker.done.wait()
+        await ingress.stop()
+        await app.stop()
+    return {"tracker": tracker, "api_calls": sum(fake.calls.values()), "ack": ack.summary(), "retries": retries}
+
+
+def _report(name: str, result: dict) -> None:
+    t: Tracker = result["tracker"]
+    elapsed = t.finished_at - t.t0
+    lat = t.latency.summary()
+    print(
+        f"{name:<8} {t.total / elapsed:>9.0f} upd/s  {elapsed:>7.2f}s  latency p50={lat['p50'] * 1000:.0f}ms "
+        f"p95={lat['p95'] * 1000:.0f}ms p99={lat['p99'] * 1000:.0f}ms max={lat['max'] * 1000:.0f}ms  errors={t.errors}"
+    )
+    if "ack" in result:
+        a = result["ack"]
+        print(f"{'':<8} webhook ack p50={a['p50'] * 1000:.1f}ms p99={a['p99'] * 1000:.1f}ms, 503 retries={result['retries']}")
+    if "getUpdates" in result:
+        print(f"{'':<8} getUpdates calls={result['getUpdates']}")
+
+
+async def run(args: argparse.Namespace) -> None:
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    get_runtime_config().apply({"FORCE_JOIN_ENABLED": "false", "FREE_DAILY_EDITS": "1000000"})
+    # همه آپدیت‌ها باید به handler برسند
+    ratelimit._LIMITER = ratelimit.RateLimiter(ratelimit.MemoryBackend(1), budgets={})
+    template_ids, seeded = await seed_templates(args.templates)
+
+    # هر حالت کاربرهای تازه خودش را دارد (کش کاربر و state دیتابیس یکسان شروع می‌شود)
+    polling_uid, webhook_uid = BASE_UID, BASE_UID + args.users
+    results = {}
+    if args.mode in ("both", "polling"):
+        updates = interleaved_updates(polling_uid, args.users, template_ids, args.album, args.seed)
+        results["polling"] = await run_polling(updates, args)
+    if args.mode in ("both", "webhook"):
+        updates = interleaved_updates(webhook_uid, args.users, template_ids, args.album, args.seed)
+        results["webhook"] = await run_webhook(updates, args)
+
+    if not args.keep:
+        await cleanup(polling_uid, webhook_uid + args.users - 1, seeded)
+    await engine.dispose()
+
+    total = next(iter(results.values()))["tracker"].total
+    print(
+        f"{args.users} users, {total} updates, rate={'burst' if args.rate <= 0 else f'{args.rate:.0f}/s'}, "
+        f"api latency={args.api_latency_ms:.0f}ms, webhook concurrency={args.concurrency} "
+        f"in-flight<={args.max_in_flight} connections={args.connections}"
+    )
+    for name, result in results.items():
+        _report(name, result)
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--mode", choices=("both", "polling", "webhook"), default="both")
+    p.add_argument("--users", type=int, default=500)
+    p.add_argument("--album", type=int, default=3)
+    p.add_argument("--templates", type=int, default=5)
+    p.add_argument("--rate", type=float, default=0.0, help="آپدیت در ثانیه؛ 0 = burst")
+    p.add_argument("--api-latency-ms", type=float, default=50.0)
+    p.add_argument("--concurrency", type=int, default=32, help="handler هم‌زمان در حالت webhook")
+    p.add_argument("--max-in-flight", type=int, default=256)
+    p.add_argument("--connections", type=int, default=40, help="کانکشن‌های هم‌زمان فرستنده (max_connections تلگرام)")
+    p.add_argument("--keep", action="store_true")
+    p.add_argument("--seed", type=int, default=1)
+    args = p.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,17 @@
 from __future__ import annotations
 
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 
 from telegram import Update
+from telegram.error import BadRequest
 from telegram.ext import ContextTypes
 
-from config import settings
+from config import settings, runtime
 from config.database import get_session
+from config.runtime import get_runtime_config
 from bot.states import States
 from bot.keyboards import (
     HOME_KB,
-    templates_inline_kb,
     template_preview_kb,
     admin_kb,
     admin_templates_manage_kb,
@@ -19,40 +20,55 @@ from bot.keyboards import (
     edit_prompt_kb,
     edit_final_confirm_kb,
     account_kb,
+    history_kb,
 )
 from bot.middlewares import (
     ensure_user,
+    get_user_flags,
     is_banned,
-    check_cooldown,
+    check_rate_limit,
     check_force_join,
     check_daily_quota,
-    consume_edit,
+    QUOTA_EXHAUSTED_TEXT,
 )
 from db import repository as repo
-from services.queue import enqueue_request
+from services import profiler
+from services.queue import enqueue_request, get_queue, QueueFull
+from services.ratelimit import ACTION_MENU, ACTION_UPLOAD, ACTION_SUBMIT
+from services.membership import get_membership_cache
+from services.templates import get_template_catalog
+from services.worker import FAILED_TEXT, deliver_cached_result, estimate_wait_seconds, lookup_cached_result
 
 
 def _is_admin(uid: int) -> bool:
     return uid in settings.ADMIN_IDS
 
 
-def _ts_to_date(ts: int | None) -> str:
+def _ts_to_date(ts: datetime | None) -> str:
     if not ts:
         return "-"
-    return datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M")
+    return ts.strftime("%Y-%m-%d %H:%M")
 
 
-def _get_photo_file_id(update: Update) -> str | None:
+def _fmt_eta(seconds: float) -> str:
+    if seconds < 60:
+        return f"{max(1, round(seconds))} ثانیه"
+    return f"{round(seconds / 60)} دقیقه"
+
+
+def _get_photo_file(update: Update) -> tuple[str, str] | None:
+    """(file_id, file_unique_id) عکس پیام؛ file_unique_id برای کش دانلود است."""
     msg = update.effective_message
     if not msg:
         return None
 
     if getattr(msg, "photo", None):
-        return msg.photo[-1].file_id
+        photo = msg.photo[-1]
+        return photo.file_id, photo.file_unique_id
 
     doc = getattr(msg, "document", None)
     if doc and (doc.mime_type or "").startswith("image/"):
-        return doc.file_id
+        return doc.file_id, doc.file_unique_id
 
     return None
 
@@ -61,9 +77,9 @@ def _get_photo_file_id(update: Update) -> str | None:
 # /start + Home
 # -------------------------
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await ensure_user(update)
+    await ensure_user(update, context)
 
-    if await is_banned(update):
+    if await is_banned(update, context):
         await update.effective_message.reply_text("⛔️ دسترسی شما مسدود شده.")
         return States.HOME
 
@@ -72,13 +88,13 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def home_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await ensure_user(update)
+    await ensure_user(update, context)
 
-    if await is_banned(update):
+    if await is_banned(update, context):
         await update.effective_message.reply_text("⛔️ دسترسی شما مسدود شده.")
         return States.HOME
 
-    if not await check_cooldown(update, context):
+    if not await check_rate_limit(update, context, ACTION_MENU):
         return States.HOME
 
     text = (update.effective_message.text or "").strip()
@@ -109,21 +125,20 @@ async def show_account(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return States.HOME
 
     async with get_session() as session:
-        user = await repo.get_user_by_tg(session, u.id)
-        if not user:
-            await update.effective_message.reply_text("یه مشکلی پیش اومد. دوباره /start بزن.", reply_markup=HOME_KB)
-            return States.HOME
+        row = await repo.get_user_with_stats(session, u.id)
 
-        await repo.ensure_daily_reset(session, user)
-        total_reqs = await repo.count_requests_for_user(session, u.id)
-        await session.commit()
+    if not row:
+        await update.effective_message.reply_text("یه مشکلی پیش اومد. دوباره /start بزن.", reply_markup=HOME_KB)
+        return States.HOME
+
+    user, stats = row
 
-        is_vip = bool(user.is_vip)
-        used = int(user.daily_used or 0)
-        free = int(settings.FREE_DAILY_EDITS)
-        remaining = "نامحدود" if is_vip else max(0, free - used)
+    is_vip = bool(user.is_vip)
+    used = repo.daily_used_today(user)
+    free = int(runtime.current().FREE_DAILY_EDITS)
+    remaining = "نامحدود" if is_vip else max(0, free - used)
 
-        lang = (user.lang or "fa").lower()
+    lang = (user.lang or "fa").lower()
 
     text = (
         f"👤 حساب کاربری\n\n"
@@ -131,16 +146,100 @@ async def show_account(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"🔖 Username: @{u.username if u.username else '-'}\n"
         f"💎 VIP: {'✅ فعال' if is_vip else '❌ غیرفعال'}\n"
         f"📆 سهمیه امروز: {used}/{free} | باقی‌مانده: {remaining}\n"
-        f"📦 تعداد کل درخواست‌ها: {total_reqs}\n"
+        f"📦 تعداد کل درخواست‌ها: {stats.total if stats else 0}"
+        f" (✅ {stats.success if stats else 0} | ❌ {stats.fail if stats else 0})\n"
+        f"🕒 آخرین درخواست: {_ts_to_date(stats.last_request_at if stats else None)}\n"
         f"🌐 زبان: {lang}\n"
-        f"🕒 اولین ورود: {_ts_to_date(getattr(user, 'first_seen', None))}\n"
-        f"🕒 آخرین فعالیت: {_ts_to_date(getattr(user, 'last_seen', None))}\n"
+        f"🕒 اولین ورود: {_ts_to_date(user.first_seen)}\n"
+        f"🕒 آخرین فعالیت: {_ts_to_date(user.last_seen)}\n"
     )
 
     await update.effective_message.reply_text(text, reply_markup=account_kb(lang))
     return States.HOME
 
 
+# -------------------------
+# User: History (keyset pagination)
+# -------------------------
+HISTORY_PAGE_SIZE = 8
+_HISTORY_STATUS = {"a": None, "s": "success", "f": "fail", "q": "queued"}
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def _encode_cursor(r) -> str:
+    us = (r.created_at - _EPOCH) // timedelta(microseconds=1)
+    return f"{_b36(us)}.{_b36(r.id)}"
+
+
+def _decode_cursor(raw: str) -> tuple[datetime, int] | None:
+    try:
+        us, rid = raw.split(".")
+        return _EPOCH + timedelta(microseconds=int(us, 36)), int(rid, 36)
+    except ValueError:
+        return None
+
+
+def _b36(n: int) -> str:
+    digits = "0123456789abcdefghijklmnopqrstuvwxyz"
+    out = ""
+    while True:
+        n, r = divmod(n, 36)
+        out = digits[r] + out
+        if n == 0:
+            return out
+
+
+async def _show_history_page(q, user_tg_id: int, data: str):
+    """
+    acc:history           -> صفحه اول (پیام جدید)
+    acc:h:<f>             -> صفحه اول با فیلتر
+    acc:h:<f>:<o|n>:<c>   -> صفحه قبل/بعد از cursor
+    """
+    parts = data.split(":")
+    flt = parts[2] if len(parts) > 2 and parts[2] in _HISTORY_STATUS else "a"
+    newer = len(parts) > 3 and parts[3] == "n"
+    cursor = _decode_cursor(parts[4]) if len(parts) > 4 else None
+
+    async with get_session() as session:
+        rows, has_more = await repo.list_requests_page(
+            session,
+            user_tg_id,
+            cursor=cursor,
+            newer=newer,
+            status=_HISTORY_STATUS[flt],
+            limit=HISTORY_PAGE_SIZE,
+        )
+
+    if not rows and cursor is None and flt == "a":
+        await q.message.reply_text("فعلاً هیچ درخواستی ثبت نکردی.", reply_markup=HOME_KB)
+        return States.HOME
+
+    # جدیدتر: اگه از صفحه‌ای قدیمی‌تر اومدیم یا در جهت جدیدتر باز هم هست
+    has_newer = (newer and has_more) or (not newer and cursor is not None)
+    has_older = (not newer and has_more) or (newer and cursor is not None)
+
+    lines = [
+        f"#{r.id} | {r.status} | {r.images_count} عکس | {_ts_to_date(r.created_at)}"
+        for r in rows
+    ] or ["(خالی)"]
+    kb = history_kb(
+        flt,
+        older_cursor=_encode_cursor(rows[-1]) if rows and has_older else None,
+        newer_cursor=_encode_cursor(rows[0]) if rows and has_newer else None,
+    )
+    text = "🧾 تاریخچه درخواست‌ها:\n" + "\n".join(lines)
+
+    if data == "acc:history":
+        await q.message.reply_text(text, reply_markup=kb)
+    else:
+        try:
+            await q.message.edit_text(text, reply_markup=kb)
+        except BadRequest:
+            # مثلاً زدن دوباره همون فیلتر: "message is not modified"
+            pass
+    return States.HOME
+
+
 # -------------------------
 # User: Templates
 # -------------------------
@@ -149,17 +248,17 @@ async def show_templates(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not u:
         return States.HOME
 
-    async with get_session() as session:
-        user = await repo.get_user_by_tg(session, u.id)
-        is_vip = bool(user and user.is_vip)
-        tpls = await repo.list_active_templates(session, for_vip=is_vip)
+    user = await get_user_flags(update, context)
+    is_vip = bool(user and user.is_vip)
+
+    catalog = await get_template_catalog().snapshot()
+    kb = catalog.keyboard(for_vip=is_vip)
 
-    if not tpls:
+    if kb is None:
         await update.effective_message.reply_text("فعلاً هیچ تمپلیتی نداریم. ادمین باید اضافه کنه.", reply_markup=HOME_KB)
         return States.HOME
 
-    items = [(t.id, t.title) for t in tpls]
-    await update.effective_message.reply_text("یکی از تمپلیت‌ها رو انتخاب کن:", reply_markup=templates_inline_kb(items))
+    await update.effective_message.reply_text("یکی از تمپلیت‌ها رو انتخاب کن:", reply_markup=kb)
     return States.HOME
 
 
@@ -170,13 +269,14 @@ async def edit_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await check_force_join(update, context):
         return States.HOME
 
-    if not await check_daily_quota(update):
+    if not await check_daily_quota(update, context):
         return States.HOME
 
     context.user_data["edit_images"] = []
+    context.user_data["edit_image_uids"] = []
     context.user_data["edit_prompt"] = None
 
-    max_images = settings.MAX_IMAGES
+    max_images = runtime.current().MAX_IMAGES
     await update.effective_message.reply_text(
         f"📸 عکس(ها) رو بفرست (می‌تونی چندتا بفرستی، حداکثر {max_images} تا).\n"
         f"بعدش روی «✅ تایید عکس‌ها» بزن.",
@@ -186,34 +286,37 @@ async def edit_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def edit_wait_images(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await ensure_user(update)
+    await ensure_user(update, context)
 
-    if await is_banned(update):
+    if await is_banned(update, context):
         await update.effective_message.reply_text("⛔️ دسترسی شما مسدود شده.")
         return States.HOME
 
-    if not await check_cooldown(update, context):
+    if not await check_rate_limit(update, context, ACTION_UPLOAD):
         return States.EDIT_WAIT_IMAGES
 
-    file_id = _get_photo_file_id(update)
-    if not file_id:
+    photo = _get_photo_file(update)
+    if not photo:
         await update.effective_message.reply_text("فقط عکس بفرست (photo یا document تصویر).", reply_markup=edit_images_kb())
         return States.EDIT_WAIT_IMAGES
 
+    max_images = runtime.current().MAX_IMAGES
     images: list[str] = context.user_data.get("edit_images", [])
-    if len(images) >= settings.MAX_IMAGES:
+    if len(images) >= max_images:
         await update.effective_message.reply_text(
-            f"🚫 بیشتر از {settings.MAX_IMAGES} تا نمی‌شه.\n"
+            f"🚫 بیشتر از {max_images} تا نمی‌شه.\n"
             "روی «✅ تایید عکس‌ها» بزن یا «🗑 پاک کردن عکس‌ها».",
             reply_markup=edit_images_kb(),
         )
         return States.EDIT_WAIT_IMAGES
 
+    file_id, file_unique_id = photo
     images.append(file_id)
     context.user_data["edit_images"] = images
+    context.user_data.setdefault("edit_image_uids", []).append(file_unique_id)
 
     await update.effective_message.reply_text(
-        f"✅ عکس ثبت شد. ({len(images)}/{settings.MAX_IMAGES})\n"
+        f"✅ عکس ثبت شد. ({len(images)}/{max_images})\n"
         "می‌تونی عکس دیگه هم بفرستی یا تایید کنی.",
         reply_markup=edit_images_kb(),
     )
@@ -221,13 +324,13 @@ async def edit_wait_images(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def edit_wait_prompt(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await ensure_user(update)
+    await ensure_user(update, context)
 
-    if await is_banned(update):
+    if await is_banned(update, context):
         await update.effective_message.reply_text("⛔️ دسترسی شما مسدود شده.")
         return States.HOME
 
-    if not await check_cooldown(update, context):
+    if not await check_rate_limit(update, context, ACTION_MENU):
         return States.EDIT_WAIT_PROMPT
 
     prompt = (update.effective_message.text or "").strip()
@@ -254,6 +357,138 @@ async def admin_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.effective_message.reply_text("پنل ادمین:", reply_markup=admin_kb())
 
 
+async def setting_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/set KEY VALUE — تغییر تنظیمات runtime بدون ری‌استارت (بدون آرگومان: نمایش فعلی)."""
+    if not update.effective_user or not _is_admin(update.effective_user.id):
+        await update.effective_message.reply_text("ادمین نیستی.")
+        return
+
+    args = context.args or []
+    if len(args) < 2:
+        rt = runtime.current()
+        lines = [f"{key} = {getattr(rt, key)}" for key in runtime.TUNABLES]
+        await update.effective_message.reply_text(
+            f"⚙️ تنظیمات فعلی (v{rt.version}):\n" + "\n".join(lines) + "\n\nتغییر: /set KEY VALUE"
+        )
+        return
+
+    key = args[0].upper()
+    value = " ".join(args[1:])
+    if key not in runtime.TUNABLES or not runtime.parse_overrides({key: value}):
+        await update.effective_message.reply_text("❌ کلید یا مقدار نامعتبر.")
+        return
+
+    async with get_session() as session:
+        await repo.set_setting(session, key, value)
+        await session.commit()
+
+    rt = await get_runtime_config().reload()
+    await update.effective_message.reply_text(f"✅ {key} = {getattr(rt, key)} (v{rt.version})")
+
+
+async def queue_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/queue — وضعیت صف و worker pool."""
+    if not update.effective_user or not _is_admin(update.effective_user.id):
+        await update.effective_message.reply_text("ادمین نیستی.")
+        return
+
+    queue = get_queue()
+    depth = await queue.depth()
+    lanes_depth = await queue.depth_by_lane()
+    depth_line = f"📦 صف: {depth} (" + ", ".join(f"{lane}={n}" for lane, n in lanes_depth.items()) + ")"
+    uc = repo.user_cache_stats()
+    cache_line = (
+        f"🗂 کش کاربر: {uc['hits']} hit / {uc['misses']} miss، {uc['size']}/{uc['maxsize']} "
+        f"(حذف: {uc['evictions']} LRU، {uc['expirations']} TTL)"
+    )
+
+    pool = context.application.bot_data.get("worker_pool")
+    if not pool:
+        # workerها پروسه جدا هستند: زمان مرحله‌ها از request_timings (همه پروسه‌ها)
+        async with get_session() as session:
+            pct = await repo.request_timing_percentiles(session)
+        lines = [depth_line, cache_line, "⚠️ worker pool در این پروسه اجرا نمی‌شود.", "⏱ مرحله‌ها (آخرین 1000، ms):"]
+        lines += [f"• {col[:-3]}: p50={p50:.0f} p95={p95:.0f} p99={p99:.0f}" for col, (p50, p95, p99) in pct.items()]
+        await update.effective_message.reply_text("\n".join(lines))
+        return
+
+    st = pool.stats()
+    wait = st["queue_wait"]
+    lines = [
+        depth_line,
+        cache_line,
+        f"👷 workerها: {st['active']} فعال / {st['idle']} بیکار (از {st['workers']})",
+        f"👤 کاربران در حال اجرا: {st['users_in_flight']}",
+        f"✅ {st['processed']}  ❌ {st['failed']}",
+        f"⏱ انتظار در صف (آخرین {wait['n']}): "
+        f"p50={wait['p50']:.1f}s p95={wait['p95']:.1f}s p99={wait['p99']:.1f}s",
+    ]
+    for lane, ls in st["lanes"].items():
+        w = ls["wait"]
+        lines.append(
+            f"• {lane}: p50={w['p50']:.1f}s p95={w['p95']:.1f}s "
+            f"SLO {ls['slo']:.0f}s → {ls['within_slo'] * 100:.0f}% (نقض: {ls['breaches']})"
+        )
+    lines.append("⏱ مرحله‌ها (این پروسه):")
+    for stage, h in st["stages"].items():
+        if h["n"]:
+            lines.append(f"• {stage}: p50={h['p50']:.2f}s p95={h['p95']:.2f}s p99={h['p99']:.2f}s (n={h['n']})")
+    ai = st["ai"]
+    lines.append(
+        f"🤖 مدل: {ai['calls']} فراخوانی، {ai['retries']} retry، {ai['failures']} خطا | "
+        f"circuit={ai['breaker']} (trip: {ai['breaker_trips']})"
+    )
+    ob = st["outbound"]
+    if ob:
+        lag = ob["lag"]
+        lines.append(
+            f"📤 ارسال: {ob['sent']} (throttle: {ob['throttled']}، RetryAfter: {ob['retry_after']}، منتظر: {ob['waiting']}) | "
+            f"lag p95: interactive={lag['interactive']['p95']:.2f}s bulk={lag['bulk']['p95']:.2f}s"
+        )
+    rc = st["result_cache"]
+    lines.append(
+        f"♻️ کش نتیجه: {rc['hits']} hit / {rc['misses']} miss، {rc['stores']} ذخیره، {rc['evictions']} حذف | "
+        f"قبل از صف: {rc['alias_hits']} hit / {rc['alias_misses']} miss"
+    )
+    await update.effective_message.reply_text("\n".join(lines))
+
+
+async def profile_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/profile [ثانیه] — پروفایل نمونه‌برداری این پروسه (و workerهای مستقل)؛ گزارش به صورت فایل."""
+    if not update.effective_user or not _is_admin(update.effective_user.id):
+        await update.effective_message.reply_text("ادمین نیستی.")
+        return
+
+    args = context.args or []
+    try:
+        seconds = int(args[0]) if args else 10
+    except ValueError:
+        await update.effective_message.reply_text("❌ مدت نامعتبر. مثال: /profile 30")
+        return
+    seconds = max(1, min(settings.PROFILE_MAX_SECONDS, seconds))
+    if profiler.busy():
+        await update.effective_message.reply_text("⏳ یک پروفایل دیگر در حال اجراست.")
+        return
+
+    chat_id = update.effective_chat.id
+    note = ""
+    if settings.QUEUE_BACKEND == "postgres":
+        async with get_session() as session:
+            await repo.request_profile(session, seconds, chat_id)
+            await session.commit()
+        # با worker داخلی ProfileListener جدایی در کار نیست و فایل دیگری نمی‌آید
+        if not settings.EMBEDDED_WORKER:
+            note = "\nworkerهای مستقل هم هر کدام فایل خودشان را می‌فرستند."
+    await update.effective_message.reply_text(f"🔬 پروفایل {seconds} ثانیه‌ای شروع شد.{note}")
+
+    async def _run():
+        report = await profiler.profile(seconds)
+        await profiler.send_report(context.bot, chat_id, report)
+
+    # handler نباید چند ثانیه آپدیت‌های بعدی را پشت خودش نگه دارد
+    context.application.create_task(_run(), update=update)
+
+
 # -------------------------
 # Callback router
 # -------------------------
@@ -265,29 +500,29 @@ async def callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await q.answer()
     data = q.data or ""
 
+    # ---- FORCE JOIN re-check ----
+    if data == "join:check":
+        u = update.effective_user
+        if not u:
+            return States.HOME
+        # نتیجه منفی کش‌شده (از قبل از عضویت) نباید جلوی این چک را بگیرد
+        get_membership_cache().invalidate(u.id)
+        fake_update = Update(update.update_id, message=q.message)
+        fake_update._effective_user = u
+        if await check_force_join(fake_update, context):
+            await q.message.reply_text("✅ عضویتت تأیید شد. حالا می‌تونی ادامه بدی.", reply_markup=HOME_KB)
+        return States.HOME
+
     # ---- ACCOUNT callbacks ----
     if data == "acc:back":
         await q.message.reply_text("برگشتیم منو.", reply_markup=HOME_KB)
         return States.HOME
 
-    if data == "acc:history":
+    if data == "acc:history" or data.startswith("acc:h:"):
         u = update.effective_user
         if not u:
             return States.HOME
-
-        async with get_session() as session:
-            rows = await repo.list_recent_requests_for_user(session, u.id, limit=5)
-
-        if not rows:
-            await q.message.reply_text("فعلاً هیچ درخواستی ثبت نکردی.", reply_markup=HOME_KB)
-            return States.HOME
-
-        lines = []
-        for r in rows:
-            lines.append(f"#{r.id} | {r.status} | {r.images_count} عکس | مدل: {r.model}")
-
-        await q.message.reply_text("🧾 5 درخواست آخر:\n" + "\n".join(lines), reply_markup=HOME_KB)
-        return States.HOME
+        return await _show_history_page(q, u.id, data)
 
     if data == "acc:lang:toggle":
         u = update.effective_user
@@ -295,14 +530,13 @@ async def callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return States.HOME
 
         async with get_session() as session:
-            user = await repo.get_user_by_tg(session, u.id)
+            user = await repo.get_user_flags(session, u.id)
             if not user:
                 await q.message.reply_text("مشکل کاربر. دوباره /start بزن.")
                 return States.HOME
-            cur = (user.lang or "fa").lower()
-            user.lang = "en" if cur == "fa" else "fa"
+            new_lang = "en" if user.lang == "fa" else "fa"
+            await repo.set_user_lang(session, u.id, new_lang)
             await session.commit()
-            new_lang = user.lang
 
         await q.message.reply_text(f"✅ زبان تغییر کرد: {new_lang}", reply_markup=HOME_KB)
         return States.HOME
@@ -319,8 +553,7 @@ async def callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     if data.startswith("tpl:view:"):
         template_id = int(data.split(":")[-1])
-        async with get_session() as session:
-            tpl = await repo.get_template(session, template_id)
+        tpl = (await get_template_catalog().snapshot()).get(template_id)
 
         if not tpl:
             await q.message.reply_text("این تمپلیت پیدا نشد.")
@@ -353,12 +586,14 @@ async def callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # ---- EDIT callbacks ----
     if data == "edit:cancel":
         context.user_data.pop("edit_images", None)
+        context.user_data.pop("edit_image_uids", None)
         context.user_data.pop("edit_prompt", None)
         await q.message.reply_text("لغو شد. برگشتیم منو.", reply_markup=HOME_KB)
         return States.HOME
 
     if data == "edit:images:clear":
         context.user_data["edit_images"] = []
+        context.user_data["edit_image_uids"] = []
         await q.message.reply_text("🗑 عکس‌ها پاک شد. دوباره عکس‌ها رو بفرست.", reply_markup=edit_images_kb())
         return States.EDIT_WAIT_IMAGES
 
@@ -379,10 +614,10 @@ async def callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
         fake_update = Update(update.update_id, message=q.message)
         fake_update._effective_user = update.effective_user
 
-        if not await check_force_join(fake_update, context):
-            return States.HOME
+        if not await check_rate_limit(fake_update, context, ACTION_SUBMIT):
+            return States.EDIT_CONFIRM
 
-        if not await check_daily_quota(fake_update):
+        if not await check_force_join(fake_update, context):
             return States.HOME
 
         u = update.effective_user
@@ -399,35 +634,74 @@ async def callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
         selected_template_id = context.user_data.get("selected_template_id")
         final_prompt = prompt
         if selected_template_id:
-            async with get_session() as session:
-                tpl = await repo.get_template(session, int(selected_template_id))
+            tpl = (await get_template_catalog().snapshot()).get(int(selected_template_id))
             if tpl and tpl.prompt:
                 final_prompt = f"{tpl.prompt}\n\nUser prompt: {prompt}"
 
-        async with get_session() as session:
-            req = await repo.create_request(
-                session,
-                user_tg_id=u.id,
-                model=settings.GEMINI_MODEL,
-                images_count=len(images),
-                prompt=final_prompt,
-            )
-            await session.commit()
-
-        await consume_edit(fake_update)
+        # همین عکس‌ها + همین prompt قبلاً ویرایش شده؟ بدون صف جواب می‌دهیم (سهمیه مثل همیشه خرج می‌شود)
+        image_uids: list[str] = context.user_data.get("edit_image_uids") or []
+        cached = await lookup_cached_result(image_uids, len(images), final_prompt)
 
-        await enqueue_request(
-            request_id=req.id,
-            user_tg_id=u.id,
-            chat_id=q.message.chat_id,
-            image_file_ids=images,
-            prompt=final_prompt,
-        )
+        # رزرو سهمیه + ثبت درخواست + صف در یک تراکنش (double-tap نمی‌تونه سهمیه رو دوبار خرج کنه)
+        try:
+            async with get_session() as session:
+                reservation = await repo.reserve_daily_edit(session, u.id, runtime.current().FREE_DAILY_EDITS)
+                if not reservation:
+                    await q.message.reply_text(QUOTA_EXHAUSTED_TEXT, reply_markup=HOME_KB)
+                    return States.HOME
+
+                req = await repo.create_request(
+                    session,
+                    user_tg_id=u.id,
+                    model=settings.GEMINI_MODEL,
+                    images_count=len(images),
+                    prompt=final_prompt,
+                    quota_day=reservation.day,
+                )
+                await session.flush()
+
+                if cached is None:
+                    job = await enqueue_request(
+                        request_id=req.id,
+                        user_tg_id=u.id,
+                        chat_id=q.message.chat_id,
+                        image_file_ids=images,
+                        image_unique_ids=image_uids,
+                        prompt=final_prompt,
+                        session=session,
+                        user=reservation,
+                    )
+                await session.commit()
+        except QueueFull as e:
+            # تراکنش rollback شد: سهمیه خرج نشده و عکس‌ها هنوز تو user_data هستند
+            # تا وقتی اضافه‌ی صف (نسبت به سقف) اجرا بشه
+            retry_in = await estimate_wait_seconds(context.application, e.depth - settings.QUEUE_MAX_DEPTH + 1)
+            await q.message.reply_text(
+                f"🚦 الان صف خیلی شلوغه. حدود {_fmt_eta(retry_in)} دیگه دوباره «ارسال» رو بزن.",
+                reply_markup=edit_final_confirm_kb(),
+            )
+            return States.EDIT_CONFIRM
 
         context.user_data.pop("edit_images", None)
+        context.user_data.pop("edit_image_uids", None)
         context.user_data.pop("edit_prompt", None)
 
-        await q.message.reply_text("🚀 درخواست ثبت شد و رفت تو صف پردازش. نتیجه که آماده بشه می‌فرستم.", reply_markup=HOME_KB)
+        if cached is not None:
+            if await deliver_cached_result(context.bot, q.message.chat_id, req.id, cached):
+                await q.message.reply_text("⚡ همین ویرایش قبلاً انجام شده بود؛ نتیجه رو فرستادم.", reply_markup=HOME_KB)
+            else:
+                await q.message.reply_text(FAILED_TEXT.format(request_id=req.id), reply_markup=HOME_KB)
+            return States.HOME
+
+        position = await get_queue().position(job)
+        eta = await estimate_wait_seconds(context.application, position)
+        await q.message.reply_text(
+            "🚀 درخواست ثبت شد و رفت تو صف پردازش.\n"
+            f"📍 نوبت شما: {position}\n"
+            f"⏳ زمان تقریبی: {_fmt_eta(eta)}\n"
+            "نتیجه که آماده بشه می‌فرستم.",
+            reply_markup=HOME_KB,
+        )
         return States.HOME
 
     # ---- ADMIN callbacks (فعلاً همون قبلی‌ها) ----
@@ -446,8 +720,7 @@ async def callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return States.ADM_TPL_TITLE
 
         if data == "adm:tpl:list":
-            async with get_session() as session:
-                all_tpls = await repo.list_all_templates(session)
+            all_tpls = (await get_template_catalog().snapshot()).all
             if not all_tpls:
                 await q.message.reply_text("هیچ تمپلیتی ثبت نشده.")
                 return States.HOME
@@ -458,8 +731,7 @@ async def callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         if data.startswith("adm:tpl:view:"):
             template_id = int(data.split(":")[-1])
-            async with get_session() as session:
-                tpl = await repo.get_template(session, template_id)
+            tpl = (await get_template_catalog().snapshot()).get(template_id)
 
             if not tpl:
                 await q.message.reply_text("پیدا نشد.")
@@ -486,6 +758,7 @@ async def callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
             async with get_session() as session:
                 ok = await repo.toggle_template_active(session, template_id)
                 await session.commit()
+            get_template_catalog().invalidate()
             await q.message.reply_text("✅ تغییر کرد." if ok else "❌ پیدا نشد.")
             return States.HOME
 
@@ -494,6 +767,7 @@ async def callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
             async with get_session() as session:
                 ok = await repo.delete_template(session, template_id)
                 await session.commit()
+            get_template_catalog().invalidate()
             await q.message.reply_text("✅ حذف شد." if ok else "❌ پیدا نشد.")
             return States.HOME
 
@@ -569,7 +843,19 @@ async def adm_tpl_sample(update: Update, context: ContextTypes.DEFAULT_TYPE):
             sample_file_id=sample_file_id,
         )
         await session.commit()
+    get_template_catalog().invalidate()
 
     context.user_data.pop("adm_new_tpl", None)
     await update.effective_message.reply_text("✅ تمپلیت اضافه شد.", reply_markup=HOME_KB)
     return States.HOME
+
+
+# -------------------------
+# Force Join: تغییر عضویت در کانال (نیاز به ادمین بودن bot در کانال)
+# -------------------------
+async def on_chat_member(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    cm = update.chat_member
+    rt = runtime.current()
+    if not cm or not rt.FORCE_JOIN_CHAT:
+        return
+    get_membership_cache().on_member_update(cm.chat.id, cm.chat.username, rt.FORCE_JOIN_CHAT, cm.new_chat_member.user.id)
@@ -62,6 +62,13 @@ def edit_prompt_kb():
     ])
 
 
+def force_join_kb(join_link: str):
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("📢 عضویت", url=join_link)],
+        [InlineKeyboardButton("✅ عضو شدم", callback_data="join:check")],
+    ])
+
+
 def edit_final_confirm_kb():
     return InlineKeyboardMarkup([
         [InlineKeyboardButton("🚀 شروع پردازش", callback_data="edit:go")],
@@ -72,7 +79,29 @@ def edit_final_confirm_kb():
 def account_kb(lang: str):
     lang_label = "English 🇬🇧" if lang == "fa" else "فارسی 🇮🇷"
     return InlineKeyboardMarkup([
-        [InlineKeyboardButton("🧾 تاریخچه آخر", callback_data="acc:history")],
+        [InlineKeyboardButton("🧾 تاریخچه", callback_data="acc:history")],
         [InlineKeyboardButton(f"🌐 تغییر زبان به {lang_label}", callback_data="acc:lang:toggle")],
         [InlineKeyboardButton("🔙 برگشت", callback_data="acc:back")],
     ])
+
+
+HISTORY_FILTERS = [("a", "همه"), ("s", "✅"), ("f", "❌"), ("q", "⏳")]
+
+
+def history_kb(flt: str, older_cursor: str | None, newer_cursor: str | None):
+    """cursorها در callback_data: acc:h:<filter>:<o|n>:<cursor>"""
+    rows = [[
+        InlineKeyboardButton(f"• {label}" if code == flt else label, callback_data=f"acc:h:{code}")
+        for code, label in HISTORY_FILTERS
+    ]]
+
+    nav = []
+    if newer_cursor:
+        nav.append(InlineKeyboardButton("➡️ جدیدتر", callback_data=f"acc:h:{flt}:n:{newer_cursor}"))
+    if older_cursor:
+        nav.append(InlineKeyboardButton("قدیمی‌تر ⬅️", callback_data=f"acc:h:{flt}:o:{older_cursor}"))
+    if nav:
+        rows.append(nav)
+
+    rows.append([InlineKeyboardButton("🔙 برگشت", callback_data="acc:back")])
+    return InlineKeyboardMarkup(rows)
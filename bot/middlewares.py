@@ -1,114 +1,157 @@
-import time
+import math
+from dataclasses import dataclass
+from datetime import datetime
+
 from telegram import Update
 from telegram.ext import ContextTypes
 
-from config import settings
+from bot.keyboards import force_join_kb
+from config import runtime
 from config.database import get_session
 from db import repository as repo
-
-
-async def ensure_user(update: Update) -> None:
-    """هر آپدیت: کاربر رو در DB ثبت/آپدیت کن."""
+from services.last_seen import get_last_seen_buffer
+from services.membership import get_membership_cache
+from services.ratelimit import get_rate_limiter
+
+
+@dataclass
+class UserCtx:
+    """وضعیت کاربر برای یک آپدیت؛ یک بار از DB خوانده می‌شود و بین همه چک‌ها مشترک است."""
+    tg_id: int
+    is_banned: bool
+    is_vip: bool
+    lang: str
+    # فقط وقتی ردیف کامل از DB خوانده شده پر هستند (نه از کش)
+    credits: int | None = None
+    daily_used: int | None = None
+    first_seen: datetime | None = None
+    last_seen: datetime | None = None
+
+
+# اسم attribute روی CallbackContext (هر آپدیت context خودش رو داره)
+_CTX_ATTR = "user_ctx"
+
+
+async def ensure_user(update: Update, context: ContextTypes.DEFAULT_TYPE) -> UserCtx | None:
+    """
+    هر آپدیت: کاربر رو ثبت/آپدیت کن و نتیجه رو روی context نگه دار.
+    اگر کاربر تو کش باشه فقط last_seen تو بافر write-behind ثبت می‌شه (بدون DB)،
+    وگرنه یک upsert. فراخوانی‌های بعدی در همون آپدیت دیگه سراغ DB نمی‌رن.
+    """
     u = update.effective_user
     if not u:
-        return
+        return None
+
+    cached: UserCtx | None = getattr(context, _CTX_ATTR, None)
+    if cached is not None and cached.tg_id == u.id:
+        return cached
+
+    flags = repo.cached_user_flags(u.id)
+    if flags is not None:
+        get_last_seen_buffer().touch(u.id, u.username)
+        ctx = UserCtx(tg_id=u.id, is_banned=flags.is_banned, is_vip=flags.is_vip, lang=flags.lang)
+        setattr(context, _CTX_ATTR, ctx)
+        return ctx
 
     async with get_session() as session:
         user = await repo.upsert_user(session, u.id, u.username)
-        await repo.ensure_daily_reset(session, user)
         await session.commit()
 
-
-async def is_banned(update: Update) -> bool:
+    ctx = UserCtx(
+        tg_id=user.tg_id,
+        is_banned=bool(user.is_banned),
+        is_vip=bool(user.is_vip),
+        lang=(user.lang or "fa").lower(),
+        credits=int(user.credits or 0),
+        daily_used=int(user.daily_used or 0),
+        first_seen=user.first_seen,
+        last_seen=user.last_seen,
+    )
+    setattr(context, _CTX_ATTR, ctx)
+    return ctx
+
+
+async def get_user_flags(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+) -> UserCtx | repo.UserFlags | None:
+    """
+    is_banned / is_vip / lang بدون upsert:
+    اگر همین آپدیت ensure_user شده از context، وگرنه از کش repository.
+    """
     u = update.effective_user
     if not u:
-        return False
+        return None
+
+    cached: UserCtx | None = getattr(context, _CTX_ATTR, None)
+    if cached is not None and cached.tg_id == u.id:
+        return cached
 
     async with get_session() as session:
-        user = await repo.get_user_by_tg(session, u.id)
-        return bool(user and user.is_banned)
+        return await repo.get_user_flags(session, u.id)
 
 
-async def check_cooldown(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
-    """ضد اسپم ساده داخل RAM (برای شروع)."""
-    now = time.time()
-    last = context.user_data.get("last_action_ts", 0.0)
+async def is_banned(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
+    ctx = await ensure_user(update, context)
+    return bool(ctx and ctx.is_banned)
 
-    if now - last < settings.COOLDOWN_SECONDS:
-        await update.effective_message.reply_text("⏳ یه کم آروم‌تر… چند ثانیه دیگه دوباره بزن.")
-        return False
 
-    context.user_data["last_action_ts"] = now
-    return True
+async def check_rate_limit(update: Update, context: ContextTypes.DEFAULT_TYPE, action: str) -> bool:
+    """ضد اسپم با بودجه جدا برای هر اکشن (menu / upload / submit)."""
+    u = update.effective_user
+    if not u:
+        return True
+
+    decision = await get_rate_limiter().hit(action, u.id)
+    if decision.allowed:
+        return True
+
+    wait = max(1, math.ceil(decision.retry_after))
+    await update.effective_message.reply_text(f"⏳ یه کم آروم‌تر… {wait} ثانیه دیگه دوباره امتحان کن.")
+    return False
 
 
 async def check_force_join(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
-    """Force Join با تنظیم env."""
-    if not settings.FORCE_JOIN_ENABLED or not settings.FORCE_JOIN_CHAT:
+    """Force Join با تنظیم env (نتیجه get_chat_member کش می‌شود)."""
+    rt = runtime.current()
+    if not rt.FORCE_JOIN_ENABLED or not rt.FORCE_JOIN_CHAT:
         return True
 
     u = update.effective_user
     if not u:
         return False
 
-    try:
-        member = await context.bot.get_chat_member(settings.FORCE_JOIN_CHAT, u.id)
-        if member.status in ("member", "administrator", "creator"):
-            return True
-    except Exception:
-        # اگر دسترسی/آیدی اشتباه بود، فعلاً بلاک نکنیم.
+    if await get_membership_cache().is_member(context.bot, rt.FORCE_JOIN_CHAT, u.id):
         return True
 
-    join_link = f"https://t.me/{settings.FORCE_JOIN_CHAT.lstrip('@')}"
+    join_link = f"https://t.me/{rt.FORCE_JOIN_CHAT.lstrip('@')}"
     await update.effective_message.reply_text(
         "🔒 برای استفاده از این بخش، اول باید عضو کانال/گروه بشی:\n"
         f"{join_link}\n\n"
-        "بعد از عضویت دوباره امتحان کن."
+        "بعد از عضویت «عضو شدم» رو بزن.",
+        reply_markup=force_join_kb(join_link),
     )
     return False
 
 
-async def check_daily_quota(update: Update) -> bool:
-    """سهمیه روزانه: VIP نامحدود، رایگان روزی FREE_DAILY_EDITS."""
-    u = update.effective_user
-    if not u:
-        return False
+QUOTA_EXHAUSTED_TEXT = "🚫 سهمیه امروزت تموم شده. فردا دوباره داری."
 
-    async with get_session() as session:
-        user = await repo.get_user_by_tg(session, u.id)
-        if not user:
-            return False
 
-        await repo.ensure_daily_reset(session, user)
-
-        if user.is_vip:
-            await session.commit()
-            return True
+async def check_daily_quota(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
+    """
+    چک اولیه سهمیه روزانه: VIP نامحدود، رایگان روزی FREE_DAILY_EDITS.
+    رزرو واقعی موقع edit:go با repo.reserve_daily_edit انجام می‌شود.
+    """
+    ctx = await ensure_user(update, context)
+    if not ctx:
+        return False
 
-        if user.daily_used < settings.FREE_DAILY_EDITS:
-            await session.commit()
-            return True
+    if ctx.daily_used is None and not ctx.is_vip:
+        async with get_session() as session:
+            ctx.daily_used = await repo.get_daily_used(session, ctx.tg_id) or 0
 
-        await session.commit()
+    if ctx.is_vip or ctx.daily_used < runtime.current().FREE_DAILY_EDITS:
+        return True
 
-    await update.effective_message.reply_text("🚫 سهمیه امروزت تموم شده. فردا دوباره داری.")
+    await update.effective_message.reply_text(QUOTA_EXHAUSTED_TEXT)
     return False
-
-
-async def consume_edit(update: Update) -> None:
-    """بعد از ثبت درخواست ادیت، یک واحد از سهمیه کم کن (فعلاً فقط رایگان)."""
-    u = update.effective_user
-    if not u:
-        return
-
-    async with get_session() as session:
-        user = await repo.get_user_by_tg(session, u.id)
-        if not user:
-            return
-
-        await repo.ensure_daily_reset(session, user)
-
-        if not user.is_vip:
-            user.daily_used += 1
-
-        await session.commit()
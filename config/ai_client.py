@@ -0,0 +1,306 @@
+"""
+کلاینت Gemini برای worker.
+
+- یک genai.Client طولانی‌عمر با httpx.AsyncClient مشترک (کانکشن‌ها reuse می‌شوند).
+- هر تلاش timeout خودش را دارد و کل فراخوانی (با retryها) یک deadline.
+- 429 و 5xx و خطای شبکه با backoff نمایی + jitter کامل دوباره امتحان می‌شوند (Retry-After رعایت می‌شود).
+- circuit breaker: بعد از چند خطای پشت‌سرهم upstream، فراخوانی‌ها فوراً CircuitOpen می‌گیرند
+  و worker pool هم تا بسته شدن دوباره job برنمی‌دارد (wait_until_available).
+
+GEMINI_BASE_URL برای وصل شدن به سرور fake محلی است (python -m benchmarks.fake_gemini).
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import random
+import time
+from dataclasses import dataclass
+from typing import Callable
+
+import httpx
+from google import genai
+from google.genai import errors as genai_errors
+from google.genai import types
+
+from config import settings
+
+logger = logging.getLogger("ai_client")
+
+RETRYABLE_STATUS = frozenset({408, 429, 500, 502, 503, 504})
+
+
+class AIError(Exception):
+    """retryable=False یعنی تکرار همین درخواست فایده ندارد (مثلاً 400 یا پاسخ بدون تصویر)."""
+
+    def __init__(self, message: str, status: int | None = None, retryable: bool = True):
+        super().__init__(message)
+        self.status = status
+        self.retryable = retryable
+
+
+class CircuitOpen(AIError):
+    def __init__(self, retry_in: float):
+        super().__init__(f"upstream circuit open (retry in {retry_in:.0f}s)", retryable=True)
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """
+    closed -> (threshold خطای پشت‌سرهم) -> open -> (بعد از reset_timeout) -> half_open
+    در half_open فقط یک فراخوانی آزمایشی رد می‌شود؛ موفق بود closed، نبود دوباره open.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, threshold: int, reset_timeout: float, clock: Callable[[], float] = time.monotonic):
+        self.threshold = max(1, threshold)
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._closed = asyncio.Event()
+        self._closed.set()
+
+        self.trips = 0
+
+    @property
+    def state(self) -> str:
+        if self._state == self.OPEN and self._clock() - self._opened_at >= self.reset_timeout:
+            self._state = self.HALF_OPEN
+        return self._state
+
+    def retry_in(self) -> float:
+        if self._state != self.OPEN:
+            return 0.0
+        return max(0.0, self.reset_timeout - (self._clock() - self._opened_at))
+
+    def before_call(self) -> None:
+        """CircuitOpen اگر الان نباید به upstream زد."""
+        state = self.state
+        if state == self.OPEN:
+            raise CircuitOpen(self.retry_in())
+        if state == self.HALF_OPEN:
+            if self._probe_in_flight:
+                raise CircuitOpen(1.0)
+            self._probe_in_flight = True
+
+    def on_success(self) -> None:
+        self._probe_in_flight = False
+        self._failures = 0
+        if self._state != self.CLOSED:
+            logger.info("Circuit closed: upstream recovered")
+        self._state = self.CLOSED
+        self._closed.set()
+
+    def on_failure(self) -> None:
+        self._probe_in_flight = False
+        self._failures += 1
+        if self._state == self.HALF_OPEN or self._failures >= self.threshold:
+            if self._state != self.OPEN:
+                self.trips += 1
+                logger.warning("Circuit opened after %s upstream failures", self._failures)
+            self._state = self.OPEN
+            self._opened_at = self._clock()
+            self._closed.clear()
+
+    def on_neutral(self) -> None:
+        """خطایی که تقصیر upstream نیست (مثلاً 400)؛ probe آزاد می‌شود ولی وضعیت عوض نمی‌شود."""
+        self._probe_in_flight = False
+
+    async def wait_until_available(self) -> None:
+        """برای dispatcher: تا وقتی open است یا probe در جریان است صبر کن."""
+        while self.state == self.OPEN or (self._state == self.HALF_OPEN and self._probe_in_flight):
+            try:
+                await asyncio.wait_for(self._closed.wait(), timeout=max(0.05, self.retry_in()))
+            except asyncio.TimeoutError:
+                pass
+
+
+@dataclass(frozen=True)
+class EditResult:
+    images: list[tuple[bytes, str]]  # (data, mime_type)
+    text: str
+    attempts: int
+    latency_ms: int
+
+
+class GeminiClient:
+    def __init__(
+        self,
+        api_key: str,
+        model: str,
+        base_url: str | None,
+        attempt_timeout: float,
+        deadline: float,
+        max_retries: int,
+        backoff_base: float,
+        backoff_max: float,
+        max_connections: int,
+        breaker: CircuitBreaker,
+    ):
+        self.model = model
+        self.attempt_timeout = attempt_timeout
+        self.deadline = deadline
+        self.max_retries = max(0, max_retries)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = breaker
+
+        # کانکشن‌ها بین همه فراخوانی‌ها مشترک‌اند؛ timeout واقعی را per-attempt خودمان اعمال می‌کنیم
+        self._http = httpx.AsyncClient(
+            timeout=httpx.Timeout(attempt_timeout, connect=10.0),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+        self._client = genai.Client(
+            api_key=api_key or "local",
+            http_options=types.HttpOptions(
+                base_url=base_url or None,
+                timeout=int(attempt_timeout * 1000),
+                httpx_async_client=self._http,
+            ),
+        )
+
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+
+    def _backoff(self, attempt: int, retry_after: float | None) -> float:
+        if retry_after is not None:
+            return min(self.backoff_max, retry_after)
+        # full jitter: uniform(0, min(max, base * 2^attempt))
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    @staticmethod
+    def _retry_after(e: genai_errors.APIError) -> float | None:
+        resp = getattr(e, "response", None)
+        raw = resp.headers.get("retry-after") if resp is not None and hasattr(resp, "headers") else None
+        try:
+            return float(raw) if raw else None
+        except ValueError:
+            return None
+
+    async def edit_image(
+        self,
+        images: list[tuple[bytes, str]],
+        prompt: str,
+        deadline: float | None = None,
+    ) -> EditResult:
+        """images: (data, mime_type). خطای نهایی AIError است (یا CircuitOpen)."""
+        contents = [types.Part.from_bytes(data=data, mime_type=mime) for data, mime in images]
+        contents.append(types.Part.from_text(text=prompt))
+        config = types.GenerateContentConfig(response_modalities=["TEXT", "IMAGE"])
+
+        started = time.monotonic()
+        budget = deadline if deadline is not None else self.deadline
+        attempt = 0
+        self.calls += 1
+
+        while True:
+            # deadline قبل از گرفتن جای probe؛ وگرنه probe نیمه‌باز آزاد نمی‌شد
+            remaining = budget - (time.monotonic() - started)
+            if remaining <= 0:
+                self.failures += 1
+                raise AIError("deadline exceeded", status=504)
+
+            self.breaker.before_call()
+            # هر خروجی از این تلاش وضعیت breaker را مشخص می‌کند؛ خطای غیرمنتظره = failure
+            settle = self.breaker.on_failure
+            try:
+                resp = await asyncio.wait_for(
+                    self._client.aio.models.generate_content(model=self.model, contents=contents, config=config),
+                    timeout=min(self.attempt_timeout, remaining),
+                )
+                settle = self.breaker.on_success
+            except genai_errors.APIError as e:
+                retryable = e.code in RETRYABLE_STATUS
+                err = AIError(f"{e.code} {e.status or ''} {e.message or ''}".strip(), status=e.code, retryable=retryable)
+                retry_after = self._retry_after(e)
+                if not retryable:
+                    settle = self.breaker.on_neutral
+            except (asyncio.TimeoutError, httpx.TransportError) as e:
+                retryable = True
+                err = AIError(f"{type(e).__name__}: {e}".rstrip(": "), status=504)
+                retry_after = None
+            except asyncio.CancelledError:
+                # خاموشی worker؛ تقصیر upstream نیست
+                settle = self.breaker.on_neutral
+                raise
+            finally:
+                settle()
+
+            if settle == self.breaker.on_success:
+                # مدل جواب داده؛ پاسخ بدون تصویر (AIError غیرقابل تکرار) هم upstream سالم است
+                return self._result(resp, attempt + 1, started)
+
+            delay = self._backoff(attempt, retry_after)
+            out_of_time = (time.monotonic() - started) + delay >= budget
+            if not retryable or attempt >= self.max_retries or out_of_time:
+                self.failures += 1
+                raise err
+
+            attempt += 1
+            self.retries += 1
+            logger.info("Gemini %s; retry %s/%s in %.1fs", err, attempt, self.max_retries, delay)
+            await asyncio.sleep(delay)
+
+    def _result(self, resp: types.GenerateContentResponse, attempts: int, started: float) -> EditResult:
+        images: list[tuple[bytes, str]] = []
+        texts: list[str] = []
+        for cand in resp.candidates or []:
+            for part in (cand.content.parts if cand.content else None) or []:
+                if part.inline_data and part.inline_data.data:
+                    images.append((part.inline_data.data, part.inline_data.mime_type or "image/png"))
+                elif part.text:
+                    texts.append(part.text)
+
+        if not images:
+            reason = ""
+            if resp.candidates and resp.candidates[0].finish_reason:
+                reason = str(resp.candidates[0].finish_reason)
+            elif resp.prompt_feedback and resp.prompt_feedback.block_reason:
+                reason = str(resp.prompt_feedback.block_reason)
+            # مدل جواب داد ولی تصویر نداد (مثلاً safety)؛ تکرار فایده ندارد
+            raise AIError(f"no image in response {reason}".strip(), status=200, retryable=False)
+
+        return EditResult(images, "\n".join(texts), attempts, int((time.monotonic() - started) * 1000))
+
+    async def close(self) -> None:
+        await self._http.aclose()
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "retries": self.retries,
+            "failures": self.failures,
+            "breaker": self.breaker.state,
+            "breaker_trips": self.breaker.trips,
+        }
+
+
+_CLIENT: GeminiClient | None = None
+
+
+def get_ai_client() -> GeminiClient:
+    global _CLIENT
+    if _CLIENT is None:
+        if not settings.GEMINI_API_KEY and not settings.GEMINI_BASE_URL:
+            logger.error("GEMINI_API_KEY is empty; edit jobs will fail")
+        _CLIENT = GeminiClient(
+            api_key=settings.GEMINI_API_KEY,
+            model=settings.GEMINI_MODEL,
+            base_url=settings.GEMINI_BASE_URL or None,
+            attempt_timeout=settings.AI_ATTEMPT_TIMEOUT_SECONDS,
+            deadline=settings.AI_DEADLINE_SECONDS,
+            max_retries=settings.AI_MAX_RETRIES,
+            backoff_base=settings.AI_BACKOFF_BASE_SECONDS,
+            backoff_max=settings.AI_BACKOFF_MAX_SECONDS,
+            max_connections=settings.AI_MAX_CONNECTIONS,
+            breaker=CircuitBreaker(settings.AI_BREAKER_THRESHOLD, settings.AI_BREAKER_RESET_SECONDS),
+        )
+    return _CLIENT
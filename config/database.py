@@ -1,11 +1,35 @@
+import time
 from contextlib import asynccontextmanager
+from typing import Callable
+
+import asyncpg
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from config import settings
 
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """همان pool پیش‌فرض؛ وقتی metrics روشن است زمان انتظار هر checkout را گزارش می‌کند."""
+
+    wait_observer: Callable[[float], None] | None = None
+
+    def _do_get(self):
+        observer = TimedQueuePool.wait_observer
+        if observer is None:
+            return super()._do_get()
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            observer(time.perf_counter() - started)
+
+
 engine = create_async_engine(
     settings.DATABASE_URL,
     echo=False,
     pool_pre_ping=True,
+    poolclass=TimedQueuePool,
 )
 
 SessionLocal = async_sessionmaker(
@@ -18,3 +42,14 @@ SessionLocal = async_sessionmaker(
 async def get_session():
     async with SessionLocal() as session:
         yield session
+
+
+async def connect_listener(channel: str, callback: Callable) -> asyncpg.Connection:
+    """
+    کانکشن اختصاصی asyncpg برای LISTEN (خارج از pool، چون تا آخر باز می‌ماند).
+    callback(conn, pid, channel, payload) داخل event loop صدا زده می‌شود.
+    """
+    dsn = make_url(settings.DATABASE_URL).set(drivername="postgresql").render_as_string(hide_password=False)
+    conn = await asyncpg.connect(dsn)
+    await conn.add_listener(channel, callback)
+    return conn
@@ -0,0 +1,190 @@
+"""
+تنظیمات قابل تغییر در زمان اجرا.
+
+مقدارهای env (config/settings.py) پیش‌فرض هستند و ردیف‌های جدول settings روی آن‌ها می‌نشینند.
+مسیرهای داغ فقط current() را می‌خوانند: یک snapshot immutable داخل RAM، بدون کوئری.
+به‌روزرسانی با LISTEN/NOTIFY پستگرس انجام می‌شود و polling پشتیبان آن است.
+"""
+from __future__ import annotations
+
+import asyncio
+import dataclasses
+import logging
+from dataclasses import dataclass
+from typing import Callable
+
+import asyncpg
+
+from config import settings
+
+logger = logging.getLogger("runtime_config")
+
+
+def _parse_bool(v: str) -> bool:
+    v = v.strip().lower()
+    if v in ("1", "true", "yes", "on"):
+        return True
+    if v in ("0", "false", "no", "off"):
+        return False
+    raise ValueError(f"not a bool: {v!r}")
+
+
+def _parse_budget(v: str) -> str:
+    limit, sep, window = v.strip().partition("/")
+    int(limit), float(window)
+    if not sep:
+        raise ValueError(f"expected limit/window: {v!r}")
+    return v.strip()
+
+
+def _parse_optional_str(v: str) -> str | None:
+    return v.strip() or None
+
+
+@dataclass(frozen=True)
+class Snapshot:
+    version: int = 0
+
+    FREE_DAILY_EDITS: int = settings.FREE_DAILY_EDITS
+    MAX_IMAGES: int = settings.MAX_IMAGES
+
+    RATE_LIMIT_ALGORITHM: str = settings.RATE_LIMIT_ALGORITHM
+    RATE_LIMIT_MENU: str = settings.RATE_LIMIT_MENU
+    RATE_LIMIT_UPLOAD: str = settings.RATE_LIMIT_UPLOAD
+    RATE_LIMIT_SUBMIT: str = settings.RATE_LIMIT_SUBMIT
+
+    FORCE_JOIN_ENABLED: bool = settings.FORCE_JOIN_ENABLED
+    FORCE_JOIN_CHAT: str | None = settings.FORCE_JOIN_CHAT
+
+
+# کلیدهای جدول settings که override می‌شوند -> parser
+TUNABLES: dict[str, Callable[[str], object]] = {
+    "FREE_DAILY_EDITS": int,
+    "MAX_IMAGES": int,
+    "RATE_LIMIT_ALGORITHM": lambda v: v.strip().lower(),
+    "RATE_LIMIT_MENU": _parse_budget,
+    "RATE_LIMIT_UPLOAD": _parse_budget,
+    "RATE_LIMIT_SUBMIT": _parse_budget,
+    "FORCE_JOIN_ENABLED": _parse_bool,
+    "FORCE_JOIN_CHAT": _parse_optional_str,
+}
+
+
+def parse_overrides(raw: dict[str, str]) -> dict[str, object]:
+    out: dict[str, object] = {}
+    for key, value in raw.items():
+        parser = TUNABLES.get(key)
+        if parser is None:
+            continue
+        try:
+            out[key] = parser(value)
+        except (TypeError, ValueError):
+            logger.warning("Ignoring invalid setting %s=%r", key, value)
+    return out
+
+
+class RuntimeConfig:
+    def __init__(self, poll_seconds: float):
+        self.poll_seconds = poll_seconds
+        self._snapshot = Snapshot()
+        self._task: asyncio.Task | None = None
+        self._listen_conn: asyncpg.Connection | None = None
+        self._reload_task: asyncio.Task | None = None
+        self._dirty = False  # NOTIFY بعد از شروع reload در جریان
+
+    def current(self) -> Snapshot:
+        return self._snapshot
+
+    def apply(self, raw: dict[str, str]) -> Snapshot:
+        """snapshot جدید = پیش‌فرض‌های env + overrideها. اگر چیزی عوض نشده همون قبلی."""
+        new = dataclasses.replace(Snapshot(), version=self._snapshot.version, **parse_overrides(raw))
+        if new != self._snapshot:
+            new = dataclasses.replace(new, version=self._snapshot.version + 1)
+            self._snapshot = new
+            logger.info("Runtime settings updated (version=%s)", new.version)
+        return self._snapshot
+
+    async def reload(self) -> Snapshot:
+        from config.database import get_session
+        from db import repository as repo
+
+        async with get_session() as session:
+            raw = await repo.list_settings(session)
+        return self.apply(raw)
+
+    # -------- LISTEN/NOTIFY --------
+    def _on_notify(self, conn, pid, channel, payload) -> None:
+        # NOTIFY وسط یک reload گم نمی‌شود: همان task بعد از reload فعلی یک دور دیگر می‌خواند
+        self._dirty = True
+        if self._reload_task is None or self._reload_task.done():
+            self._reload_task = asyncio.create_task(self._safe_reload())
+
+    async def _safe_reload(self) -> None:
+        while True:
+            self._dirty = False
+            try:
+                await self.reload()
+            except Exception:
+                logger.exception("Runtime settings reload failed")
+            if not self._dirty:
+                return
+
+    async def _listen(self) -> None:
+        from config.database import connect_listener
+        from db.repository import SETTINGS_CHANNEL
+
+        self._listen_conn = await connect_listener(SETTINGS_CHANNEL, self._on_notify)
+        logger.info("Listening for settings changes on %s", SETTINGS_CHANNEL)
+
+    def _listening(self) -> bool:
+        return self._listen_conn is not None and not self._listen_conn.is_closed()
+
+    async def _run(self) -> None:
+        while True:
+            if not self._listening():
+                try:
+                    await self._listen()
+                    # هر چی بین لود قبلی و LISTEN عوض شده
+                    await self._safe_reload()
+                except Exception:
+                    logger.warning("LISTEN unavailable, falling back to polling", exc_info=True)
+
+            await asyncio.sleep(self.poll_seconds)
+            # polling پشتیبان: NOTIFYهای گم‌شده (مثلاً وقت قطعی یا UPDATE دستی در DB)
+            await self._safe_reload()
+
+    async def start(self) -> None:
+        if self._task is None:
+            await self._safe_reload()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._reload_task is not None:
+            self._reload_task.cancel()
+            try:
+                await self._reload_task
+            except asyncio.CancelledError:
+                pass
+            self._reload_task = None
+        if self._listening():
+            await self._listen_conn.close()
+        self._listen_conn = None
+
+
+_CONFIG = RuntimeConfig(settings.RUNTIME_SETTINGS_POLL_SECONDS)
+
+
+def get_runtime_config() -> RuntimeConfig:
+    return _CONFIG
+
+
+def current() -> Snapshot:
+    """snapshot فعلی؛ برای مسیرهای داغ (بدون IO)."""
+    return _CONFIG._snapshot
@@ -14,6 +14,17 @@ def _get_bool(name: str, default: bool = False) -> bool:
         return False
     return default
 
+def _get_float_map(name: str, default: str) -> dict[str, float]:
+    """فرمت: "key:value,key:value" مثل "vip:6,credit:3,free:1"."""
+    out: dict[str, float] = {}
+    for part in (os.getenv(name, "").strip() or default).split(","):
+        key, _, value = part.partition(":")
+        try:
+            out[key.strip().lower()] = float(value)
+        except ValueError:
+            continue
+    return out
+
 BOT_TOKEN = os.getenv("BOT_TOKEN", "").strip()
 if not BOT_TOKEN:
     raise RuntimeError("BOT_TOKEN is missing in environment")
@@ -30,15 +41,116 @@ if _admin_ids_raw:
 # Force Join
 FORCE_JOIN_ENABLED = _get_bool("FORCE_JOIN_ENABLED", False)
 FORCE_JOIN_CHAT = os.getenv("FORCE_JOIN_CHAT", "").strip() or None
+FORCE_JOIN_CACHE_TTL = _get_int("FORCE_JOIN_CACHE_TTL", 300)       # عضو بود
+FORCE_JOIN_NEGATIVE_TTL = _get_int("FORCE_JOIN_NEGATIVE_TTL", 15)   # عضو نبود
+FORCE_JOIN_CACHE_SIZE = _get_int("FORCE_JOIN_CACHE_SIZE", 50000)
 
 # Limits
 FREE_DAILY_EDITS = _get_int("FREE_DAILY_EDITS", 5)
-COOLDOWN_SECONDS = _get_int("COOLDOWN_SECONDS", 20)
 MAX_IMAGES = _get_int("MAX_IMAGES", 6)
 
+# Rate limit: هر بودجه به شکل "limit/window_seconds"
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory").strip().lower()  # memory | postgres
+RATE_LIMIT_ALGORITHM = os.getenv("RATE_LIMIT_ALGORITHM", "token_bucket").strip().lower()  # token_bucket | sliding_window
+RATE_LIMIT_MENU = os.getenv("RATE_LIMIT_MENU", "5/10").strip()
+RATE_LIMIT_UPLOAD = os.getenv("RATE_LIMIT_UPLOAD", "12/30").strip()
+RATE_LIMIT_SUBMIT = os.getenv("RATE_LIMIT_SUBMIT", "3/60").strip()
+RATE_LIMIT_MAX_KEYS = _get_int("RATE_LIMIT_MAX_KEYS", 100000)
+
+# Runtime settings (جدول settings): polling پشتیبان LISTEN/NOTIFY
+RUNTIME_SETTINGS_POLL_SECONDS = _get_int("RUNTIME_SETTINGS_POLL_SECONDS", 60)
+
+# Queue
+QUEUE_BACKEND = os.getenv("QUEUE_BACKEND", "postgres").strip().lower()  # postgres | memory
+QUEUE_LEASE_SECONDS = _get_int("QUEUE_LEASE_SECONDS", 120)
+QUEUE_MAX_ATTEMPTS = _get_int("QUEUE_MAX_ATTEMPTS", 3)
+QUEUE_RETRY_BACKOFF_SECONDS = _get_int("QUEUE_RETRY_BACKOFF_SECONDS", 10)
+QUEUE_POLL_SECONDS = _get_int("QUEUE_POLL_SECONDS", 5)
+# Admission control: بیشترین تعداد job در صف (0 = بی‌سقف)
+QUEUE_MAX_DEPTH = _get_int("QUEUE_MAX_DEPTH", 500)
+# تخمین زمان هر job تا وقتی نمونه واقعی نداریم (برای ETA)
+QUEUE_DEFAULT_SERVICE_SECONDS = _get_int("QUEUE_DEFAULT_SERVICE_SECONDS", 20)
+
+# Worker pool: تعداد jobهای هم‌زمان (سقف کل) و سقف هم‌زمان برای هر کاربر
+WORKER_CONCURRENCY = _get_int("WORKER_CONCURRENCY", 4)
+WORKER_PER_USER_LIMIT = _get_int("WORKER_PER_USER_LIMIT", 1)
+# false: پروسه bot فقط آپدیت می‌گیرد و enqueue می‌کند (ingest-only)؛ workerها با python -m services.worker
+EMBEDDED_WORKER = _get_bool("EMBEDDED_WORKER", True)
+WORKER_PROCESSES = _get_int("WORKER_PROCESSES", 1)
+WORKER_SHUTDOWN_GRACE_SECONDS = _get_int("WORKER_SHUTDOWN_GRACE_SECONDS", 30)
+
+# Lanes اولویت صف: وزن در weighted round-robin و SLO زمان انتظار در صف (ثانیه)
+QUEUE_LANE_WEIGHTS = _get_float_map("QUEUE_LANE_WEIGHTS", "vip:6,credit:3,free:1")
+QUEUE_LANE_SLO_SECONDS = _get_float_map("QUEUE_LANE_SLO_SECONDS", "vip:30,credit:60,free:300")
+
+# Download فایل‌های تلگرام (worker)
+DOWNLOAD_CACHE_DIR = os.getenv("DOWNLOAD_CACHE_DIR", "data/file_cache").strip()
+DOWNLOAD_CACHE_MAX_MB = _get_int("DOWNLOAD_CACHE_MAX_MB", 1024)  # 0 = بدون کش دیسک
+DOWNLOAD_CONCURRENCY = _get_int("DOWNLOAD_CONCURRENCY", 8)
+DOWNLOAD_MAX_KBPS = _get_int("DOWNLOAD_MAX_KBPS", 0)  # 0 = بی‌سقف
+DOWNLOAD_TIMEOUT_SECONDS = _get_int("DOWNLOAD_TIMEOUT_SECONDS", 30)
+
+# پیش‌پردازش عکس (process pool)
+IMAGE_WORKERS = _get_int("IMAGE_WORKERS", 0)  # 0 = تعداد هسته‌ها
+IMAGE_MAX_SIDE = _get_int("IMAGE_MAX_SIDE", 1536)  # ضلع بزرگ‌تر ورودی مدل (2x2 تایل 768)
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "JPEG").strip().upper()  # JPEG | WEBP | PNG
+IMAGE_QUALITY = _get_int("IMAGE_QUALITY", 90)
+
+# پیام‌های خروجی (محدودیت‌های تلگرام): سقف سراسری bot، هر چت خصوصی، هر گروه
+OUTBOUND_GLOBAL_PER_SECOND = _get_int("OUTBOUND_GLOBAL_PER_SECOND", 30)  # 0 = بی‌سقف
+OUTBOUND_CHAT_PER_SECOND = _get_int("OUTBOUND_CHAT_PER_SECOND", 1)
+OUTBOUND_GROUP_PER_MINUTE = _get_int("OUTBOUND_GROUP_PER_MINUTE", 20)
+OUTBOUND_MAX_RETRIES = _get_int("OUTBOUND_MAX_RETRIES", 3)  # تکرار بعد از RetryAfter
+# ingest-only (EMBEDDED_WORKER=false): درصد سقف سراسری برای پروسه bot (پاسخ‌های interactive)؛ بقیه بین workerها
+OUTBOUND_BOT_SHARE_PERCENT = _get_int("OUTBOUND_BOT_SHARE_PERCENT", 20)
+
+# Result cache: همان عکس‌ها + prompt + مدل بدون فراخوانی دوباره مدل (ایندکس در Postgres، بایت‌ها روی دیسک)
+RESULT_CACHE_DIR = os.getenv("RESULT_CACHE_DIR", "data/result_cache").strip()
+RESULT_CACHE_MAX_MB = _get_int("RESULT_CACHE_MAX_MB", 2048)  # 0 = خاموش
+RESULT_CACHE_TTL_HOURS = _get_int("RESULT_CACHE_TTL_HOURS", 72)
+
+# Caches
+USER_CACHE_SIZE = _get_int("USER_CACHE_SIZE", 10000)
+USER_CACHE_TTL = _get_int("USER_CACHE_TTL", 60)
+
+# Write-behind: last_seen / username
+LAST_SEEN_FLUSH_SECONDS = _get_int("LAST_SEEN_FLUSH_SECONDS", 5)
+LAST_SEEN_FLUSH_MAX = _get_int("LAST_SEEN_FLUSH_MAX", 500)
+
+# Webhook: با WEBHOOK_URL (آدرس عمومی https) به جای polling؛ سرور محلی پشت reverse proxy
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").strip()
+WEBHOOK_LISTEN_HOST = os.getenv("WEBHOOK_LISTEN_HOST", "127.0.0.1").strip()
+WEBHOOK_LISTEN_PORT = _get_int("WEBHOOK_LISTEN_PORT", 8443)
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "").strip()  # خالی = تصادفی در هر اجرا
+WEBHOOK_MAX_CONNECTIONS = _get_int("WEBHOOK_MAX_CONNECTIONS", 40)  # کانکشن‌های هم‌زمان تلگرام
+WEBHOOK_MAX_IN_FLIGHT = _get_int("WEBHOOK_MAX_IN_FLIGHT", 256)  # آپدیت پذیرفته‌شده و تمام‌نشده
+UPDATE_CONCURRENCY = _get_int("UPDATE_CONCURRENCY", 32)  # handler هم‌زمان (فقط حالت webhook)
+
+# Metrics (Prometheus text) روی پروسه bot؛ 0 = خاموش
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1").strip()
+METRICS_PORT = _get_int("METRICS_PORT", 0)
+
+# /profile: فاصله نمونه‌برداری، آستانه slow callback و سقف مدت
+PROFILE_INTERVAL_MS = _get_int("PROFILE_INTERVAL_MS", 5)
+PROFILE_SLOW_CALLBACK_MS = _get_int("PROFILE_SLOW_CALLBACK_MS", 100)
+PROFILE_MAX_SECONDS = _get_int("PROFILE_MAX_SECONDS", 120)
+
+# زمان مرحله‌های هر job (request_timings) دسته‌ای نوشته می‌شود
+TIMINGS_FLUSH_SECONDS = _get_int("TIMINGS_FLUSH_SECONDS", 5)
+TIMINGS_FLUSH_MAX = _get_int("TIMINGS_FLUSH_MAX", 200)
+
 # AI
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "").strip()
 GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash-image").strip()
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL", "").strip()  # مثلاً http://127.0.0.1:8089 برای fake محلی
+AI_ATTEMPT_TIMEOUT_SECONDS = _get_int("AI_ATTEMPT_TIMEOUT_SECONDS", 60)
+AI_DEADLINE_SECONDS = _get_int("AI_DEADLINE_SECONDS", 150)  # کل فراخوانی با retryها
+AI_MAX_RETRIES = _get_int("AI_MAX_RETRIES", 3)
+AI_BACKOFF_BASE_SECONDS = _get_int("AI_BACKOFF_BASE_SECONDS", 1)
+AI_BACKOFF_MAX_SECONDS = _get_int("AI_BACKOFF_MAX_SECONDS", 20)
+AI_MAX_CONNECTIONS = _get_int("AI_MAX_CONNECTIONS", 20)
+AI_BREAKER_THRESHOLD = _get_int("AI_BREAKER_THRESHOLD", 5)  # خطای پشت‌سرهم تا باز شدن circuit
+AI_BREAKER_RESET_SECONDS = _get_int("AI_BREAKER_RESET_SECONDS", 30)
 
 # Database (اولویت با DATABASE_URL)
 DATABASE_URL = os.getenv("DATABASE_URL", "").strip()
@@ -1 +1 @@
-from db.models import Base, User, Request, Template, Setting  # noqa
+from db.models import Base, User, Request, Template, Setting, RateLimitState, UserRequestStats, Job  # noqa
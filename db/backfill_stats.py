@@ -0,0 +1,20 @@
+import asyncio
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from config.database import engine, get_session
+from db.models import Base
+from db import repository as repo
+
+async def main():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    async with get_session() as session:
+        n = await repo.backfill_user_stats(session)
+        await session.commit()
+    print(f"✅ user_request_stats backfilled ({n} users)")
+
+if __name__ == "__main__":
+    asyncio.run(main())
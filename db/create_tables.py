@@ -3,12 +3,22 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+from sqlalchemy import text
+
 from config.database import engine
 from db.models import Base
 
+# create_all جدول موجود را عوض نمی‌کند؛ ستون‌های اضافه‌شده به جدول‌های قدیمی اینجا (idempotent)
+UPGRADES = [
+    "ALTER TABLE requests ADD COLUMN IF NOT EXISTS quota_day integer",
+    "ALTER TABLE requests ADD COLUMN IF NOT EXISTS cache_hit boolean NOT NULL DEFAULT false",
+]
+
 async def main():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        for stmt in UPGRADES:
+            await conn.execute(text(stmt))
     print("✅ Tables created")
 
 if __name__ == "__main__":
@@ -2,7 +2,7 @@ from __future__ import annotations
 
 from datetime import datetime
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
-from sqlalchemy import String, Integer, BigInteger, Boolean, Text, Index, DateTime
+from sqlalchemy import String, Integer, BigInteger, Boolean, Text, Index, DateTime, Float, JSON
 from sqlalchemy.sql import func
 
 
@@ -64,10 +64,131 @@ class Request(Base):
     latency_ms: Mapped[int | None] = mapped_column(Integer, nullable=True)
     error: Mapped[str | None] = mapped_column(Text, nullable=True)
 
+    # روزی که سهمیه برای این درخواست رزرو شده (برای refund)؛ بعد از refund خالی می‌شود
+    quota_day: Mapped[int | None] = mapped_column(Integer, nullable=True)
+
+    # نتیجه از result cache آمد (فراخوانی مدل نداشت)
+    cache_hit: Mapped[bool] = mapped_column(Boolean, default=False, server_default="false", nullable=False)
+
 
 Index("idx_requests_user_created", Request.user_tg_id, Request.created_at)
 
 
+class RequestTiming(Base):
+    """
+    زمان هر مرحله یک درخواست (میلی‌ثانیه)، از آخرین تلاش worker. NULL یعنی آن مرحله اجرا نشد
+    (مثلاً preprocess/model وقتی result cache hit داد، یا هر چه بعد از مرحله‌ای که خطا داد).
+    total_ms از enqueue تا پایان تحویل است (چیزی که کاربر حس می‌کند).
+    """
+    __tablename__ = "request_timings"
+
+    request_id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    queue_ms: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    download_ms: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    cache_ms: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    preprocess_ms: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    model_ms: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    upload_ms: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    total_ms: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    attempts: Mapped[int] = mapped_column(Integer, default=1, nullable=False)
+    ok: Mapped[bool] = mapped_column(Boolean, nullable=False)
+
+    recorded_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        server_default=func.now(),
+        nullable=False,
+    )
+
+
+class Job(Base):
+    """صف پایدار: هر ردیف یک EditJob که worker با FOR UPDATE SKIP LOCKED برمی‌دارد."""
+    __tablename__ = "jobs"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    request_id: Mapped[int] = mapped_column(Integer, unique=True, nullable=False)
+    user_tg_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    chat_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    payload: Mapped[dict] = mapped_column(JSON, nullable=False)  # image_file_ids, prompt, ...
+    lane: Mapped[str] = mapped_column(String(16), default="free", server_default="free", nullable=False)  # vip/credit/free
+
+    # ready/leased (بعد از ack حذف می‌شود، بعد از تلاش‌های ناموفق dead)
+    status: Mapped[str] = mapped_column(String(16), default="ready", nullable=False)
+    attempts: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    lease_owner: Mapped[str | None] = mapped_column(String(64), nullable=True)
+    lease_until: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
+    last_error: Mapped[str | None] = mapped_column(Text, nullable=True)
+
+    enqueued_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        server_default=func.now(),
+        nullable=False,
+    )
+    available_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        server_default=func.now(),
+        nullable=False,
+    )
+
+
+Index("idx_jobs_ready", Job.lane, Job.available_at, Job.id, postgresql_where=Job.status == "ready")
+Index("idx_jobs_leased", Job.lease_until, postgresql_where=Job.status == "leased")
+# رتبه‌بندی per-user در claim منصفانه
+Index("idx_jobs_user_active", Job.user_tg_id, Job.id, postgresql_where=Job.status.in_(("ready", "leased")))
+
+
+class ResultCacheEntry(Base):
+    """
+    ایندکس result cache: کلید = sha256(مدل، تنظیمات پیش‌پردازش، prompt نرمال‌شده، hash عکس‌های ورودی).
+    بایت‌های خروجی روی دیسک هستند (RESULT_CACHE_DIR/ab/<key>-<i>)، این جدول فقط متادیتا.
+    """
+    __tablename__ = "result_cache"
+
+    key: Mapped[str] = mapped_column(String(64), primary_key=True)
+    model: Mapped[str] = mapped_column(String(64), nullable=False)
+    mime_types: Mapped[list] = mapped_column(JSON, nullable=False)  # یکی برای هر فایل خروجی
+    text: Mapped[str] = mapped_column(Text, default="", nullable=False)
+    size_bytes: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    hits: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        server_default=func.now(),
+        nullable=False,
+    )
+    last_hit_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        server_default=func.now(),
+        nullable=False,
+    )
+    expires_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+
+
+Index("idx_result_cache_expires", ResultCacheEntry.expires_at)
+Index("idx_result_cache_lru", ResultCacheEntry.last_hit_at)
+
+
+class ResultCacheAlias(Base):
+    """
+    کلید ارزان برای همان ورودی قبل از دانلود: sha256(مدل، تنظیمات، prompt، file_unique_idهای عکس‌ها)
+    -> کلید محتوایی result_cache. worker بعد از هر hit/store ثبتش می‌کند تا edit:go بدون صف جواب بدهد.
+    """
+    __tablename__ = "result_cache_aliases"
+
+    alias: Mapped[str] = mapped_column(String(64), primary_key=True)
+    key: Mapped[str] = mapped_column(String(64), index=True, nullable=False)
+
+
+class UserRequestStats(Base):
+    """شمارنده‌های از پیش محاسبه‌شده هر کاربر (به‌جای COUNT(*) روی requests)."""
+    __tablename__ = "user_request_stats"
+
+    user_tg_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    total: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    success: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    fail: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    last_request_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
+
+
 class Template(Base):
     __tablename__ = "templates"
 
@@ -94,3 +215,16 @@ class Setting(Base):
 
     key: Mapped[str] = mapped_column(String(64), primary_key=True)
     value: Mapped[str] = mapped_column(Text, nullable=False)
+
+
+class RateLimitState(Base):
+    """وضعیت rate limiter مشترک بین چند instance (backend=postgres)."""
+    __tablename__ = "rate_limits"
+
+    key: Mapped[str] = mapped_column(String(128), primary_key=True)  # action:tg_id
+
+    # token bucket: level=توکن‌های باقی‌مانده، stamp=زمان آخرین refill (epoch)
+    # sliding window: level=شمارش پنجره فعلی، prev_level=پنجره قبلی، stamp=شروع پنجره فعلی
+    level: Mapped[float] = mapped_column(Float, nullable=False)
+    prev_level: Mapped[float] = mapped_column(Float, default=0, nullable=False)
+    stamp: Mapped[float] = mapped_column(Float, nullable=False)
@@ -1,10 +1,17 @@
 from __future__ import annotations
 
+import json
+from collections.abc import Collection
+from dataclasses import dataclass
 from datetime import datetime, timezone
-from sqlalchemy import select, func, desc
+from sqlalchemy import select, update, delete, func, desc, asc, case, tuple_, event, values, column, BigInteger, String, DateTime
+from sqlalchemy.dialects.postgresql import insert as pg_insert, array
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
 
-from db.models import User, Setting, Template, Request
+from config import settings
+from db.cache import TTLCache
+from db.models import User, Setting, Template, Request, RateLimitState, UserRequestStats, Job, ResultCacheEntry, ResultCacheAlias, RequestTiming
 
 
 def _utc_now() -> datetime:
@@ -20,6 +27,59 @@ def _day_key_utc() -> int:
     return d.year * 10000 + d.month * 100 + d.day
 
 
+# -------- User cache --------
+@dataclass(frozen=True)
+class UserFlags:
+    """فیلدهای کم‌تغییر کاربر که کش می‌شوند."""
+    tg_id: int
+    is_banned: bool
+    is_vip: bool
+    lang: str
+
+    @classmethod
+    def from_user(cls, user: User) -> "UserFlags":
+        return cls(
+            tg_id=user.tg_id,
+            is_banned=bool(user.is_banned),
+            is_vip=bool(user.is_vip),
+            lang=(user.lang or "fa").lower(),
+        )
+
+
+_user_cache: TTLCache[int, UserFlags] = TTLCache(settings.USER_CACHE_SIZE, settings.USER_CACHE_TTL)
+
+_PENDING_INVALIDATIONS = "invalidate_user_ids"
+
+
+def _invalidate_user_on_commit(session: AsyncSession, tg_id: int) -> None:
+    """
+    همین الان و دوباره بعد از commit/rollback از کش پاک کن
+    (تا خواننده‌ای که وسط تراکنش کش رو پر کرده، مقدار کهنه نگه نداره).
+    """
+    _user_cache.pop(tg_id)
+    session.sync_session.info.setdefault(_PENDING_INVALIDATIONS, set()).add(tg_id)
+
+
+@event.listens_for(Session, "after_commit")
+@event.listens_for(Session, "after_soft_rollback")
+def _flush_user_invalidations(session: Session, *args) -> None:
+    for tg_id in session.info.pop(_PENDING_INVALIDATIONS, ()):
+        _user_cache.pop(tg_id)
+
+
+def cached_user_flags(tg_id: int) -> UserFlags | None:
+    """فقط از کش، بدون رفتن سراغ DB."""
+    return _user_cache.get(tg_id)
+
+
+def invalidate_user(tg_id: int) -> None:
+    _user_cache.pop(tg_id)
+
+
+def user_cache_stats() -> dict[str, int]:
+    return _user_cache.stats()
+
+
 # -------- Users --------
 async def get_user_by_tg(session: AsyncSession, tg_id: int) -> User | None:
     res = await session.execute(select(User).where(User.tg_id == tg_id))
@@ -28,47 +88,281 @@ async def get_user_by_tg(session: AsyncSession, tg_id: int) -> User | None:
 
 async def upsert_user(session: AsyncSession, tg_id: int, username: str | None) -> User:
     """
-    ایجاد/آپدیت کاربر.
+    ایجاد/آپدیت کاربر در یک رفت‌وبرگشت: INSERT ... ON CONFLICT DO UPDATE ... RETURNING
+    ریست سهمیه روزانه هم داخل همین statement انجام می‌شود.
     نکته: first_seen و last_seen باید datetime باشند، نه int epoch.
     """
-    user = await get_user_by_tg(session, tg_id)
     now = _utc_now()
+    day = _day_key_utc()
 
-    if user:
-        user.username = username
-        user.last_seen = now
-        return user
-
-    user = User(
+    stmt = pg_insert(User).values(
         tg_id=tg_id,
         username=username,
-        daily_reset_day=_day_key_utc(),
+        daily_reset_day=day,
         daily_used=0,
         credits=0,
         first_seen=now,
         last_seen=now,
     )
-    session.add(user)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[User.tg_id],
+        set_={
+            "username": stmt.excluded.username,
+            "last_seen": stmt.excluded.last_seen,
+            "daily_used": case((User.daily_reset_day != day, 0), else_=User.daily_used),
+            "daily_reset_day": day,
+        },
+    ).returning(User)
+
+    res = await session.execute(stmt, execution_options={"populate_existing": True})
+    user = res.scalar_one()
+    # write-through: ردیف تازه از DB اومده
+    _user_cache.set(tg_id, UserFlags.from_user(user))
     return user
 
 
-async def ensure_daily_reset(session: AsyncSession, user: User) -> None:
+async def get_user_flags(session: AsyncSession, tg_id: int) -> UserFlags | None:
+    """نسخه کش‌شده get_user_by_tg برای is_banned / is_vip / lang."""
+    flags = _user_cache.get(tg_id)
+    if flags is not None:
+        return flags
+
+    user = await get_user_by_tg(session, tg_id)
+    if not user:
+        return None
+
+    flags = UserFlags.from_user(user)
+    _user_cache.set(tg_id, flags)
+    return flags
+
+
+def daily_used_today(user: User) -> int:
+    """مصرف امروز از روی ردیف کاربر (اگر روز عوض شده، صفر)."""
+    if user.daily_reset_day != _day_key_utc():
+        return 0
+    return int(user.daily_used or 0)
+
+
+async def get_daily_used(session: AsyncSession, tg_id: int) -> int | None:
+    """مصرف امروز (با در نظر گرفتن ریست روزانه) بدون نوشتن در DB."""
+    day = _day_key_utc()
+    res = await session.execute(
+        select(case((User.daily_reset_day != day, 0), else_=User.daily_used)).where(User.tg_id == tg_id)
+    )
+    return res.scalar_one_or_none()
+
+
+async def touch_users_bulk(session: AsyncSession, rows: list[tuple[int, str | None, datetime]]) -> int:
+    """
+    آپدیت دسته‌ای last_seen/username با یک UPDATE ... FROM (VALUES ...).
+    rows: (tg_id, username, last_seen) — به ترتیب tg_id تا بین چند instance قفل‌ها deadlock نشوند.
+    """
+    if not rows:
+        return 0
+
+    v = values(
+        column("tg_id", BigInteger),
+        column("username", String(64)),
+        column("last_seen", DateTime(timezone=True)),
+        name="v",
+    ).data(sorted(rows, key=lambda r: r[0]))
+
+    res = await session.execute(
+        update(User)
+        .where(User.tg_id == v.c.tg_id, User.last_seen < v.c.last_seen)
+        .values(last_seen=v.c.last_seen, username=v.c.username)
+    )
+    return res.rowcount
+
+
+async def set_user_lang(session: AsyncSession, tg_id: int, lang: str) -> bool:
+    res = await session.execute(update(User).where(User.tg_id == tg_id).values(lang=lang))
+    _invalidate_user_on_commit(session, tg_id)
+    return res.rowcount > 0
+
+
+# ban/VIP فقط از این دو مسیر: کش کاربر بعد از commit invalidate می‌شود (نه بعد از USER_CACHE_TTL)
+async def set_user_banned(session: AsyncSession, tg_id: int, banned: bool) -> bool:
+    res = await session.execute(update(User).where(User.tg_id == tg_id).values(is_banned=banned))
+    _invalidate_user_on_commit(session, tg_id)
+    return res.rowcount > 0
+
+
+async def set_user_vip(session: AsyncSession, tg_id: int, vip: bool) -> bool:
+    res = await session.execute(update(User).where(User.tg_id == tg_id).values(is_vip=vip))
+    _invalidate_user_on_commit(session, tg_id)
+    return res.rowcount > 0
+
+
+# -------- Daily quota --------
+@dataclass(frozen=True)
+class QuotaReservation:
+    tg_id: int
+    day: int
+    daily_used: int
+    is_vip: bool
+    credits: int
+
+
+async def reserve_daily_edit(session: AsyncSession, tg_id: int, free_limit: int) -> QuotaReservation | None:
     """
-    اگر روز عوض شده، سهمیه روزانه ریست می‌شود.
+    رزرو اتمیک یک واحد سهمیه با یک UPDATE شرطی (ریست روزانه هم داخلش).
+    اگر سهمیه تموم شده باشد None برمی‌گردد. commit با caller است.
     """
     day = _day_key_utc()
-    if user.daily_reset_day != day:
-        user.daily_used = 0
-        user.daily_reset_day = day
+    rolled = User.daily_reset_day != day
+    used_today = case((rolled, 0), else_=User.daily_used)
+
+    res = await session.execute(
+        update(User)
+        .where(User.tg_id == tg_id, (User.is_vip.is_(True)) | (used_today < free_limit))
+        .values(daily_used=used_today + 1, daily_reset_day=day)
+        .returning(User.tg_id, User.daily_used, User.is_vip, User.credits)
+    )
+    row = res.one_or_none()
+    if row is None:
+        return None
+    return QuotaReservation(
+        tg_id=row.tg_id,
+        day=day,
+        daily_used=row.daily_used,
+        is_vip=bool(row.is_vip),
+        credits=int(row.credits or 0),
+    )
+
+
+async def refund_daily_edit(session: AsyncSession, request_id: int) -> bool:
+    """
+    برگرداندن سهمیه رزروشده یک درخواست (مثلاً وقتی job شکست خورد).
+    idempotent است: quota_day درخواست خالی می‌شود، و اگر روز عوض شده باشد چیزی برنمی‌گردد.
+    """
+    r = (
+        select(Request.id, Request.user_tg_id, Request.quota_day)
+        .where(Request.id == request_id, Request.quota_day.is_not(None))
+        .with_for_update()
+        .cte("r")
+    )
+    cleared = (
+        update(Request)
+        .where(Request.id == r.c.id)
+        .values(quota_day=None)
+        .returning(Request.id)
+        .cte("cleared")
+    )
+    stmt = (
+        update(User)
+        .where(User.tg_id == r.c.user_tg_id, User.daily_reset_day == r.c.quota_day)
+        .values(daily_used=func.greatest(User.daily_used - 1, 0))
+        .add_cte(cleared)
+    )
+    res = await session.execute(stmt)
+    return res.rowcount > 0
+
+
+# -------- Rate limits --------
+def _db_epoch():
+    # ساعت DB؛ همه instanceها با یک ساعت حساب می‌کنند
+    return func.extract("epoch", func.now())
+
+
+async def rate_limit_token_bucket(session: AsyncSession, key: str, limit: int, window: float) -> float | None:
+    """
+    token bucket اتمیک با یک UPSERT.
+    اگر مجاز بود None، وگرنه تعداد توکن موجود (کمتر از ۱) برمی‌گردد.
+    """
+    rate = limit / window
+    now = _db_epoch()
+    available = func.least(limit, RateLimitState.level + (now - RateLimitState.stamp) * rate)
+
+    stmt = pg_insert(RateLimitState).values(key=key, level=limit - 1, prev_level=0, stamp=now)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[RateLimitState.key],
+        set_={"level": available - 1, "stamp": now},
+        where=available >= 1,
+    ).returning(RateLimitState.key)
+
+    res = await session.execute(stmt)
+    if res.first() is not None:
+        return None
+
+    res = await session.execute(select(available).where(RateLimitState.key == key))
+    return float(res.scalar_one_or_none() or 0.0)
+
+
+async def rate_limit_sliding_window(
+    session: AsyncSession,
+    key: str,
+    limit: int,
+    window: float,
+) -> tuple[float, float, float] | None:
+    """
+    sliding window counter اتمیک با یک UPSERT.
+    اگر مجاز بود None، وگرنه (شمارش پنجره فعلی، شمارش پنجره قبلی، ثانیه‌های گذشته از پنجره).
+    """
+    now = _db_epoch()
+    window_start = func.floor(now / window) * window
+    same = RateLimitState.stamp == window_start
+    cur = case((same, RateLimitState.level), else_=0)
+    prev = case(
+        (same, RateLimitState.prev_level),
+        (RateLimitState.stamp == window_start - window, RateLimitState.level),
+        else_=0,
+    )
+    elapsed = now - window_start
+    estimate = prev * (1 - elapsed / window) + cur
+
+    stmt = pg_insert(RateLimitState).values(key=key, level=1, prev_level=0, stamp=window_start)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[RateLimitState.key],
+        set_={"level": cur + 1, "prev_level": prev, "stamp": window_start},
+        where=estimate + 1 <= limit,
+    ).returning(RateLimitState.key)
+
+    res = await session.execute(stmt)
+    if res.first() is not None:
+        return None
+
+    res = await session.execute(select(cur, prev, elapsed).where(RateLimitState.key == key))
+    row = res.one_or_none()
+    if row is None:
+        return (0.0, 0.0, 0.0)
+    return (float(row[0]), float(row[1]), float(row[2]))
+
+
+async def purge_rate_limits(session: AsyncSession, older_than_seconds: float) -> int:
+    res = await session.execute(
+        delete(RateLimitState).where(RateLimitState.stamp < _db_epoch() - older_than_seconds)
+    )
+    return res.rowcount
 
 
 # -------- Settings --------
+SETTINGS_CHANNEL = "settings_changed"
+
+
 async def set_setting(session: AsyncSession, key: str, value: str) -> None:
     row = await session.get(Setting, key)
     if row:
         row.value = value
     else:
         session.add(Setting(key=key, value=value))
+    # بعد از commit به همه instanceها خبر بده (LISTEN settings_changed)
+    await session.execute(select(func.pg_notify(SETTINGS_CHANNEL, key)))
+
+
+# -------- Profiling --------
+PROFILE_CHANNEL = "profile_requests"
+
+
+async def request_profile(session: AsyncSession, seconds: float, chat_id: int) -> None:
+    """به workerهای مستقل خبر بده پروفایل بگیرند و گزارش را به chat_id بفرستند (بعد از commit)."""
+    payload = json.dumps({"seconds": seconds, "chat_id": chat_id})
+    await session.execute(select(func.pg_notify(PROFILE_CHANNEL, payload)))
+
+
+async def list_settings(session: AsyncSession) -> dict[str, str]:
+    res = await session.execute(select(Setting.key, Setting.value))
+    return {k: v for k, v in res.all()}
 
 
 async def get_setting(session: AsyncSession, key: str, default: str | None = None) -> str | None:
@@ -143,6 +437,7 @@ async def create_request(
     model: str,
     images_count: int,
     prompt: str,
+    quota_day: int | None = None,
 ) -> Request:
     req = Request(
         user_tg_id=user_tg_id,
@@ -150,25 +445,528 @@ async def create_request(
         images_count=images_count,
         prompt=prompt,
         status="queued",
+        quota_day=quota_day,
     )
     session.add(req)
+    await _bump_user_stats(session, user_tg_id, total=1, last_request_at=_utc_now())
     return req
 
 
-async def count_requests_for_user(session: AsyncSession, user_tg_id: int) -> int:
-    res = await session.execute(select(func.count(Request.id)).where(Request.user_tg_id == user_tg_id))
-    return int(res.scalar() or 0)
+REQUEST_STATUSES = ("queued", "success", "fail")
 
 
-async def list_recent_requests_for_user(
+async def _bump_user_stats(
     session: AsyncSession,
     user_tg_id: int,
-    limit: int = 5,
-) -> list[Request]:
+    total: int = 0,
+    success: int = 0,
+    fail: int = 0,
+    last_request_at: datetime | None = None,
+) -> None:
+    """افزایش اتمیک شمارنده‌های user_request_stats (داخل تراکنش caller)."""
+    stmt = pg_insert(UserRequestStats).values(
+        user_tg_id=user_tg_id,
+        total=total,
+        success=success,
+        fail=fail,
+        last_request_at=last_request_at,
+    )
+    set_ = {
+        "total": UserRequestStats.total + total,
+        "success": UserRequestStats.success + success,
+        "fail": UserRequestStats.fail + fail,
+    }
+    if last_request_at is not None:
+        set_["last_request_at"] = func.greatest(UserRequestStats.last_request_at, last_request_at)
+    await session.execute(stmt.on_conflict_do_update(index_elements=[UserRequestStats.user_tg_id], set_=set_))
+
+
+async def set_request_status(
+    session: AsyncSession,
+    request_id: int,
+    status: str,
+    latency_ms: int | None = None,
+    error: str | None = None,
+    cache_hit: bool = False,
+) -> bool:
+    """
+    queued -> success/fail (فقط یک بار) و آپدیت شمارنده‌های کاربر در همان تراکنش.
+    """
     res = await session.execute(
-        select(Request)
-        .where(Request.user_tg_id == user_tg_id)
+        update(Request)
+        .where(Request.id == request_id, Request.status == "queued")
+        .values(status=status, latency_ms=latency_ms, error=error, cache_hit=cache_hit)
+        .returning(Request.user_tg_id)
+    )
+    user_tg_id = res.scalar_one_or_none()
+    if user_tg_id is None:
+        return False
+
+    await _bump_user_stats(
+        session,
+        user_tg_id,
+        success=1 if status == "success" else 0,
+        fail=1 if status == "fail" else 0,
+    )
+    return True
+
+
+TIMING_COLUMNS = ("queue_ms", "download_ms", "cache_ms", "preprocess_ms", "model_ms", "upload_ms", "total_ms")
+
+
+async def upsert_request_timings_bulk(session: AsyncSession, rows: list[dict]) -> int:
+    """
+    یک INSERT چندردیفی برای یک batch. هر ردیف: request_id، attempts، ok و ستون‌های *_ms.
+    retry یک درخواست ردیف قبلی را با تلاش آخر جایگزین می‌کند.
+    """
+    if not rows:
+        return 0
+    values = [
+        {"request_id": r["request_id"], "attempts": r.get("attempts", 1), "ok": r["ok"],
+         **{c: r.get(c) for c in TIMING_COLUMNS}}
+        for r in rows
+    ]
+    stmt = pg_insert(RequestTiming).values(values)
+    await session.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[RequestTiming.request_id],
+            set_={
+                **{c: getattr(stmt.excluded, c) for c in TIMING_COLUMNS},
+                "attempts": stmt.excluded.attempts,
+                "ok": stmt.excluded.ok,
+                "recorded_at": func.now(),
+            },
+        )
+    )
+    return len(values)
+
+
+async def request_timing_percentiles(
+    session: AsyncSession,
+    limit: int = 1000,
+) -> dict[str, tuple[float, float, float]]:
+    """p50/p95/p99 هر مرحله (میلی‌ثانیه) روی آخرین limit ردیف؛ از همه پروسه‌های worker با هم."""
+    recent = (
+        select(*(getattr(RequestTiming, c) for c in TIMING_COLUMNS))
+        .order_by(desc(RequestTiming.recorded_at))
+        .limit(limit)
+        .subquery()
+    )
+    cols = []
+    for c in TIMING_COLUMNS:
+        for p in (0.5, 0.95, 0.99):
+            cols.append(func.percentile_cont(p).within_group(recent.c[c]))
+    res = (await session.execute(select(*cols))).one()
+    return {
+        c: tuple(float(v or 0) for v in res[i * 3:i * 3 + 3])
+        for i, c in enumerate(TIMING_COLUMNS)
+    }
+
+
+async def avg_recent_latency_ms(session: AsyncSession, limit: int = 200) -> float | None:
+    """میانگین latency آخرین درخواست‌های موفق (برای تخمین ETA صف)."""
+    recent = (
+        select(Request.latency_ms)
+        .where(Request.status == "success", Request.latency_ms.is_not(None))
         .order_by(desc(Request.id))
         .limit(limit)
+        .subquery()
     )
-    return list(res.scalars().all())
+    res = await session.execute(select(func.avg(recent.c.latency_ms)))
+    avg = res.scalar()
+    return float(avg) if avg is not None else None
+
+
+async def get_user_stats(session: AsyncSession, user_tg_id: int) -> UserRequestStats | None:
+    return await session.get(UserRequestStats, user_tg_id)
+
+
+async def get_user_with_stats(
+    session: AsyncSession,
+    tg_id: int,
+) -> tuple[User, UserRequestStats | None] | None:
+    """صفحه حساب: کاربر + شمارنده‌ها با یک کوئری (مستقل از حجم تاریخچه)."""
+    res = await session.execute(
+        select(User, UserRequestStats)
+        .outerjoin(UserRequestStats, UserRequestStats.user_tg_id == User.tg_id)
+        .where(User.tg_id == tg_id)
+    )
+    row = res.one_or_none()
+    return (row[0], row[1]) if row else None
+
+
+async def backfill_user_stats(session: AsyncSession) -> int:
+    """بازسازی کامل user_request_stats از روی requests (برای داده‌های قدیمی)."""
+    agg = select(
+        Request.user_tg_id,
+        func.count(Request.id),
+        func.count(Request.id).filter(Request.status == "success"),
+        func.count(Request.id).filter(Request.status == "fail"),
+        func.max(Request.created_at),
+    ).group_by(Request.user_tg_id)
+
+    stmt = pg_insert(UserRequestStats).from_select(
+        ["user_tg_id", "total", "success", "fail", "last_request_at"],
+        agg,
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[UserRequestStats.user_tg_id],
+        set_={
+            "total": stmt.excluded.total,
+            "success": stmt.excluded.success,
+            "fail": stmt.excluded.fail,
+            "last_request_at": stmt.excluded.last_request_at,
+        },
+    )
+    res = await session.execute(stmt)
+    return res.rowcount
+
+
+async def list_requests_page(
+    session: AsyncSession,
+    user_tg_id: int,
+    cursor: tuple[datetime, int] | None = None,
+    newer: bool = False,
+    status: str | None = None,
+    limit: int = 8,
+) -> tuple[list[Request], bool]:
+    """
+    صفحه‌بندی keyset روی (user_tg_id, created_at, id) — بدون OFFSET، صفحه‌های عمیق هم‌هزینه صفحه اول.
+    cursor: (created_at, id) یک سر صفحه قبلی. newer=False یعنی قدیمی‌ترها.
+    خروجی: ردیف‌ها از جدید به قدیم + آیا در همان جهت ردیف دیگری هست.
+    """
+    q = select(Request).where(Request.user_tg_id == user_tg_id)
+    if status:
+        q = q.where(Request.status == status)
+
+    if cursor is not None:
+        ts, rid = cursor
+        key = tuple_(Request.created_at, Request.id)
+        if newer:
+            q = q.where(Request.created_at >= ts, key > tuple_(ts, rid))
+        else:
+            # شرط اضافه روی created_at برای استفاده از idx_requests_user_created
+            q = q.where(Request.created_at <= ts, key < tuple_(ts, rid))
+
+    order = asc if newer else desc
+    q = q.order_by(order(Request.created_at), order(Request.id)).limit(limit + 1)
+
+    res = await session.execute(q)
+    rows = list(res.scalars().all())
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if newer:
+        rows.reverse()
+    return rows, has_more
+
+
+# -------- Jobs (durable queue) --------
+JOBS_CHANNEL = "jobs_ready"
+
+
+def _seconds(n: float):
+    return func.make_interval(0, 0, 0, 0, 0, 0, n)
+
+
+async def insert_job(
+    session: AsyncSession,
+    request_id: int,
+    user_tg_id: int,
+    chat_id: int,
+    payload: dict,
+    lane: str = "free",
+) -> Job:
+    """داخل تراکنش caller؛ workerها بعد از commit با NOTIFY بیدار می‌شوند."""
+    job = Job(
+        request_id=request_id,
+        user_tg_id=user_tg_id,
+        chat_id=chat_id,
+        payload=payload,
+        lane=lane,
+        status="ready",
+        attempts=0,
+    )
+    session.add(job)
+    await session.flush()
+    await session.execute(select(func.pg_notify(JOBS_CHANNEL, "")))
+    return job
+
+
+def _user_rank():
+    """نوبت هر job بین jobهای همان کاربر: اول در حال اجراها، بعد به ترتیب id (پایه round-robin بین کاربران)."""
+    return func.row_number().over(
+        partition_by=Job.user_tg_id,
+        order_by=(case((Job.status == "leased", 0), else_=1), Job.id),
+    )
+
+
+async def claim_jobs(
+    session: AsyncSession,
+    owner: str,
+    lease_seconds: float,
+    limit: int = 1,
+    per_user_limit: int = 0,
+    exclude_users: Collection[int] = (),
+    lane_order: list[str] | None = None,
+) -> list[Job]:
+    """
+    برداشتن تا limit job آماده با FOR UPDATE SKIP LOCKED (چند worker همدیگه رو بلاک نمی‌کنند).
+    job تا lease_until مال owner است؛ بعدش اگر heartbeat نشود دوباره آزاد می‌شود.
+
+    انصاف بین کاربران: jobهای هر کاربر بعد از jobهای در حال اجرای خودش رتبه می‌گیرند
+    و به ترتیب (رتبه، id) برداشته می‌شوند؛ یعنی round-robin بین کاربران به جای FIFO خالص.
+    per_user_limit > 0: کاربری که این تعداد job در حال اجرا (در همه پروسه‌ها) دارد رد می‌شود.
+    lane_order: اول lane اول لیست (اگر job آماده داشته باشد)، بعد بقیه به همان ترتیب.
+    """
+    active = (
+        select(
+            Job.id,
+            Job.status,
+            Job.available_at,
+            Job.lane,
+            _user_rank().label("rank"),
+            func.count().filter(Job.status == "leased").over(partition_by=Job.user_tg_id).label("in_flight"),
+        )
+        .where(Job.status.in_(("ready", "leased")))
+    )
+    if exclude_users:
+        active = active.where(Job.user_tg_id.not_in(list(exclude_users)))
+    active = active.subquery("active")
+
+    ready = (
+        select(Job.id)
+        .join(active, active.c.id == Job.id)
+        .where(active.c.status == "ready", active.c.available_at <= func.now())
+    )
+    if per_user_limit > 0:
+        ready = ready.where(active.c.in_flight < per_user_limit)
+    order_by = [active.c.rank, Job.id]
+    if lane_order:
+        order_by.insert(0, func.array_position(array(lane_order, type_=String), active.c.lane))
+    ready = (
+        ready.order_by(*order_by)
+        .limit(limit)
+        .with_for_update(of=Job, skip_locked=True)
+        .scalar_subquery()
+    )
+
+    res = await session.execute(
+        update(Job)
+        .where(Job.id.in_(ready))
+        .values(
+            status="leased",
+            lease_owner=owner,
+            lease_until=func.now() + _seconds(lease_seconds),
+            attempts=Job.attempts + 1,
+        )
+        .returning(Job),
+        execution_options={"populate_existing": True},
+    )
+    return sorted(res.scalars().all(), key=lambda j: j.id)
+
+
+async def ready_lanes(session: AsyncSession, lanes: Collection[str]) -> set[str]:
+    """laneهایی که همین حالا job آماده دارند (برای هر lane یک probe روی idx_jobs_ready)."""
+    out: set[str] = set()
+    for lane in lanes:
+        res = await session.execute(
+            select(Job.id)
+            .where(Job.lane == lane, Job.status == "ready", Job.available_at <= func.now())
+            .limit(1)
+        )
+        if res.first() is not None:
+            out.add(lane)
+    return out
+
+
+async def heartbeat_job(session: AsyncSession, job_id: int, owner: str, lease_seconds: float) -> bool:
+    res = await session.execute(
+        update(Job)
+        .where(Job.id == job_id, Job.status == "leased", Job.lease_owner == owner)
+        .values(lease_until=func.now() + _seconds(lease_seconds))
+    )
+    return res.rowcount > 0
+
+
+async def ack_job(session: AsyncSession, job_id: int) -> None:
+    """کار تمام شد؛ سابقه در requests می‌ماند، ردیف صف لازم نیست."""
+    await session.execute(delete(Job).where(Job.id == job_id))
+
+
+async def retry_job(
+    session: AsyncSession,
+    job_id: int,
+    error: str,
+    max_attempts: int,
+    backoff_seconds: float,
+) -> bool:
+    """
+    اگر هنوز تلاش باقی مانده، job با تأخیر به ready برمی‌گردد (True)، وگرنه dead می‌شود (False).
+    """
+    can_retry = Job.attempts < max_attempts
+    res = await session.execute(
+        update(Job)
+        .where(Job.id == job_id)
+        .values(
+            status=case((can_retry, "ready"), else_="dead"),
+            available_at=func.now() + _seconds(backoff_seconds) * Job.attempts,
+            lease_owner=None,
+            lease_until=None,
+            last_error=error,
+        )
+        .returning(Job.status)
+    )
+    return res.scalar_one_or_none() == "ready"
+
+
+async def reap_expired_jobs(session: AsyncSession, max_attempts: int) -> list[int]:
+    """
+    leaseهای منقضی (worker مرده/کرش کرده) آزاد می‌شوند.
+    خروجی: request_id جاب‌هایی که دیگر تلاشی ندارند و dead شدند.
+    """
+    res = await session.execute(
+        update(Job)
+        .where(Job.status == "leased", Job.lease_until < func.now())
+        .values(
+            status=case((Job.attempts < max_attempts, "ready"), else_="dead"),
+            lease_owner=None,
+            lease_until=None,
+            last_error="lease expired",
+        )
+        .returning(Job.request_id, Job.status)
+    )
+    return [rid for rid, status in res.all() if status == "dead"]
+
+
+async def count_jobs(session: AsyncSession, statuses: tuple[str, ...] = ("ready", "leased")) -> int:
+    res = await session.execute(select(func.count(Job.id)).where(Job.status.in_(statuses)))
+    return int(res.scalar() or 0)
+
+
+async def count_jobs_ahead(session: AsyncSession, job_id: int) -> int:
+    """
+    jobهای آماده‌ای که در lane همین job زودتر برداشته می‌شوند: همان ترتیب (rank، id) که claim_jobs
+    داخل یک lane استفاده می‌کند. job ناموجود (برداشته شده) یعنی 0.
+    """
+    active = (
+        select(Job.id, Job.status, Job.lane, _user_rank().label("rank"))
+        .where(Job.status.in_(("ready", "leased")))
+        .cte("active")
+    )
+    mine = select(active.c.lane, active.c.rank).where(active.c.id == job_id).subquery("mine")
+    res = await session.execute(
+        select(func.count())
+        .select_from(active.join(mine, active.c.lane == mine.c.lane))
+        .where(active.c.status == "ready", tuple_(active.c.rank, active.c.id) < tuple_(mine.c.rank, job_id))
+    )
+    return int(res.scalar() or 0)
+
+
+async def count_jobs_by_lane(session: AsyncSession, statuses: tuple[str, ...] = ("ready",)) -> dict[str, int]:
+    res = await session.execute(
+        select(Job.lane, func.count(Job.id)).where(Job.status.in_(statuses)).group_by(Job.lane)
+    )
+    return {lane: int(n) for lane, n in res.all()}
+
+
+# -------- Result cache --------
+async def hit_cached_result(session: AsyncSession, key: str) -> ResultCacheEntry | None:
+    """اگر entry منقضی نشده باشد hits/last_hit_at (برای LRU) در همان یک statement به‌روز می‌شود."""
+    res = await session.execute(
+        update(ResultCacheEntry)
+        .where(ResultCacheEntry.key == key, ResultCacheEntry.expires_at > func.now())
+        .values(hits=ResultCacheEntry.hits + 1, last_hit_at=func.now())
+        .returning(ResultCacheEntry)
+    )
+    return res.scalar_one_or_none()
+
+
+async def put_cached_result(
+    session: AsyncSession,
+    key: str,
+    model: str,
+    mime_types: list[str],
+    text: str,
+    size_bytes: int,
+    ttl_seconds: float,
+) -> None:
+    stmt = pg_insert(ResultCacheEntry).values(
+        key=key,
+        model=model,
+        mime_types=mime_types,
+        text=text,
+        size_bytes=size_bytes,
+        hits=0,
+        expires_at=func.now() + _seconds(ttl_seconds),
+    )
+    await session.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[ResultCacheEntry.key],
+            set_={
+                "model": stmt.excluded.model,
+                "mime_types": stmt.excluded.mime_types,
+                "text": stmt.excluded.text,
+                "size_bytes": stmt.excluded.size_bytes,
+                "created_at": func.now(),
+                "last_hit_at": func.now(),
+                "expires_at": stmt.excluded.expires_at,
+            },
+        )
+    )
+
+
+async def hit_cached_result_by_alias(session: AsyncSession, alias: str) -> ResultCacheEntry | None:
+    """مثل hit_cached_result ولی از روی alias (file_unique_idها)؛ alias بی‌صاحب یعنی miss."""
+    key = select(ResultCacheAlias.key).where(ResultCacheAlias.alias == alias).scalar_subquery()
+    res = await session.execute(
+        update(ResultCacheEntry)
+        .where(ResultCacheEntry.key == key, ResultCacheEntry.expires_at > func.now())
+        .values(hits=ResultCacheEntry.hits + 1, last_hit_at=func.now())
+        .returning(ResultCacheEntry)
+    )
+    return res.scalar_one_or_none()
+
+
+async def put_cache_alias(session: AsyncSession, alias: str, key: str) -> None:
+    stmt = pg_insert(ResultCacheAlias).values(alias=alias, key=key)
+    await session.execute(
+        stmt.on_conflict_do_update(index_elements=[ResultCacheAlias.alias], set_={"key": stmt.excluded.key})
+    )
+
+
+async def delete_cached_result(session: AsyncSession, key: str) -> None:
+    await session.execute(delete(ResultCacheEntry).where(ResultCacheEntry.key == key))
+    await session.execute(delete(ResultCacheAlias).where(ResultCacheAlias.key == key))
+
+
+async def purge_result_cache(session: AsyncSession, max_bytes: int) -> list[tuple[str, int]]:
+    """
+    اول entryهای منقضی، بعد اگر حجم کل از max_bytes بیشتر است قدیمی‌ترین‌ها (last_hit_at)
+    تا وقتی جدیدترین‌ها در 90٪ سقف جا شوند.
+    خروجی: (key, تعداد فایل) ردیف‌های حذف‌شده تا caller فایل‌ها را از دیسک پاک کند.
+    """
+    expired = await session.execute(
+        delete(ResultCacheEntry)
+        .where(ResultCacheEntry.expires_at <= func.now())
+        .returning(ResultCacheEntry.key, ResultCacheEntry.mime_types)
+    )
+    removed = [(key, len(mimes or [])) for key, mimes in expired.all()]
+
+    if max_bytes > 0:
+        # مجموع تجمعی از جدیدترین به قدیمی‌ترین؛ هر چه از هدف بیرون بزند حذف می‌شود
+        kept = func.sum(ResultCacheEntry.size_bytes).over(
+            order_by=(desc(ResultCacheEntry.last_hit_at), ResultCacheEntry.key)
+        )
+        ranked = select(ResultCacheEntry.key, kept.label("kept")).subquery("ranked")
+        over = await session.execute(
+            delete(ResultCacheEntry)
+            .where(ResultCacheEntry.key.in_(select(ranked.c.key).where(ranked.c.kept > int(max_bytes * 0.9))))
+            .returning(ResultCacheEntry.key, ResultCacheEntry.mime_types)
+        )
+        removed += [(key, len(mimes or [])) for key, mimes in over.all()]
+
+    if removed:
+        # aliasهایی که کلیدشان دیگر نیست
+        alive = select(ResultCacheEntry.key).where(ResultCacheEntry.key == ResultCacheAlias.key)
+        await session.execute(delete(ResultCacheAlias).where(~alive.exists()))
+    return removed
@@ -1,21 +1,28 @@
 from dotenv import load_dotenv
 load_dotenv()
 
+import asyncio
 import logging
+from telegram import Update
 from telegram.ext import (
-    Application, CommandHandler, MessageHandler, CallbackQueryHandler,
-    ConversationHandler, filters
+    Application, ApplicationBuilder, CommandHandler, MessageHandler, CallbackQueryHandler,
+    ChatMemberHandler, TypeHandler, filters
 )
 
 from config import settings
 from bot.states import States
 from bot.handlers import (
     start, home_router, callbacks,
-    admin_cmd,
+    admin_cmd, setting_cmd, queue_cmd, profile_cmd, on_chat_member,
     adm_tpl_title, adm_tpl_desc, adm_tpl_prompt, adm_tpl_sample,
     edit_wait_images, edit_wait_prompt,
 )
-from services.worker import start_worker
+from services.worker import start_worker, stop_worker
+from services.outbound import bot_global_share, build_rate_limiter
+from services.webhook import build_update_processor, serve_webhook
+from services.metrics import InstrumentedConversationHandler, count_update, start_metrics, stop_metrics
+from services.last_seen import get_last_seen_buffer
+from config.runtime import get_runtime_config
 
 
 logging.basicConfig(
@@ -25,18 +32,46 @@ logging.basicConfig(
 
 
 async def on_startup(app: Application):
-    # استارت worker صف
-    await start_worker(app)
+    # تنظیمات runtime از جدول settings (قبل از هر چیز دیگه)
+    await get_runtime_config().start()
 
+    # استارت worker صف (در حالت ingest-only workerها پروسه جدا هستند: python -m services.worker)
+    if settings.EMBEDDED_WORKER:
+        await start_worker(app)
+    elif settings.QUEUE_BACKEND == "memory":
+        logging.getLogger("main").warning("EMBEDDED_WORKER=false with QUEUE_BACKEND=memory: nothing will consume jobs")
+    get_last_seen_buffer().start()
+    await start_metrics(app)
+
+
+async def on_shutdown(app: Application):
+    await stop_metrics(app)
+    await stop_worker(app)
+    # last_seenهای بافرشده نباید گم بشن
+    await get_last_seen_buffer().stop()
+    await get_runtime_config().stop()
 
-def main():
-    app = Application.builder().token(settings.BOT_TOKEN).post_init(on_startup).build()
 
-    conv = ConversationHandler(
+def build_app(builder: ApplicationBuilder | None = None) -> Application:
+    """
+    Application کامل با همه handlerها.
+    builder داده شود (مثلاً benchmarks.app_load با Bot جعلی): token، request و rate limiter با caller است.
+    """
+    if builder is None:
+        builder = Application.builder().token(settings.BOT_TOKEN).rate_limiter(build_rate_limiter(bot_global_share()))
+        if settings.WEBHOOK_URL:
+            # webhook: پردازش هم‌زمان (ترتیبی برای هر کاربر)، بدون Updater
+            builder = builder.concurrent_updates(build_update_processor()).updater(None)
+    app = builder.post_init(on_startup).post_shutdown(on_shutdown).build()
+
+    conv = InstrumentedConversationHandler(
         entry_points=[CommandHandler("start", start)],
         states={
             States.HOME: [
                 CommandHandler("admin", admin_cmd),
+                CommandHandler("set", setting_cmd),
+                CommandHandler("queue", queue_cmd),
+                CommandHandler("profile", profile_cmd),
                 CallbackQueryHandler(callbacks),
                 MessageHandler(filters.TEXT & ~filters.COMMAND, home_router),
             ],
@@ -67,10 +102,23 @@ def main():
         persistent=False,
     )
 
+    # شمارش آپدیت‌ها برای metrics؛ group جدا یعنی جلوی conv را نمی‌گیرد
+    app.add_handler(TypeHandler(Update, count_update), group=-1)
     app.add_handler(conv)
+    # عضو شدن/رفتن در کانال Force Join کش عضویت همان کاربر را پاک می‌کند
+    app.add_handler(ChatMemberHandler(on_chat_member, ChatMemberHandler.CHAT_MEMBER))
+    return app
+
 
+def main():
+    app = build_app()
+    if settings.WEBHOOK_URL:
+        print(f"✅ Bot is running (webhook {settings.WEBHOOK_URL})...")
+        asyncio.run(serve_webhook(app))
+        return
     print("✅ Bot is running...")
-    app.run_polling(close_loop=False)
+    # chat_member به‌صورت پیش‌فرض فرستاده نمی‌شود
+    app.run_polling(close_loop=False, allowed_updates=Update.ALL_TYPES)
 
 
 if __name__ == "__main__":
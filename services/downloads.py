@@ -0,0 +1,297 @@
+"""
+مرحله دانلود worker: گرفتن فایل‌های تلگرام یک job.
+
+- همه فایل‌های یک job هم‌زمان و روی یک httpx client با کانکشن‌های pooled دانلود می‌شوند.
+- تعداد دانلود هم‌زمان و پهنای باند کل (بایت بر ثانیه) سقف دارد.
+- کلید کش file_unique_id است (file_id برای یک فایل ثابت نیست)؛ دو درخواست هم‌زمان
+  برای یک فایل فقط یک دانلود می‌زنند.
+- بایت‌ها روی دیسک content-addressed (sha256) ذخیره می‌شوند با حذف LRU وقتی حجم از سقف رد شود؛
+  retry یا job تکراری با همان عکس‌ها اصلاً به شبکه نمی‌رود.
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import logging
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable
+
+import httpx
+from telegram import Bot
+
+from config import settings
+
+logger = logging.getLogger("downloads")
+
+_CHUNK = 64 * 1024
+
+
+def write_atomic(path: Path, data: bytes) -> None:
+    """tmp + rename در همان پوشه؛ خواننده هیچ‌وقت فایل نیمه‌کاره نمی‌بیند."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+class ByteRateLimiter:
+    """
+    token bucket روی بایت‌ها، مشترک بین همه دانلودها.
+    سطح می‌تواند منفی شود؛ هر مصرف‌کننده به اندازه بدهی خودش صبر می‌کند.
+    rate <= 0 یعنی بی‌سقف.
+    """
+
+    def __init__(self, rate: float, burst: float | None = None, clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.burst = burst if burst is not None else rate
+        self._clock = clock
+        self._level = self.burst
+        self._stamp = clock()
+
+    async def consume(self, n: int) -> None:
+        if self.rate <= 0:
+            return
+        now = self._clock()
+        self._level = min(self.burst, self._level + (now - self._stamp) * self.rate)
+        self._stamp = now
+        self._level -= n
+        if self._level < 0:
+            await asyncio.sleep(-self._level / self.rate)
+
+
+class FileCache:
+    """
+    کش دیسکی content-addressed:
+        objects/ab/abcdef...   بایت‌های فایل با نام sha256
+        ids/<file_unique_id>   digest فایل
+    mtime هر object موقع hit به‌روز می‌شود و حذف از قدیمی‌ترین mtime شروع می‌شود (LRU).
+    نوشتن‌ها اتمیک هستند (tmp + rename) پس چند پروسه worker می‌توانند یک پوشه را شریک شوند.
+    متدها blocking هستند؛ از داخل event loop با asyncio.to_thread صدا زده شوند.
+    """
+
+    def __init__(self, root: str | Path, max_bytes: int):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self._objects = self.root / "objects"
+        self._ids = self.root / "ids"
+        self._size: int | None = None  # تخمین حجم؛ اولین بار با اسکن پوشه
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _object_path(self, digest: str) -> Path:
+        return self._objects / digest[:2] / digest
+
+    def _id_path(self, unique_id: str) -> Path:
+        # file_unique_id فقط [A-Za-z0-9_-] است؛ باز هم جداکننده مسیر را راه نمی‌دهیم
+        return self._ids / unique_id.replace("/", "_").replace("\\", "_")
+
+    def get(self, unique_id: str) -> bytes | None:
+        id_path = self._id_path(unique_id)
+        try:
+            digest = id_path.read_text().strip()
+            obj = self._object_path(digest)
+            data = obj.read_bytes()
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+
+        try:
+            os.utime(obj)
+        except FileNotFoundError:
+            pass  # هم‌زمان evict شد؛ بایت‌ها را داریم
+        self.hits += 1
+        return data
+
+    def put(self, unique_id: str, data: bytes) -> str:
+        digest = hashlib.sha256(data).hexdigest()
+        obj = self._object_path(digest)
+        if not obj.exists():
+            write_atomic(obj, data)
+            if self._size is not None:
+                self._size += len(data)
+        write_atomic(self._id_path(unique_id), digest.encode())
+
+        if self._size is None:
+            self._size = self._scan_size()
+        if self.max_bytes > 0 and self._size > self.max_bytes:
+            self.evict()
+        return digest
+
+    def _scan_size(self) -> int:
+        total = 0
+        for p in self._objects.glob("*/*"):
+            try:
+                total += p.stat().st_size
+            except FileNotFoundError:
+                pass
+        return total
+
+    def evict(self) -> int:
+        """قدیمی‌ترین‌ها حذف می‌شوند تا حجم به 90٪ سقف برسد. idهای یتیم موقع get پاک نمی‌شوند، فقط miss می‌دهند."""
+        entries = []
+        for p in self._objects.glob("*/*"):
+            if p.name.startswith(".tmp-"):
+                continue
+            try:
+                st = p.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, p))
+
+        total = sum(size for _, size, _ in entries)
+        target = int(self.max_bytes * 0.9)
+        removed = 0
+        for _, size, p in sorted(entries):
+            if total <= target:
+                break
+            try:
+                p.unlink()
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+
+        self._size = total
+        self.evictions += removed
+        return removed
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "bytes": self._size or 0,
+        }
+
+
+class TelegramDownloader:
+    """
+    دانلود فایل‌های یک job: اول کش دیسک، بعد getFile + دانلود stream با سقف پهنای باند.
+    """
+
+    def __init__(
+        self,
+        cache: FileCache | None,
+        concurrency: int,
+        max_bytes_per_sec: float,
+        timeout: float,
+    ):
+        self.cache = cache
+        self._sem = asyncio.Semaphore(max(1, concurrency))
+        self._limiter = ByteRateLimiter(max_bytes_per_sec)
+        self._client = httpx.AsyncClient(
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency),
+        )
+        self._inflight: dict[str, asyncio.Future[bytes]] = {}
+
+        self.network_fetches = 0
+        self.coalesced = 0
+        self.bytes_downloaded = 0
+
+    async def fetch_all(self, bot: Bot, file_ids: list[str], unique_ids: list[str] | None = None) -> list[bytes]:
+        """به همان ترتیب file_ids؛ اگر یکی شکست بخورد کل job خطا می‌گیرد (retry صف)."""
+        unique_ids = unique_ids or []
+        return list(await asyncio.gather(*(
+            self.fetch(bot, fid, unique_ids[i] if i < len(unique_ids) else None)
+            for i, fid in enumerate(file_ids)
+        )))
+
+    async def fetch(self, bot: Bot, file_id: str, unique_id: str | None = None) -> bytes:
+        key = unique_id or file_id
+        fut = self._inflight.get(key)
+        if fut is not None:
+            self.coalesced += 1
+            return await asyncio.shield(fut)
+
+        fut = asyncio.get_running_loop().create_future()
+        self._inflight[key] = fut
+        try:
+            data = await self._load(bot, file_id, unique_id)
+            fut.set_result(data)
+            return data
+        except BaseException as e:
+            if not fut.done():
+                fut.set_exception(e)
+                # اگر کسی منتظرش نبود، "exception was never retrieved" لاگ نشود
+                fut.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    async def _load(self, bot: Bot, file_id: str, unique_id: str | None) -> bytes:
+        if self.cache and unique_id:
+            data = await asyncio.to_thread(self.cache.get, unique_id)
+            if data is not None:
+                return data
+
+        async with self._sem:
+            data = await self._download(bot, file_id)
+
+        if self.cache and unique_id:
+            try:
+                await asyncio.to_thread(self.cache.put, unique_id, data)
+            except OSError:
+                logger.warning("File cache write failed (%s)", unique_id, exc_info=True)
+        return data
+
+    async def _download(self, bot: Bot, file_id: str) -> bytes:
+        tg_file = await bot.get_file(file_id)
+        path = tg_file.file_path or ""
+        self.network_fetches += 1
+
+        if not path.startswith(("http://", "https://")):
+            # Bot API سرور محلی (--local): مسیر فایل روی همین ماشین است
+            return await asyncio.to_thread(Path(path).read_bytes)
+
+        buf = bytearray()
+        async with self._client.stream("GET", path) as resp:
+            resp.raise_for_status()
+            async for chunk in resp.aiter_bytes(_CHUNK):
+                await self._limiter.consume(len(chunk))
+                buf += chunk
+        self.bytes_downloaded += len(buf)
+        return bytes(buf)
+
+    async def close(self) -> None:
+        await self._client.aclose()
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "network_fetches": self.network_fetches,
+            "coalesced": self.coalesced,
+            "bytes_downloaded": self.bytes_downloaded,
+            **({f"cache_{k}": v for k, v in self.cache.stats().items()} if self.cache else {}),
+        }
+
+
+_DOWNLOADER: TelegramDownloader | None = None
+
+
+def get_downloader() -> TelegramDownloader:
+    global _DOWNLOADER
+    if _DOWNLOADER is None:
+        cache = (
+            FileCache(settings.DOWNLOAD_CACHE_DIR, settings.DOWNLOAD_CACHE_MAX_MB * 1024 * 1024)
+            if settings.DOWNLOAD_CACHE_MAX_MB > 0 else None
+        )
+        _DOWNLOADER = TelegramDownloader(
+            cache,
+            concurrency=settings.DOWNLOAD_CONCURRENCY,
+            max_bytes_per_sec=settings.DOWNLOAD_MAX_KBPS * 1024,
+            timeout=settings.DOWNLOAD_TIMEOUT_SECONDS,
+        )
+    return _DOWNLOADER
@@ -0,0 +1,200 @@
+"""
+سرور HTTP/1.1 حداقلی روی asyncio (بدون وابستگی اضافه) برای endpointهای داخلی:
+سرور fake مدل، metrics و webhook.
+
+فقط Content-Length پشتیبانی می‌شود (نه chunked) و keep-alive فعال است.
+روی اینترنت هم (webhook) باز است: انتظار برای درخواست بعدی idle_timeout، و خواندن header و body
+روی هم request_timeout مهلت دارد؛ تعداد و حجم headerها سقف دارد (slowloris، رشد بی‌حد حافظه).
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable
+from urllib.parse import parse_qs, urlsplit
+
+logger = logging.getLogger("httpserver")
+
+_REASONS = {
+    200: "OK", 204: "No Content", 400: "Bad Request", 401: "Unauthorized", 403: "Forbidden",
+    404: "Not Found", 405: "Method Not Allowed", 408: "Request Timeout", 413: "Payload Too Large",
+    429: "Too Many Requests", 431: "Request Header Fields Too Large",
+    500: "Internal Server Error", 502: "Bad Gateway", 503: "Service Unavailable", 504: "Gateway Timeout",
+}
+
+
+@dataclass
+class HttpRequest:
+    method: str
+    path: str
+    query: dict[str, list[str]]
+    headers: dict[str, str]  # کلیدها lowercase
+    body: bytes
+
+
+@dataclass
+class HttpResponse:
+    status: int = 200
+    body: bytes = b""
+    content_type: str = "application/json"
+    headers: dict[str, str] = field(default_factory=dict)
+
+
+Handler = Callable[[HttpRequest], Awaitable[HttpResponse]]
+
+
+class _RequestError(Exception):
+    """درخواست خراب یا بیش از حد؛ با status جواب داده و کانکشن بسته می‌شود."""
+
+    def __init__(self, status: int, error: str):
+        super().__init__(error)
+        self.status = status
+        self.error = error
+
+
+class HttpServer:
+    MAX_HEADERS = 100
+    MAX_HEADER_BYTES = 32 * 1024
+
+    def __init__(
+        self,
+        handler: Handler,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        max_body: int = 64 * 1024 * 1024,
+        idle_timeout: float = 75.0,
+        request_timeout: float = 30.0,
+    ):
+        self.handler = handler
+        self.host = host
+        self._port = port
+        self.max_body = max_body
+        self.idle_timeout = idle_timeout
+        self.request_timeout = request_timeout
+        self._server: asyncio.base_events.Server | None = None
+        self._clients: set[asyncio.Task] = set()
+
+    @property
+    def port(self) -> int:
+        """پورت واقعی (با port=0 سیستم‌عامل انتخاب می‌کند)."""
+        if self._server and self._server.sockets:
+            return self._server.sockets[0].getsockname()[1]
+        return self._port
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._serve_client, self.host, self._port)
+        logger.info("HTTP server listening on %s", self.url)
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            # کانکشن‌های keep-alive باز خودشان بسته نمی‌شوند
+            for task in list(self._clients):
+                task.cancel()
+            await asyncio.gather(*self._clients, return_exceptions=True)
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> HttpRequest | None:
+        line = await asyncio.wait_for(reader.readline(), timeout=self.idle_timeout)
+        if not line:
+            return None
+        try:
+            # یک مهلت برای کل header و body، نه برای هر readline
+            async with asyncio.timeout(self.request_timeout):
+                return await self._read_rest(reader, line)
+        except TimeoutError:
+            raise _RequestError(408, "request timeout") from None
+
+    async def _read_rest(self, reader: asyncio.StreamReader, line: bytes) -> HttpRequest:
+        method, target, _ = line.decode("latin-1").rstrip("\r\n").split(" ", 2)
+
+        headers: dict[str, str] = {}
+        count = 0
+        size = 0
+        while True:
+            h = await reader.readline()
+            if h in (b"\r\n", b"\n", b""):
+                break
+            count += 1
+            size += len(h)
+            if count > self.MAX_HEADERS or size > self.MAX_HEADER_BYTES:
+                raise _RequestError(431, "headers too large")
+            name, _, value = h.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        length = int(headers.get("content-length") or 0)
+        if length > self.max_body:
+            raise _RequestError(413, "body too large")
+        body = await reader.readexactly(length) if length else b""
+
+        parts = urlsplit(target)
+        return HttpRequest(method.upper(), parts.path, parse_qs(parts.query), headers, body)
+
+    async def _serve_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        task = asyncio.current_task()
+        self._clients.add(task)
+        try:
+            while True:
+                try:
+                    req = await self._read_request(reader)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except _RequestError as e:
+                    await self._write(writer, HttpResponse(e.status, b'{"error":"%s"}' % e.error.encode()), close=True)
+                    await self._linger(reader, writer)
+                    break
+                except ValueError:
+                    # request line خراب، Content-Length نامعتبر یا خط بلندتر از limit خود StreamReader
+                    await self._write(writer, HttpResponse(400, b'{"error":"bad request"}'), close=True)
+                    await self._linger(reader, writer)
+                    break
+                if req is None:
+                    break
+
+                try:
+                    resp = await self.handler(req)
+                except Exception:
+                    logger.exception("HTTP handler failed (%s %s)", req.method, req.path)
+                    resp = HttpResponse(500, b'{"error":"internal"}')
+
+                close = req.headers.get("connection", "").lower() == "close"
+                await self._write(writer, resp, close=close)
+                if close:
+                    break
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self._clients.discard(task)
+            writer.close()
+
+    @staticmethod
+    async def _linger(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, seconds: float = 1.0) -> None:
+        """
+        بستن با داده‌ی خوانده‌نشده RST می‌فرستد و ممکن است جواب خطا به client نرسد؛
+        پس اول EOF و کمی دور ریختن ورودی (با مهلت، تا کانکشن کند نگه‌مان ندارد).
+        """
+        try:
+            writer.write_eof()
+            async with asyncio.timeout(seconds):
+                while await reader.read(64 * 1024):
+                    pass
+        except (TimeoutError, ConnectionError, OSError):
+            pass
+
+    @staticmethod
+    async def _write(writer: asyncio.StreamWriter, resp: HttpResponse, close: bool) -> None:
+        head = [
+            f"HTTP/1.1 {resp.status} {_REASONS.get(resp.status, 'Unknown')}",
+            f"Content-Type: {resp.content_type}",
+            f"Content-Length: {len(resp.body)}",
+            f"Connection: {'close' if close else 'keep-alive'}",
+            *(f"{k}: {v}" for k, v in resp.headers.items()),
+        ]
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + resp.body)
+        await writer.drain()
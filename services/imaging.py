@@ -0,0 +1,213 @@
+"""
+پیش‌پردازش عکس‌ها قبل از مدل، داخل ProcessPoolExecutor (decode/resize روی event loop همه handlerها را قفل می‌کند).
+
+هر عکس: چرخش بر اساس EXIF، کوچک کردن تا ضلع بزرگ‌تر = max_side، تبدیل فرمت و فشرده‌سازی دوباره.
+برای JPEG با Image.draft همان موقع decode با مقیاس 1/2..1/8 خوانده می‌شود و بقیه با reduce
+(thumbnail با reducing_gap) کوچک می‌شوند؛ یعنی پیکسل‌های کامل یک عکس 12 مگاپیکسلی هیچ‌وقت decode نمی‌شوند.
+
+بایت‌ها از طریق shared memory بین پروسه‌ها جابه‌جا می‌شوند، نه pickle روی pipe.
+"""
+from __future__ import annotations
+
+import asyncio
+import io
+import logging
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+
+from PIL import Image, ImageOps
+
+from config import settings
+
+logger = logging.getLogger("imaging")
+
+_MIME = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+
+
+@dataclass(frozen=True)
+class PreprocessOptions:
+    max_side: int = 1536
+    format: str = "JPEG"  # JPEG | WEBP | PNG
+    quality: int = 90
+    fast_decode: bool = True  # draft/reduce؛ برای مقایسه در بنچمارک قابل خاموش شدن
+
+
+@dataclass(frozen=True)
+class ProcessedImage:
+    data: bytes
+    mime_type: str
+    width: int
+    height: int
+    original_width: int
+    original_height: int
+
+
+class _ShmReader(io.RawIOBase):
+    """file-like فقط‌خواندنی روی memoryview؛ Pillow مستقیم از shared memory می‌خواند."""
+
+    def __init__(self, view: memoryview):
+        self._view = view
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: len(self._view)}[whence]
+        self._pos = max(0, base + offset)
+        return self._pos
+
+    def readinto(self, b) -> int:
+        n = max(0, min(len(b), len(self._view) - self._pos))
+        b[:n] = self._view[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+    def close(self) -> None:
+        # view متعلق به shm است؛ caller آزادش می‌کند
+        self._view = memoryview(b"")
+        super().close()
+
+
+def _transform(src, opts: PreprocessOptions) -> tuple[Image.Image, tuple[int, int]]:
+    img = Image.open(src)
+    original = img.size
+    w, h = original
+
+    if max(w, h) > opts.max_side:
+        scale = opts.max_side / max(w, h)
+        target = (max(1, math.ceil(w * scale)), max(1, math.ceil(h * scale)))
+        if opts.fast_decode:
+            # JPEG: decode با مقیاس DCT (1/2..1/8) که هنوز >= target باشد؛ بقیه فرمت‌ها اثری ندارد
+            img.draft("RGB", target)
+            # reduce با ضریب صحیح (ارزان) تا حدود 2 برابر target، بعد LANCZOS فقط روی همان
+            img.thumbnail(target, Image.Resampling.LANCZOS, reducing_gap=2.0)
+        else:
+            img.thumbnail(target, Image.Resampling.LANCZOS, reducing_gap=None)
+
+    # بعد از کوچک کردن (ضلع بزرگ‌تر با چرخش عوض نمی‌شود و transpose روی عکس کوچک ارزان است)
+    img = ImageOps.exif_transpose(img)
+
+    if opts.format == "JPEG" and img.mode != "RGB":
+        if img.mode in ("RGBA", "LA", "P"):
+            rgba = img.convert("RGBA")
+            bg = Image.new("RGB", rgba.size, (255, 255, 255))
+            bg.paste(rgba, mask=rgba.getchannel("A"))
+            img = bg
+        else:
+            img = img.convert("RGB")
+    elif opts.format != "JPEG" and img.mode not in ("RGB", "RGBA"):
+        img = img.convert("RGBA" if "A" in img.getbands() else "RGB")
+
+    return img, original
+
+
+def _encode(img: Image.Image, opts: PreprocessOptions) -> bytes:
+    out = io.BytesIO()
+    if opts.format == "PNG":
+        img.save(out, "PNG", optimize=True)
+    else:
+        # EXIF عمداً کپی نمی‌شود: چرخش اعمال شده و متادیتا (GPS و ...) نباید به مدل برود
+        img.save(out, opts.format, quality=opts.quality, optimize=True)
+    return out.getvalue()
+
+
+def _preprocess_shm(in_name: str, in_size: int, opts: PreprocessOptions) -> tuple[str, int, tuple[int, int], tuple[int, int]]:
+    """داخل پروسه فرزند: ورودی و خروجی هر دو shared memory؛ فقط نام و اندازه pickle می‌شوند."""
+    shm = SharedMemory(name=in_name)
+    view = shm.buf[:in_size]
+    try:
+        with _ShmReader(view) as raw:
+            img, original = _transform(io.BufferedReader(raw, buffer_size=256 * 1024), opts)
+            data = _encode(img, opts)
+    finally:
+        view.release()
+        shm.close()
+
+    out = SharedMemory(create=True, size=max(1, len(data)))
+    out.buf[:len(data)] = data
+    name = out.name
+    out.close()  # parent باز می‌کند و unlink می‌کند
+    return name, len(data), img.size, original
+
+
+def preprocess_bytes(data: bytes, opts: PreprocessOptions) -> ProcessedImage:
+    """همان کار، sync و داخل همین پروسه (برای تست/بنچمارک)."""
+    img, original = _transform(io.BytesIO(data), opts)
+    out = _encode(img, opts)
+    return ProcessedImage(out, _MIME[opts.format], img.width, img.height, original[0], original[1])
+
+
+class ImageProcessor:
+    def __init__(self, workers: int, opts: PreprocessOptions):
+        self.workers = max(1, workers)
+        self.opts = opts
+        self._executor: ProcessPoolExecutor | None = None
+
+        self.processed = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def _pool(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn: fork کردن پروسه‌ای که event loop و thread دارد امن نیست
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=get_context("spawn"))
+        return self._executor
+
+    async def preprocess(self, data: bytes) -> ProcessedImage:
+        shm = SharedMemory(create=True, size=max(1, len(data)))
+        try:
+            shm.buf[:len(data)] = data
+            out_name, out_size, size, original = await asyncio.get_running_loop().run_in_executor(
+                self._pool(), _preprocess_shm, shm.name, len(data), self.opts
+            )
+        finally:
+            shm.close()
+            shm.unlink()
+
+        out = SharedMemory(name=out_name)
+        try:
+            result = bytes(out.buf[:out_size])
+        finally:
+            out.close()
+            out.unlink()
+
+        self.processed += 1
+        self.bytes_in += len(data)
+        self.bytes_out += out_size
+        return ProcessedImage(result, _MIME[self.opts.format], size[0], size[1], original[0], original[1])
+
+    async def preprocess_all(self, images: list[bytes]) -> list[ProcessedImage]:
+        return list(await asyncio.gather(*(self.preprocess(b) for b in images)))
+
+    async def close(self) -> None:
+        if self._executor is not None:
+            executor, self._executor = self._executor, None
+            await asyncio.to_thread(executor.shutdown, wait=True, cancel_futures=True)
+
+    def stats(self) -> dict[str, int]:
+        return {"processed": self.processed, "bytes_in": self.bytes_in, "bytes_out": self.bytes_out}
+
+
+_PROCESSOR: ImageProcessor | None = None
+
+
+def get_image_processor() -> ImageProcessor:
+    global _PROCESSOR
+    if _PROCESSOR is None:
+        fmt = settings.IMAGE_FORMAT if settings.IMAGE_FORMAT in _MIME else "JPEG"
+        _PROCESSOR = ImageProcessor(
+            settings.IMAGE_WORKERS or (os.cpu_count() or 1),
+            PreprocessOptions(max_side=settings.IMAGE_MAX_SIDE, format=fmt, quality=settings.IMAGE_QUALITY),
+        )
+    return _PROCESSOR
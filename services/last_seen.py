@@ -0,0 +1,37 @@
+from __future__ import annotations
+
+from datetime import datetime, timezone
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import settings
+from db import repository as repo
+from services.writebehind import WriteBehindBuffer
+
+
+async def _write(session: AsyncSession, batch: dict[int, tuple[str | None, datetime]]) -> None:
+    rows = [(tg_id, username, ts) for tg_id, (username, ts) in batch.items()]
+    await repo.touch_users_bulk(session, rows)
+
+
+class LastSeenBuffer(WriteBehindBuffer[int, tuple[str | None, datetime]]):
+    """
+    write-behind برای last_seen/username:
+    touchها در RAM جمع و per-user یکی می‌شوند، هر N ثانیه یا M کاربر با یک UPDATE دسته‌ای flush می‌شوند.
+    """
+
+    def __init__(self, interval: float, max_pending: int):
+        super().__init__("last_seen", _write, interval, max_pending)
+
+    def touch(self, tg_id: int, username: str | None) -> None:
+        self.put(tg_id, (username, datetime.now(timezone.utc)))
+
+
+_BUFFER: LastSeenBuffer | None = None
+
+
+def get_last_seen_buffer() -> LastSeenBuffer:
+    global _BUFFER
+    if _BUFFER is None:
+        _BUFFER = LastSeenBuffer(settings.LAST_SEEN_FLUSH_SECONDS, settings.LAST_SEEN_FLUSH_MAX)
+    return _BUFFER
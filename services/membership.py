@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+
+from telegram import Bot
+
+from config import settings
+from db.cache import TTLCache
+
+logger = logging.getLogger("membership")
+
+_MEMBER_STATUSES = ("member", "administrator", "creator")
+
+
+def matches_chat(chat_id: int, chat_username: str | None, target: str) -> bool:
+    """target همان FORCE_JOIN_CHAT است: @username یا آیدی عددی."""
+    target = target.strip()
+    if target.lstrip("-").isdigit():
+        return int(target) == chat_id
+    return bool(chat_username) and chat_username.lower() == target.lstrip("@").lower()
+
+
+class MembershipCache:
+    """
+    کش نتیجه get_chat_member برای Force Join:
+    عضو بودن با TTL بلند، عضو نبودن با TTL کوتاه.
+    چند چک همزمان برای یک کاربر فقط یک درخواست به Bot API می‌زنند (singleflight).
+    """
+
+    def __init__(self, positive_ttl: float, negative_ttl: float, maxsize: int):
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        # user_id -> (chat, عضو هست؟)
+        self._cache: TTLCache[int, tuple[str, bool]] = TTLCache(maxsize, positive_ttl)
+        self._inflight: dict[tuple[str, int], asyncio.Future[bool]] = {}
+
+        self.api_calls = 0
+        self.coalesced = 0
+
+    async def is_member(self, bot: Bot, chat: str, user_id: int) -> bool:
+        cached = self._cache.get(user_id)
+        if cached is not None and cached[0] == chat:
+            return cached[1]
+
+        key = (chat, user_id)
+        fut = self._inflight.get(key)
+        if fut is not None:
+            self.coalesced += 1
+            return await asyncio.shield(fut)
+
+        fut = asyncio.get_running_loop().create_future()
+        self._inflight[key] = fut
+        try:
+            ok = await self._fetch(bot, chat, user_id)
+            fut.set_result(ok)
+            return ok
+        except BaseException:
+            # مثلاً cancel شدن؛ منتظرها طبق سیاست قبلی بلاک نشن
+            if not fut.done():
+                fut.set_result(True)
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    async def _fetch(self, bot: Bot, chat: str, user_id: int) -> bool:
+        self.api_calls += 1
+        try:
+            member = await bot.get_chat_member(chat, user_id)
+        except Exception:
+            # اگر دسترسی/آیدی اشتباه بود، فعلاً بلاک نکنیم (و کش هم نکنیم)
+            logger.warning("get_chat_member failed (chat=%s, user=%s)", chat, user_id, exc_info=True)
+            return True
+
+        ok = member.status in _MEMBER_STATUSES
+        self._cache.set(user_id, (chat, ok), ttl=self.positive_ttl if ok else self.negative_ttl)
+        return ok
+
+    def on_member_update(self, chat_id: int, chat_username: str | None, target: str, user_id: int) -> None:
+        """آپدیت chat_member: تغییر عضویت در کانال Force Join جای نتیجه کش‌شده را می‌گیرد (نه بعد از TTL)."""
+        if matches_chat(chat_id, chat_username, target):
+            self.invalidate(user_id)
+
+    def invalidate(self, user_id: int | None = None) -> None:
+        """user_id=None یعنی کل کش."""
+        if user_id is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(user_id)
+
+    def stats(self) -> dict[str, int]:
+        return {**self._cache.stats(), "api_calls": self.api_calls, "coalesced": self.coalesced}
+
+
+_CACHE: MembershipCache | None = None
+
+
+def get_membership_cache() -> MembershipCache:
+    global _CACHE
+    if _CACHE is None:
+        _CACHE = MembershipCache(
+            settings.FORCE_JOIN_CACHE_TTL,
+            settings.FORCE_JOIN_NEGATIVE_TTL,
+            settings.FORCE_JOIN_CACHE_SIZE,
+        )
+    return _CACHE
@@ -0,0 +1,328 @@
+"""
+metrics با فرمت متنی Prometheus روی services.httpserver (بدون prometheus_client).
+
+METRICS_PORT=0 یعنی خاموش. روشن که باشد GET /metrics از پروسه bot:
+- bot_updates_total{type}                             ورودی آپدیت‌ها
+- bot_handler_seconds{state,callback}                 latency هر آپدیت داخل ConversationHandler
+- bot_api_request_seconds{method}, bot_api_errors_total{method}   فراخوانی‌های Bot API (از rate limiter)
+- db_pool_*                                           pool دیتابیس + زمان انتظار checkout
+- queue_depth{lane}، worker_*، worker_stage_seconds   صف و worker pool همین پروسه
+
+مسیر داغ فقط یک bisect و چند جمع روی dict است؛ هر چیزی که DB یا محاسبه لازم دارد
+(عمق صف، صدک‌ها) فقط موقع scrape جمع می‌شود.
+"""
+from __future__ import annotations
+
+import bisect
+import logging
+import time
+from typing import Awaitable, Callable
+
+from telegram import Update
+from telegram.ext import Application, ContextTypes, ConversationHandler
+
+from config import settings
+from config.database import TimedQueuePool, engine
+from db import repository as repo
+from services.httpserver import HttpRequest, HttpResponse, HttpServer
+from services.queue import get_queue
+
+logger = logging.getLogger("metrics")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+MAX_SERIES = 200  # سقف تعداد label-set هر metric؛ بیشترش در "other" جمع می‌شود
+
+_UPDATE_TYPES = (
+    "message", "callback_query", "edited_message", "inline_query",
+    "my_chat_member", "chat_member", "pre_checkout_query", "channel_post",
+)
+
+Labels = tuple[str, ...]
+
+
+def _esc(v: str) -> str:
+    return v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _extra(name: str, value: object) -> str:
+    return f'{name}="{value}"'
+
+
+def _fmt_labels(names: tuple[str, ...], values: Labels, extra: str = "") -> str:
+    parts = [f'{n}="{_esc(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values: dict[Labels, float] = {}
+
+    def inc(self, labels: Labels = (), n: float = 1) -> None:
+        if labels not in self._values and len(self._values) >= MAX_SERIES:
+            labels = ("other",) * len(self.labels)
+        self._values[labels] = self._values.get(labels, 0) + n
+
+    def render(self) -> list[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        out += [f"{self.name}{_fmt_labels(self.labels, k)} {v}" for k, v in self._values.items()]
+        return out
+
+
+class LatencyHistogram:
+    """histogram تجمعی Prometheus؛ observe = یک bisect و سه جمع."""
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._series: dict[Labels, list] = {}  # [counts per bucket (+Inf آخر), sum, count]
+
+    def observe(self, seconds: float, labels: Labels = ()) -> None:
+        s = self._series.get(labels)
+        if s is None:
+            if len(self._series) >= MAX_SERIES:
+                labels = ("other",) * len(self.labels)
+                s = self._series.get(labels)
+            if s is None:
+                s = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        s[0][bisect.bisect_left(self.buckets, seconds)] += 1
+        s[1] += seconds
+        s[2] += 1
+
+    def render(self) -> list[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total, n) in self._series.items():
+            acc = 0
+            for le, c in zip(self.buckets, counts):
+                acc += c
+                out.append(f"{self.name}_bucket{_fmt_labels(self.labels, labels, _extra('le', le))} {acc}")
+            out.append(f"{self.name}_bucket{_fmt_labels(self.labels, labels, _extra('le', '+Inf'))} {n}")
+            out.append(f"{self.name}_sum{_fmt_labels(self.labels, labels)} {total}")
+            out.append(f"{self.name}_count{_fmt_labels(self.labels, labels)} {n}")
+        return out
+
+
+def _gauge(name: str, help: str, samples: list[tuple[Labels, float]], labels: tuple[str, ...] = ()) -> list[str]:
+    out = [f"# HELP {name} {help}", f"# TYPE {name} gauge"]
+    out += [f"{name}{_fmt_labels(labels, k)} {v}" for k, v in samples]
+    return out
+
+
+def _summary(name: str, help: str, series: dict[Labels, dict], labels: tuple[str, ...]) -> list[str]:
+    """از summary()های services.stats (صدک‌های از قبل حساب‌شده)."""
+    out = [f"# HELP {name} {help}", f"# TYPE {name} summary"]
+    for key, s in series.items():
+        for q, quantile in (("p50", "0.5"), ("p95", "0.95"), ("p99", "0.99")):
+            out.append(f"{name}{_fmt_labels(labels, key, _extra('quantile', quantile))} {s[q]}")
+        out.append(f"{name}_sum{_fmt_labels(labels, key)} {s['mean'] * s['n']}")
+        out.append(f"{name}_count{_fmt_labels(labels, key)} {s['n']}")
+    return out
+
+
+def update_type(update: object) -> str:
+    if isinstance(update, Update):
+        for t in _UPDATE_TYPES:
+            if getattr(update, t) is not None:
+                return t
+    return "other"
+
+
+def callback_label(data: str | None) -> str:
+    """'adm:tpl:view:12' → 'adm:tpl'؛ بخش‌های عددی و بعد از دو بخش حذف می‌شوند تا cardinality محدود بماند."""
+    if not data:
+        return ""
+    parts = [p for p in data.split(":") if p and not p.isdigit()][:2]
+    return ":".join(parts)[:32]
+
+
+def state_label(state: object) -> str:
+    if state is None:
+        return "entry"
+    return getattr(state, "name", None) or str(state)
+
+
+class Metrics:
+    def __init__(self):
+        self.started_at = time.time()
+        self.updates = Counter("bot_updates_total", "Updates received by type", ("type",))
+        self.handler_seconds = LatencyHistogram(
+            "bot_handler_seconds", "Conversation handler latency per state and callback prefix", ("state", "callback")
+        )
+        self.handler_errors = Counter("bot_handler_errors_total", "Handler exceptions", ("state", "callback"))
+        self.api_seconds = LatencyHistogram("bot_api_request_seconds", "Bot API call latency by method", ("method",))
+        self.api_errors = Counter("bot_api_errors_total", "Failed Bot API calls by method", ("method",))
+        self.db_wait = LatencyHistogram(
+            "db_pool_checkout_wait_seconds", "Time to get a connection from the SQLAlchemy pool",
+            buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0),
+        )
+        self._collectors: list[Callable[[], Awaitable[list[str]]]] = []
+
+    def add_collector(self, fn: Callable[[], Awaitable[list[str]]]) -> None:
+        self._collectors.append(fn)
+
+    def _db_pool(self) -> list[str]:
+        pool = engine.pool
+        samples = []
+        for name, attr in (("size", "size"), ("checked_out", "checkedout"), ("checked_in", "checkedin"), ("overflow", "overflow")):
+            fn = getattr(pool, attr, None)
+            if fn is not None:
+                samples.append(((name,), float(fn())))
+        return _gauge("db_pool_connections", "SQLAlchemy pool state", samples, ("kind",))
+
+    async def render(self) -> str:
+        lines = [
+            *_gauge("process_uptime_seconds", "Seconds since metrics start", [((), time.time() - self.started_at)]),
+            *self.updates.render(),
+            *self.handler_seconds.render(),
+            *self.handler_errors.render(),
+            *self.api_seconds.render(),
+            *self.api_errors.render(),
+            *self.db_wait.render(),
+            *self._db_pool(),
+        ]
+        for fn in self._collectors:
+            try:
+                lines += await fn()
+            except Exception:
+                logger.exception("Metrics collector failed")
+        return "\n".join(lines) + "\n"
+
+
+_METRICS: Metrics | None = None
+
+
+def get_metrics() -> Metrics | None:
+    """None یعنی metrics خاموش است؛ caller هیچ کاری نکند (صفر هزینه)."""
+    return _METRICS
+
+
+def enable_metrics() -> Metrics:
+    global _METRICS
+    if _METRICS is None:
+        _METRICS = Metrics()
+        TimedQueuePool.wait_observer = _METRICS.db_wait.observe
+    return _METRICS
+
+
+class InstrumentedConversationHandler(ConversationHandler):
+    """ConversationHandler که latency هر آپدیت را با state فعلی (قبل از اجرا) و prefix دکمه ثبت می‌کند."""
+
+    async def handle_update(self, update, application, check_result, context):  # type: ignore[override]
+        m = _METRICS
+        if m is None:
+            return await super().handle_update(update, application, check_result, context)
+
+        labels = (
+            state_label(check_result[0]),
+            callback_label(update.callback_query.data if update.callback_query else None),
+        )
+        started = time.perf_counter()
+        try:
+            return await super().handle_update(update, application, check_result, context)
+        except Exception:
+            m.handler_errors.inc(labels)
+            raise
+        finally:
+            m.handler_seconds.observe(time.perf_counter() - started, labels)
+
+
+async def count_update(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """TypeHandler در group منفی؛ قبل از بقیه handlerها و بدون قطع کردن آن‌ها."""
+    m = _METRICS
+    if m is not None:
+        m.updates.inc((update_type(update),))
+
+
+async def _worker_lines(app: Application) -> list[str]:
+    lines = _gauge(
+        "queue_depth", "Ready jobs per lane",
+        [((lane,), float(n)) for lane, n in (await get_queue().depth_by_lane()).items()], ("lane",),
+    )
+    pool = app.bot_data.get("worker_pool")
+    if not pool:
+        return lines
+
+    st = pool.stats()
+    lines += _gauge("worker_slots", "Worker pool size", [((), st["workers"])])
+    lines += _gauge("worker_active", "Jobs running now", [((), st["active"])])
+    lines += _gauge("worker_utilization", "active / slots", [((), st["active"] / max(1, st["workers"]))])
+    lines += [
+        "# HELP worker_jobs_total Finished job attempts",
+        "# TYPE worker_jobs_total counter",
+        f'worker_jobs_total{{result="ok"}} {st["processed"]}',
+        f'worker_jobs_total{{result="failed"}} {st["failed"]}',
+    ]
+    lines += _summary(
+        "worker_stage_seconds", "Job stage durations (process lifetime)",
+        {(stage,): s for stage, s in st["stages"].items()}, ("stage",),
+    )
+    lines += _summary(
+        "queue_wait_seconds", "Queue wait per lane (recent window)",
+        {(lane,): ls["wait"] for lane, ls in st["lanes"].items()}, ("lane",),
+    )
+    ob = st.get("outbound")
+    if ob:
+        lines += _summary(
+            "bot_send_lag_seconds", "Outbound scheduler delay per priority (recent window)",
+            {(p,): s for p, s in ob["lag"].items()}, ("priority",),
+        )
+        lines += _gauge("bot_send_waiting", "Sends waiting for a global token", [((), ob["waiting"])])
+    return lines
+
+
+async def _user_cache_lines() -> list[str]:
+    st = repo.user_cache_stats()
+    lines = _gauge("user_cache_entries", "Cached user flags", [((), st["size"])])
+    lines += _gauge("user_cache_capacity", "User flags cache max size", [((), st["maxsize"])])
+    return lines + [
+        "# HELP user_cache_lookups_total User flags cache lookups",
+        "# TYPE user_cache_lookups_total counter",
+        f'user_cache_lookups_total{{result="hit"}} {st["hits"]}',
+        f'user_cache_lookups_total{{result="miss"}} {st["misses"]}',
+        "# HELP user_cache_removals_total Entries dropped from the user flags cache",
+        "# TYPE user_cache_removals_total counter",
+        f'user_cache_removals_total{{reason="evicted"}} {st["evictions"]}',
+        f'user_cache_removals_total{{reason="expired"}} {st["expirations"]}',
+    ]
+
+
+class MetricsServer:
+    def __init__(self, app: Application, host: str, port: int):
+        self.app = app
+        self.metrics = enable_metrics()
+        self.metrics.add_collector(lambda: _worker_lines(app))
+        self.metrics.add_collector(_user_cache_lines)
+        self._server = HttpServer(self._handle, host, port)
+
+    async def _handle(self, req: HttpRequest) -> HttpResponse:
+        if req.method != "GET" or req.path != "/metrics":
+            return HttpResponse(404, b"not found\n", content_type="text/plain")
+        body = await self.metrics.render()
+        return HttpResponse(200, body.encode(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+    async def start(self) -> None:
+        await self._server.start()
+        logger.info("Metrics on %s/metrics", self._server.url)
+
+    async def stop(self) -> None:
+        await self._server.stop()
+
+
+async def start_metrics(app: Application) -> None:
+    if settings.METRICS_PORT <= 0 or app.bot_data.get("metrics_server"):
+        return
+    server = MetricsServer(app, settings.METRICS_HOST, settings.METRICS_PORT)
+    await server.start()
+    app.bot_data["metrics_server"] = server
+
+
+async def stop_metrics(app: Application) -> None:
+    server: MetricsServer | None = app.bot_data.pop("metrics_server", None)
+    if server:
+        await server.stop()
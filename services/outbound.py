@@ -0,0 +1,329 @@
+"""
+زمان‌بندی پیام‌های خروجی bot طبق محدودیت‌های تلگرام (rate limiter مخصوص PTB).
+
+- یک token bucket سراسری (~30 پیام در ثانیه برای کل bot)
+- یک bucket برای هر چت (~1 پیام در ثانیه در چت خصوصی، 20 در دقیقه در گروه)
+- وقتی توکن سراسری کم است، پاسخ‌های interactive (handlerها) قبل از تحویل‌های bulk (نتیجه‌های worker) رد می‌شوند
+- RetryAfter: همان چت (یا اگر چت معلوم نیست کل bot) برای retry_after ثانیه متوقف و درخواست دوباره فرستاده می‌شود
+- lag ارسال (از صدا زدن متد تا رفتن درخواست) برای هر اولویت اندازه‌گیری می‌شود
+
+فقط متدهای ارسال و ویرایش پیام (_THROTTLED_ENDPOINTS) throttle می‌شوند؛ getFile، sendChatAction، answerCallbackQuery و ... مستقیم رد می‌شوند.
+برای bulk: await bot.send_photo(..., rate_limit_args=BULK)
+
+سقف سراسری مال توکن است نه پروسه: bot_global_share/worker_global_share آن را بین پروسه bot و
+پروسه‌های worker مستقل تقسیم می‌کنند. bucketهای per-chat اما فقط داخل هر پروسه‌اند؛ در حالت ingest-only
+پاسخ bot و تحویل worker به یک چت جدا حساب می‌شوند (RetryAfter احتمالی را retry می‌گیرد).
+"""
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Any, Callable, Coroutine
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from config import settings
+from services.metrics import get_metrics
+from services.stats import RollingStats
+
+logger = logging.getLogger("outbound")
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+_PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_BULK: "bulk"}
+
+# rate_limit_args برای تحویل نتیجه‌ها و اعلان‌های غیرفوری
+BULK: dict[str, int] = {"priority": PRIORITY_BULK}
+
+# endpointهایی که در سقف پیام تلگرام حساب می‌شوند (سراسری و per-chat)؛ بقیه بدون throttle رد می‌شوند.
+# editMessage* هم حساب می‌شود (صفحه‌بندی تاریخچه و منوهای callback با هر tap)؛ sendChatAction پیام نیست.
+_THROTTLED_ENDPOINTS = frozenset({
+    "sendMessage", "sendPhoto", "sendMediaGroup", "sendDocument", "sendVideo", "sendAnimation",
+    "sendAudio", "sendVoice", "sendVideoNote", "sendSticker", "sendLocation", "sendVenue",
+    "sendContact", "sendPoll", "sendDice", "sendInvoice", "sendGame", "sendPaidMedia",
+    "copyMessage", "copyMessages", "forwardMessage", "forwardMessages",
+    "editMessageText", "editMessageCaption", "editMessageMedia", "editMessageReplyMarkup",
+    "editMessageLiveLocation", "stopMessageLiveLocation",
+})
+
+
+class PriorityTokenBucket:
+    """
+    token bucket با صف انتظار اولویت‌دار: تا وقتی کسی منتظر است، توکن به ترتیب (priority, ورود) داده می‌شود.
+    pause سطح را منفی می‌کند؛ یعنی همه تا پایان pause (و پر شدن دوباره) صبر می‌کنند.
+    rate <= 0 یعنی بی‌سقف.
+    """
+
+    def __init__(self, rate: float, burst: float | None = None, clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.burst = max(1.0, burst if burst is not None else rate)
+        self._clock = clock
+        self._tokens = self.burst
+        self._stamp = clock()
+        self._waiters: list[tuple[int, int, asyncio.Future[None]]] = []
+        self._seq = itertools.count()
+        self._pump_task: asyncio.Task | None = None
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    def _refill(self) -> None:
+        now = self._clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+    def pause(self, seconds: float) -> None:
+        if self.rate <= 0:
+            return
+        self._refill()
+        # توکن بعدی درست seconds ثانیه بعد
+        self._tokens = min(self._tokens, 1 - seconds * self.rate)
+
+    async def acquire(self, priority: int = PRIORITY_INTERACTIVE) -> None:
+        if self.rate <= 0:
+            return
+        self._refill()
+        if not self._waiters and self._tokens >= 1:
+            self._tokens -= 1
+            return
+
+        fut: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), fut))
+        if self._pump_task is None or self._pump_task.done():
+            self._pump_task = asyncio.create_task(self._pump())
+        # cancel شدن caller خود fut را cancel می‌کند و pump از رویش رد می‌شود
+        await fut
+
+    async def _pump(self) -> None:
+        while self._waiters:
+            fut = self._waiters[0][2]
+            if fut.done():
+                heapq.heappop(self._waiters)
+                continue
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                heapq.heappop(self._waiters)
+                fut.set_result(None)
+                continue
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    async def close(self) -> None:
+        if self._pump_task is not None:
+            self._pump_task.cancel()
+            try:
+                await self._pump_task
+            except asyncio.CancelledError:
+                pass
+            self._pump_task = None
+        for _, _, fut in self._waiters:
+            fut.cancel()
+        self._waiters.clear()
+
+
+class _ChatBucket:
+    """bucket یک چت با مدل بدهی: هر ارسال یک توکن برمی‌دارد و به اندازه کسری صبر می‌کند (FIFO)."""
+
+    __slots__ = ("rate", "burst", "level", "stamp")
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.level = burst
+        self.stamp = now
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.burst, self.level + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def reserve(self, now: float) -> float:
+        """ثانیه‌هایی که باید صبر کرد."""
+        self._refill(now)
+        self.level -= 1
+        return max(0.0, -self.level / self.rate)
+
+    def pause(self, seconds: float, now: float) -> None:
+        self._refill(now)
+        self.level = min(self.level, 1 - seconds * self.rate)
+
+    def idle(self, now: float) -> bool:
+        self._refill(now)
+        return self.level >= self.burst
+
+
+def _seconds(value: float | timedelta) -> float:
+    return value.total_seconds() if isinstance(value, timedelta) else float(value)
+
+
+def _is_group(chat_id: Any) -> bool:
+    return (isinstance(chat_id, int) and chat_id < 0) or (isinstance(chat_id, str) and chat_id.startswith("@"))
+
+
+class OutboundRateLimiter(BaseRateLimiter[dict]):
+    MAX_CHATS = 10_000  # بالاتر از این bucketهای پرشده (بی‌کار) دور ریخته می‌شوند
+
+    def __init__(
+        self,
+        global_per_second: float,
+        chat_per_second: float,
+        group_per_minute: float,
+        max_retries: int,
+        chat_burst: float = 1.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self._global = PriorityTokenBucket(global_per_second, clock=clock)
+        self.chat_per_second = chat_per_second
+        self.group_per_minute = group_per_minute
+        self.chat_burst = max(1.0, chat_burst)
+        self.max_retries = max(0, max_retries)
+        self._clock = clock
+        self._chats: OrderedDict[Any, _ChatBucket] = OrderedDict()
+
+        self.sent = 0
+        self.throttled = 0
+        self.retry_after = 0
+        self.lag = {p: RollingStats(1000) for p in _PRIORITY_NAMES}  # ثانیه
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        await self._global.close()
+
+    def _chat_bucket(self, chat_id: Any) -> _ChatBucket | None:
+        group = _is_group(chat_id)
+        rate = self.group_per_minute / 60 if group else self.chat_per_second
+        if rate <= 0:
+            return None
+
+        now = self._clock()
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= self.MAX_CHATS:
+                self._prune(now)
+            bucket = self._chats[chat_id] = _ChatBucket(rate, self.chat_burst, now)
+        else:
+            self._chats.move_to_end(chat_id)
+        return bucket
+
+    def _prune(self, now: float) -> None:
+        # از قدیمی‌ترین استفاده؛ bucketی که هنوز بدهی دارد نگه داشته می‌شود
+        for chat_id in list(self._chats)[: len(self._chats) // 2]:
+            if self._chats[chat_id].idle(now):
+                del self._chats[chat_id]
+
+    async def _throttle(self, chat_id: Any, priority: int) -> None:
+        bucket = self._chat_bucket(chat_id) if chat_id is not None else None
+        if bucket is not None:
+            delay = bucket.reserve(self._clock())
+            if delay > 0:
+                await asyncio.sleep(delay)
+        await self._global.acquire(priority)
+
+    @staticmethod
+    async def _call(callback: Callable[..., Coroutine[Any, Any, Any]], args: Any, kwargs: dict[str, Any], endpoint: str) -> Any:
+        m = get_metrics()
+        if m is None:
+            return await callback(*args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return await callback(*args, **kwargs)
+        except Exception:
+            m.api_errors.inc((endpoint,))
+            raise
+        finally:
+            m.api_seconds.observe(time.perf_counter() - started, (endpoint,))
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, bool | dict[str, Any] | list[dict[str, Any]]]],
+        args: Any,
+        kwargs: dict[str, Any],
+        endpoint: str,
+        data: dict[str, Any],
+        rate_limit_args: dict | None,
+    ) -> bool | dict[str, Any] | list[dict[str, Any]]:
+        if endpoint not in _THROTTLED_ENDPOINTS:
+            return await self._call(callback, args, kwargs, endpoint)
+
+        priority = (rate_limit_args or {}).get("priority", PRIORITY_INTERACTIVE)
+        if priority not in self.lag:
+            priority = PRIORITY_BULK
+        chat_id = data.get("chat_id")
+
+        started = self._clock()
+        attempt = 0
+        while True:
+            await self._throttle(chat_id, priority)
+            if attempt == 0:
+                lag = self._clock() - started
+                self.lag[priority].add(lag)
+                if lag > 0.01:
+                    self.throttled += 1
+            try:
+                result = await self._call(callback, args, kwargs, endpoint)
+            except RetryAfter as e:
+                self.retry_after += 1
+                wait = _seconds(e.retry_after)
+                # pause روی bucket یعنی بقیه ارسال‌های همان چت (یا کل bot) هم پشت این صبر می‌کنند؛
+                # تلاش بعدی هم از همان throttle رد می‌شود
+                bucket = self._chat_bucket(chat_id) if chat_id is not None else None
+                paused = True
+                if bucket is not None:
+                    bucket.pause(wait, self._clock())
+                elif chat_id is None and self._global.rate > 0:
+                    self._global.pause(wait)
+                else:
+                    paused = False
+                if attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                logger.warning("%s flood-limited (chat=%s); retry %s/%s in %.0fs", endpoint, chat_id, attempt, self.max_retries, wait)
+                if not paused:
+                    await asyncio.sleep(wait)
+                continue
+            self.sent += 1
+            return result
+
+    def stats(self) -> dict:
+        return {
+            "sent": self.sent,
+            "throttled": self.throttled,
+            "retry_after": self.retry_after,
+            "waiting": self._global.waiting,
+            "lag": {name: self.lag[p].summary() for p, name in _PRIORITY_NAMES.items()},
+        }
+
+
+def _bot_share() -> float:
+    return min(1.0, max(0.0, settings.OUTBOUND_BOT_SHARE_PERCENT / 100))
+
+
+def bot_global_share() -> float:
+    """سهم پروسه bot: با worker داخلی تنها فرستنده است؛ در ingest-only فقط OUTBOUND_BOT_SHARE_PERCENT."""
+    return 1.0 if settings.EMBEDDED_WORKER else _bot_share()
+
+
+def worker_global_share(processes: int) -> float:
+    """سهم هر پروسه worker مستقل: باقی‌مانده سهم bot، تقسیم بر تعداد پروسه‌ها."""
+    return (1.0 - _bot_share()) / max(1, processes)
+
+
+def build_rate_limiter(global_share: float = 1.0) -> OutboundRateLimiter:
+    """global_share: سهم این پروسه از سقف سراسری (bot و workerها یک توکن را شریک‌اند)."""
+    rate = settings.OUTBOUND_GLOBAL_PER_SECOND * global_share
+    if settings.OUTBOUND_GLOBAL_PER_SECOND > 0:
+        rate = max(rate, 0.1)  # سهم صفر نباید به معنی بی‌سقف (rate=0) شود
+    return OutboundRateLimiter(
+        global_per_second=rate,
+        chat_per_second=settings.OUTBOUND_CHAT_PER_SECOND,
+        group_per_minute=settings.OUTBOUND_GROUP_PER_MINUTE,
+        max_retries=settings.OUTBOUND_MAX_RETRIES,
+    )
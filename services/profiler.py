@@ -0,0 +1,337 @@
+"""
+پروفایلر نمونه‌برداری event loop برای وقتی که latency در production بالا می‌رود (بدون debugger و ری‌استارت).
+
+- یک thread جدا هر PROFILE_INTERVAL_MS پشته‌ی thread حلقه را از sys._current_frames برمی‌دارد؛
+  خود حلقه دست نمی‌خورد. هر نمونه وزن wall (فاصله از نمونه قبلی) و CPU (ساعت CPU همان thread) دارد.
+- جمع‌بندی: handlerهای bot، coroutine تسک در حال اجرا، و تابع‌ها (self و inclusive).
+  نمونه‌هایی که حلقه داخل selector منتظر است idle حساب می‌شوند.
+- slow callback: در مدت پروفایل Handle._run پیچیده می‌شود و هر callback که بیشتر از
+  PROFILE_SLOW_CALLBACK_MS حلقه را نگه دارد با آخرین پشته‌ی نمونه‌برداری‌شده‌اش ثبت می‌شود.
+
+پروسه‌های worker مستقل (QUEUE_BACKEND=postgres) روی کانال profile_requests گوش می‌دهند
+و گزارش خودشان را مستقیم به همان چت می‌فرستند.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from pathlib import Path
+from types import FrameType
+
+from telegram import Bot, InputFile
+
+from config import settings
+
+logger = logging.getLogger("profiler")
+
+_ROOT = str(Path(__file__).resolve().parent.parent) + os.sep
+_HANDLERS_DIR = _ROOT + "bot" + os.sep
+_STDLIB = os.path.dirname(os.__file__) + os.sep
+_SITE = "site-packages" + os.sep
+_MAX_DEPTH = 64
+_TOP = 25
+
+Key = tuple[str, int, str]  # (فایل، خط شروع، qualname)
+
+
+def _short(filename: str) -> str:
+    # کتابخانه‌ها از site-packages/ به بعد، stdlib از lib/pythonX.Y/ به بعد
+    i = filename.rfind(_SITE)
+    if i >= 0:
+        return filename[i + len(_SITE):]
+    for prefix in (_ROOT, _STDLIB):
+        if filename.startswith(prefix):
+            return filename[len(prefix):]
+    return filename
+
+
+def _key(frame: FrameType) -> Key:
+    code = frame.f_code
+    return code.co_filename, code.co_firstlineno, getattr(code, "co_qualname", code.co_name)
+
+
+def _fmt_key(key: Key) -> str:
+    filename, line, name = key
+    return f"{name} ({_short(filename)}:{line})"
+
+
+def _is_idle(leaf: FrameType) -> bool:
+    # حلقه منتظر I/O است (EpollSelector.select و مشابه‌ها)
+    return leaf.f_code.co_filename.endswith("selectors.py")
+
+
+def _task_name(task: asyncio.Task | None) -> str:
+    if task is None:
+        return "(callback خارج از task)"
+    coro = task.get_coro()
+    return getattr(coro, "__qualname__", None) or repr(coro)
+
+
+def _describe_callback(handle: asyncio.Handle) -> str:
+    cb = getattr(handle, "_callback", None)
+    owner = getattr(cb, "__self__", None)
+    if isinstance(owner, asyncio.Task):
+        return f"task {_task_name(owner)}"
+    return getattr(cb, "__qualname__", None) or repr(cb)
+
+
+def _thread_cpu_clock(tid: int):
+    """ساعت CPU یک thread دیگر؛ جایی که نیست (غیر لینوکس) CPU کل پروسه."""
+    try:
+        clock_id = time.pthread_getcpuclockid(tid)
+        time.clock_gettime(clock_id)
+        return lambda: time.clock_gettime(clock_id)
+    except (AttributeError, OSError):
+        return time.process_time
+
+
+class _Stat:
+    __slots__ = ("samples", "wall", "cpu")
+
+    def __init__(self):
+        self.samples = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+
+    def add(self, wall: float, cpu: float) -> None:
+        self.samples += 1
+        self.wall += wall
+        self.cpu += cpu
+
+
+class SamplingProfiler:
+    SLOW_STACK_DEPTH = 12
+    MAX_SLOW = 200  # بیشتر از این فقط شمرده می‌شوند
+    SWITCH_INTERVAL = 0.0002
+
+    def __init__(self, interval: float, slow_threshold: float):
+        self.interval = max(0.001, interval)
+        self.slow_threshold = slow_threshold
+
+        self.samples = 0
+        self.idle = _Stat()
+        self.busy = _Stat()
+        self.handlers: dict[Key, _Stat] = defaultdict(_Stat)
+        self.tasks: dict[str, _Stat] = defaultdict(_Stat)
+        self.self_time: dict[Key, _Stat] = defaultdict(_Stat)
+        self.inclusive: dict[Key, _Stat] = defaultdict(_Stat)
+        self.slow: list[tuple[float, str, list[Key]]] = []
+        self.slow_count = 0
+        self.callbacks = 0
+
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._tid = 0
+        self._stop = threading.Event()
+        self._last_busy: tuple[float, list[Key]] = (0.0, [])
+        self.duration = 0.0
+        self.cpu_total = 0.0
+
+    # -------- sampler thread --------
+    def _sample(self) -> None:
+        cpu_clock = _thread_cpu_clock(self._tid)
+        last_wall = time.perf_counter()
+        last_cpu = cpu_clock()
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            cpu = cpu_clock()
+            wall_delta, cpu_delta = now - last_wall, cpu - last_cpu
+            last_wall, last_cpu = now, cpu
+
+            frame = sys._current_frames().get(self._tid)
+            if frame is None:
+                continue
+            self._record(frame, asyncio.current_task(self._loop), wall_delta, cpu_delta, now)
+
+    def _record(self, leaf: FrameType, task: asyncio.Task | None, wall: float, cpu: float, now: float) -> None:
+        self.samples += 1
+        if _is_idle(leaf):
+            self.idle.add(wall, cpu)
+            return
+        self.busy.add(wall, cpu)
+
+        stack: list[Key] = []
+        handler: Key | None = None
+        frame: FrameType | None = leaf
+        while frame is not None and len(stack) < _MAX_DEPTH:
+            key = _key(frame)
+            stack.append(key)
+            if key[0].startswith(_HANDLERS_DIR):
+                handler = key  # بیرونی‌ترین frame داخل bot/
+            frame = frame.f_back
+
+        self.self_time[stack[0]].add(wall, cpu)
+        for key in set(stack):  # بازگشتی‌ها یک بار
+            self.inclusive[key].add(wall, cpu)
+        if handler is not None:
+            self.handlers[handler].add(wall, cpu)
+        self.tasks[_task_name(task)].add(wall, cpu)
+        self._last_busy = (now, stack)
+
+    # -------- slow callbacks (داخل thread حلقه) --------
+    def _on_callback(self, handle: asyncio.Handle, started: float, elapsed: float) -> None:
+        self.callbacks += 1
+        if elapsed < self.slow_threshold:
+            return
+        self.slow_count += 1
+        if len(self.slow) >= self.MAX_SLOW:
+            return
+        stamp, stack = self._last_busy
+        # پشته فقط اگر نمونه‌اش وسط همین callback گرفته شده باشد
+        stack = stack[: self.SLOW_STACK_DEPTH] if stamp >= started else []
+        self.slow.append((elapsed, _describe_callback(handle), stack))
+
+    def _patch_handles(self):
+        original = asyncio.events.Handle._run
+        profiler = self
+        clock = time.perf_counter
+
+        def _run(handle):
+            started = clock()
+            try:
+                return original(handle)
+            finally:
+                profiler._on_callback(handle, started, clock() - started)
+
+        asyncio.events.Handle._run = _run
+        return original
+
+    async def run(self, seconds: float, role: str) -> str:
+        self._loop = asyncio.get_running_loop()
+        self._tid = threading.get_ident()
+        cpu_clock = _thread_cpu_clock(self._tid)
+
+        original = self._patch_handles()
+        # بدون این، thread نمونه‌بردار GIL را معمولاً وقتی می‌گیرد که حلقه به select رسیده
+        # و کار CPU-bound کوتاه (کمتر از 5ms پیش‌فرض) به حساب idle می‌رود
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(min(switch_interval, self.SWITCH_INTERVAL))
+        sampler = threading.Thread(target=self._sample, name="profiler", daemon=True)
+        started, cpu_started = time.perf_counter(), cpu_clock()
+        sampler.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            self._stop.set()
+            asyncio.events.Handle._run = original
+            sys.setswitchinterval(switch_interval)
+            await asyncio.to_thread(sampler.join)
+            self.duration = time.perf_counter() - started
+            self.cpu_total = cpu_clock() - cpu_started
+        return self.report(role)
+
+    # -------- گزارش --------
+    def _table(self, title: str, rows: dict, fmt, by: str = "wall") -> list[str]:
+        total = self.busy.wall or 1.0
+        ordered = sorted(rows.items(), key=lambda kv: getattr(kv[1], by), reverse=True)[:_TOP]
+        lines = ["", f"== {title} ==", f"{'wall ms':>10} {'%busy':>6} {'cpu ms':>10} {'n':>6}  name"]
+        for name, st in ordered:
+            lines.append(
+                f"{st.wall * 1000:>10.1f} {st.wall / total * 100:>5.1f}% {st.cpu * 1000:>10.1f} {st.samples:>6}  {fmt(name)}"
+            )
+        if not ordered:
+            lines.append("(هیچ)")
+        return lines
+
+    def report(self, role: str) -> str:
+        sampled = self.busy.wall + self.idle.wall or 1.0
+        lines = [
+            f"profile pid={os.getpid()} role={role} at={datetime.now().isoformat(timespec='seconds')}",
+            f"duration={self.duration:.1f}s interval={self.interval * 1000:.1f}ms samples={self.samples}",
+            f"loop busy={self.busy.wall / sampled * 100:.1f}% ({self.busy.wall * 1000:.0f}ms wall, {self.busy.cpu * 1000:.0f}ms cpu) "
+            f"idle={self.idle.wall / sampled * 100:.1f}%",
+            f"loop thread cpu={self.cpu_total * 1000:.0f}ms ({self.cpu_total / (self.duration or 1.0) * 100:.1f}% of one core)",
+            f"callbacks={self.callbacks} slow(>={self.slow_threshold * 1000:.0f}ms)={self.slow_count}",
+        ]
+        lines += self._table("handlers (bot/)", self.handlers, _fmt_key)
+        lines += self._table("coroutines (task در حال اجرا)", self.tasks, str)
+        lines += self._table("functions, self time", self.self_time, _fmt_key)
+        lines += self._table("functions, self cpu", self.self_time, _fmt_key, by="cpu")
+        lines += self._table("functions, inclusive", self.inclusive, _fmt_key)
+
+        lines += ["", f"== slow callbacks (>= {self.slow_threshold * 1000:.0f}ms) =="]
+        if not self.slow:
+            lines.append("(هیچ)")
+        for elapsed, desc, stack in sorted(self.slow, key=lambda s: s[0], reverse=True):
+            lines.append(f"{elapsed * 1000:>8.1f}ms  {desc}")
+            lines += [f"            at {_fmt_key(key)}" for key in stack]
+        return "\n".join(lines) + "\n"
+
+
+_lock = asyncio.Lock()
+
+
+def busy() -> bool:
+    return _lock.locked()
+
+
+async def profile(seconds: float, role: str = "bot") -> str:
+    """هر پروسه در هر لحظه یک پروفایل؛ Handle._run سراسری است."""
+    seconds = max(1.0, min(float(settings.PROFILE_MAX_SECONDS), seconds))
+    async with _lock:
+        profiler = SamplingProfiler(settings.PROFILE_INTERVAL_MS / 1000, settings.PROFILE_SLOW_CALLBACK_MS / 1000)
+        return await profiler.run(seconds, role)
+
+
+async def send_report(bot: Bot, chat_id: int, report: str, role: str = "bot", **kwargs) -> None:
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    await bot.send_document(
+        chat_id,
+        InputFile(report.encode(), filename=f"profile-{role}-{os.getpid()}-{stamp}.txt"),
+        caption="\n".join(report.splitlines()[:3]),
+        **kwargs,
+    )
+
+
+class ProfileListener:
+    """برای پروسه‌های worker مستقل: LISTEN profile_requests و فرستادن گزارش با Bot خود worker."""
+
+    def __init__(self, bot: Bot, send_kwargs: dict | None = None):
+        self.bot = bot
+        self.send_kwargs = send_kwargs or {}
+        self._conn = None
+        self._tasks: set[asyncio.Task] = set()
+
+    def _on_notify(self, conn, pid, channel, payload) -> None:
+        try:
+            req = json.loads(payload)
+            seconds, chat_id = float(req["seconds"]), int(req["chat_id"])
+        except (ValueError, KeyError, TypeError):
+            logger.warning("Bad profile request: %r", payload)
+            return
+        if busy():
+            logger.info("Profile already running; request ignored")
+            return
+        task = asyncio.create_task(self._run(seconds, chat_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, seconds: float, chat_id: int) -> None:
+        try:
+            report = await profile(seconds, role="worker")
+            await send_report(self.bot, chat_id, report, role="worker", **self.send_kwargs)
+        except Exception:
+            logger.exception("Profile run failed")
+
+    async def start(self) -> None:
+        from config.database import connect_listener
+        from db.repository import PROFILE_CHANNEL
+
+        try:
+            self._conn = await connect_listener(PROFILE_CHANNEL, self._on_notify)
+        except Exception:
+            logger.warning("LISTEN %s unavailable; /profile won't cover this worker", PROFILE_CHANNEL, exc_info=True)
+
+    async def stop(self) -> None:
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._conn is not None and not self._conn.is_closed():
+            await self._conn.close()
+        self._conn = None
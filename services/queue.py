@@ -1,7 +1,84 @@
 from __future__ import annotations
 
 import asyncio
-from dataclasses import dataclass
+import logging
+import os
+import socket
+import time
+from collections import OrderedDict, deque
+from collections.abc import Callable, Collection
+from dataclasses import dataclass, field
+from typing import Protocol
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from config import settings
+from config.database import get_session, connect_listener
+from db import repository as repo
+from db.models import Job
+
+logger = logging.getLogger("queue")
+
+# Lanes اولویت (به ترتیب اولویت)
+LANE_VIP = "vip"
+LANE_CREDIT = "credit"
+LANE_FREE = "free"
+LANES = (LANE_VIP, LANE_CREDIT, LANE_FREE)
+
+
+def lane_for_user(user) -> str:
+    """user: هر چیزی با is_vip و credits (User یا QuotaReservation)."""
+    if user is None:
+        return LANE_FREE
+    if getattr(user, "is_vip", False):
+        return LANE_VIP
+    if (getattr(user, "credits", 0) or 0) > 0:
+        return LANE_CREDIT
+    return LANE_FREE
+
+
+class LaneScheduler:
+    """
+    smooth weighted round-robin بین laneها (مثل nginx): با وزن‌های 6/3/1 از هر 10 برداشت
+    6 تا vip، 3 تا credit و 1 تا free است؛ پس free هیچ‌وقت کامل گرسنه نمی‌ماند.
+    فقط laneهایی که job آماده دارند در دور شرکت می‌کنند؛ lane خالی اعتبار جمع نمی‌کند
+    تا بعداً یک‌باره همه‌چیز را نگیرد.
+    """
+
+    def __init__(self, weights: dict[str, float]):
+        self.weights = {lane: max(0.001, float(weights.get(lane, 1))) for lane in LANES}
+        self._current = {lane: 0.0 for lane in LANES}
+
+    def order(self, eligible: Collection[str]) -> list[str]:
+        """ترتیب ترجیح برای برداشت بعدی بین laneهای غیرخالی."""
+        lanes = [lane for lane in LANES if lane in eligible]
+        return sorted(lanes, key=lambda lane: -(self._current[lane] + self.weights[lane]))
+
+    def position(self, lane: str, ahead_in_lane: int, depths: dict[str, int]) -> int:
+        """
+        نوبت تقریبی job که ahead_in_lane job جلوتر از خودش در lane دارد: تا k=ahead_in_lane+1 برداشت
+        از این lane، هر lane دیگر به نسبت وزنش k*w/w_lane برداشت می‌گیرد (حداکثر به اندازه عمقش).
+        """
+        k = ahead_in_lane + 1
+        own = self.weights.get(lane, self.weights[LANE_FREE])
+        others = sum(
+            min(depths.get(other, 0), int(k * self.weights[other] / own))
+            for other in LANES
+            if other != lane
+        )
+        return k + others
+
+    def commit(self, picked: str, eligible: Collection[str]) -> None:
+        total = 0.0
+        for lane in LANES:
+            if lane in eligible:
+                self._current[lane] += self.weights[lane]
+                total += self.weights[lane]
+            else:
+                self._current[lane] = 0.0
+        self._current[picked] -= total
 
 
 @dataclass
@@ -11,15 +88,346 @@ class EditJob:
     chat_id: int
     image_file_ids: list[str]
     prompt: str
+    lane: str = LANE_FREE
+    # موازی image_file_ids؛ کلید کش دانلود (jobهای قدیمی ممکن است نداشته باشند)
+    image_unique_ids: list[str] = field(default_factory=list)
+
+    # متادیتای صف
+    job_id: int | None = None
+    attempts: int = 0
+    enqueued_at: float = field(default_factory=time.time)
+
+    def payload(self) -> dict:
+        return {
+            "image_file_ids": self.image_file_ids,
+            "image_unique_ids": self.image_unique_ids,
+            "prompt": self.prompt,
+        }
+
+    @classmethod
+    def from_row(cls, row: Job) -> "EditJob":
+        return cls(
+            request_id=row.request_id,
+            user_tg_id=row.user_tg_id,
+            chat_id=row.chat_id,
+            image_file_ids=list(row.payload.get("image_file_ids") or []),
+            prompt=row.payload.get("prompt") or "",
+            lane=row.lane,
+            image_unique_ids=list(row.payload.get("image_unique_ids") or []),
+            job_id=row.id,
+            attempts=row.attempts,
+            enqueued_at=row.enqueued_at.timestamp(),
+        )
+
+
+class QueueFull(Exception):
+    """صف به QUEUE_MAX_DEPTH رسیده؛ درخواست جدید پذیرفته نمی‌شود."""
+
+    def __init__(self, depth: int):
+        super().__init__(f"queue full (depth={depth})")
+        self.depth = depth
+
+
+# مجموعه کاربرانی که فعلاً نباید jobشان برداشته شود (هر بار از نو خوانده می‌شود)
+ExcludeFn = Callable[[], Collection[int]]
+
+
+class JobQueue(Protocol):
+    async def put(self, job: EditJob, session: AsyncSession | None = None) -> None: ...
+    async def get(self, exclude: ExcludeFn | None = None) -> EditJob: ...
+    def wakeup(self) -> None: ...
+    async def ack(self, job: EditJob, session: AsyncSession | None = None) -> None: ...
+    async def fail(
+        self, job: EditJob, error: str, session: AsyncSession | None = None, retryable: bool = True,
+    ) -> bool: ...
+    async def heartbeat(self, job: EditJob) -> None: ...
+    async def recover(self) -> None: ...
+    async def depth(self) -> int: ...
+    async def depth_by_lane(self) -> dict[str, int]: ...
+    async def position(self, job: EditJob) -> int: ...
+
+
+# -------- In-memory backend (تست/توسعه) --------
+_PENDING_PUTS = "pending_queue_puts"
+
+
+@event.listens_for(Session, "after_commit")
+def _flush_pending_puts(session: Session) -> None:
+    for queue, job in session.info.pop(_PENDING_PUTS, ()):
+        queue.put_nowait(job)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _drop_pending_puts(session: Session, previous_transaction) -> None:
+    session.info.pop(_PENDING_PUTS, None)
+
+
+class MemoryQueue:
+    """
+    صف داخل همین پروسه (با ری‌استارت خالی می‌شود).
+    laneها با LaneScheduler انتخاب می‌شوند؛ داخل هر lane هر کاربر یک FIFO جدا دارد
+    و get بین کاربران round-robin می‌چرخد.
+    """
+
+    def __init__(self, max_attempts: int, lane_weights: dict[str, float] | None = None):
+        self.max_attempts = max_attempts
+        self._lanes: dict[str, OrderedDict[int, deque[EditJob]]] = {lane: OrderedDict() for lane in LANES}
+        self._scheduler = LaneScheduler(lane_weights or {})
+        self._size = 0
+        self._wake = asyncio.Event()
+
+    def put_nowait(self, job: EditJob) -> None:
+        by_user = self._lanes.get(job.lane, self._lanes[LANE_FREE])
+        by_user.setdefault(job.user_tg_id, deque()).append(job)
+        self._size += 1
+        self._wake.set()
 
+    async def put(self, job: EditJob, session: AsyncSession | None = None) -> None:
+        if session is None:
+            self.put_nowait(job)
+        else:
+            # فقط اگر تراکنش caller commit شد وارد صف شود
+            session.sync_session.info.setdefault(_PENDING_PUTS, []).append((self, job))
 
-_QUEUE: asyncio.Queue[EditJob] | None = None
+    def _pop_fair(self, excluded: Collection[int]) -> EditJob | None:
+        eligible = [lane for lane in LANES if self._lanes[lane]]
+        for lane in self._scheduler.order(eligible):
+            by_user = self._lanes[lane]
+            for uid in by_user:
+                if uid in excluded:
+                    continue
+                jobs = by_user.pop(uid)
+                job = jobs.popleft()
+                if jobs:
+                    # نوبت بعدی این کاربر آخر صف کاربران
+                    by_user[uid] = jobs
+                self._size -= 1
+                self._scheduler.commit(lane, eligible)
+                return job
+        return None
 
+    async def get(self, exclude: ExcludeFn | None = None) -> EditJob:
+        while True:
+            self._wake.clear()
+            job = self._pop_fair(exclude() if exclude else ())
+            if job is not None:
+                job.attempts += 1
+                return job
+            await self._wake.wait()
 
-def get_queue() -> asyncio.Queue[EditJob]:
+    def wakeup(self) -> None:
+        self._wake.set()
+
+    async def ack(self, job: EditJob, session: AsyncSession | None = None) -> None:
+        return None
+
+    async def fail(
+        self, job: EditJob, error: str, session: AsyncSession | None = None, retryable: bool = True,
+    ) -> bool:
+        if retryable and job.attempts < self.max_attempts:
+            self.put_nowait(job)
+            return True
+        return False
+
+    async def heartbeat(self, job: EditJob) -> None:
+        return None
+
+    async def recover(self) -> None:
+        return None
+
+    async def depth(self) -> int:
+        return self._size
+
+    async def depth_by_lane(self) -> dict[str, int]:
+        return {lane: sum(len(jobs) for jobs in by_user.values()) for lane, by_user in self._lanes.items()}
+
+    def _ahead_in_lane(self, job: EditJob) -> int:
+        """
+        jobهای همان lane که با round-robin کاربران زودتر برداشته می‌شوند: کاربران قبل از این کاربر
+        در چرخش تا j+1 job، کاربران بعدی تا j job (j = jobهای جلوتر خود کاربر).
+        """
+        by_user = self._lanes.get(job.lane, self._lanes[LANE_FREE])
+        own = by_user.get(job.user_tg_id, ())
+        j = next((i for i, queued in enumerate(own) if queued is job), None)
+        if j is None:
+            return 0
+        ahead = j
+        before = True
+        for uid, jobs in by_user.items():
+            if uid == job.user_tg_id:
+                before = False
+                continue
+            ahead += min(len(jobs), j + 1 if before else j)
+        return ahead
+
+    async def position(self, job: EditJob) -> int:
+        """نوبت تقریبی در برداشت: ترتیب داخل lane به‌علاوه سهم وزنی laneهای دیگر (LaneScheduler.position)."""
+        depths = await self.depth_by_lane()
+        return self._scheduler.position(job.lane, self._ahead_in_lane(job), depths)
+
+
+# -------- Postgres backend (پایدار) --------
+class PostgresQueue:
+    """
+    صف پایدار روی جدول jobs:
+    claim با FOR UPDATE SKIP LOCKED، lease با heartbeat، retry با backoff،
+    و آزاد کردن leaseهای منقضی (worker کرش‌کرده) موقع استارت و به‌صورت دوره‌ای.
+    """
+
+    def __init__(
+        self,
+        lease_seconds: float,
+        max_attempts: int,
+        backoff_seconds: float,
+        poll_seconds: float,
+        per_user_limit: int = 0,
+        lane_weights: dict[str, float] | None = None,
+    ):
+        self.lease_seconds = lease_seconds
+        self.per_user_limit = per_user_limit
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.poll_seconds = poll_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{id(self):x}"
+
+        self._scheduler = LaneScheduler(lane_weights or {})
+        self._wake = asyncio.Event()
+        self._listen_conn = None
+        self._next_reap = 0.0
+
+    async def put(self, job: EditJob, session: AsyncSession | None = None) -> None:
+        if session is not None:
+            row = await repo.insert_job(session, job.request_id, job.user_tg_id, job.chat_id, job.payload(), job.lane)
+            job.job_id = row.id
+            return
+
+        async with get_session() as own:
+            row = await repo.insert_job(own, job.request_id, job.user_tg_id, job.chat_id, job.payload(), job.lane)
+            await own.commit()
+        job.job_id = row.id
+
+    async def claim(self, limit: int = 1, exclude_users: Collection[int] = ()) -> list[EditJob]:
+        async with get_session() as session:
+            eligible = await repo.ready_lanes(session, LANES)
+            if not eligible:
+                return []
+            rows = await repo.claim_jobs(
+                session, self.owner, self.lease_seconds, limit,
+                per_user_limit=self.per_user_limit,
+                exclude_users=exclude_users,
+                lane_order=self._scheduler.order(eligible),
+            )
+            await session.commit()
+        for r in rows:
+            if r.lane in eligible:
+                self._scheduler.commit(r.lane, eligible)
+        return [EditJob.from_row(r) for r in rows]
+
+    async def get(self, exclude: ExcludeFn | None = None) -> EditJob:
+        await self._ensure_listening()
+        while True:
+            if time.monotonic() >= self._next_reap:
+                await self.recover()
+
+            self._wake.clear()
+            jobs = await self.claim(1, exclude() if exclude else ())
+            if jobs:
+                return jobs[0]
+
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.poll_seconds)
+            except asyncio.TimeoutError:
+                pass
+
+    def wakeup(self) -> None:
+        self._wake.set()
+
+    async def ack(self, job: EditJob, session: AsyncSession | None = None) -> None:
+        """session داده شود: ack با همان تراکنشی commit می‌شود که وضعیت request را عوض کرده."""
+        if session is not None:
+            await repo.ack_job(session, job.job_id)
+            return
+        async with get_session() as own:
+            await repo.ack_job(own, job.job_id)
+            await own.commit()
+
+    async def fail(
+        self, job: EditJob, error: str, session: AsyncSession | None = None, retryable: bool = True,
+    ) -> bool:
+        """True یعنی دوباره تلاش می‌شود؛ False یعنی job دفن شد (dead)."""
+        max_attempts = self.max_attempts if retryable else 0
+        if session is not None:
+            return await repo.retry_job(session, job.job_id, error[:1000], max_attempts, self.backoff_seconds)
+        async with get_session() as own:
+            retry = await repo.retry_job(own, job.job_id, error[:1000], max_attempts, self.backoff_seconds)
+            await own.commit()
+        return retry
+
+    async def heartbeat(self, job: EditJob) -> None:
+        async with get_session() as session:
+            ok = await repo.heartbeat_job(session, job.job_id, self.owner, self.lease_seconds)
+            await session.commit()
+        if not ok:
+            logger.warning("Lost lease on job %s (request_id=%s)", job.job_id, job.request_id)
+
+    async def recover(self) -> None:
+        """leaseهای منقضی دوباره ready؛ آن‌هایی که تلاشی ندارند fail + برگشت سهمیه."""
+        self._next_reap = time.monotonic() + self.lease_seconds / 2
+        async with get_session() as session:
+            dead = await repo.reap_expired_jobs(session, self.max_attempts)
+            for request_id in dead:
+                await repo.set_request_status(session, request_id, "fail", error="lease expired")
+                await repo.refund_daily_edit(session, request_id)
+            await session.commit()
+        if dead:
+            logger.warning("Buried %s orphaned jobs after lease expiry", len(dead))
+
+    async def depth(self) -> int:
+        async with get_session() as session:
+            return await repo.count_jobs(session)
+
+    async def depth_by_lane(self) -> dict[str, int]:
+        async with get_session() as session:
+            counts = await repo.count_jobs_by_lane(session)
+        return {lane: counts.get(lane, 0) for lane in LANES}
+
+    async def position(self, job: EditJob) -> int:
+        """نوبت تقریبی در برداشت: ترتیب داخل lane به‌علاوه سهم وزنی laneهای دیگر (LaneScheduler.position)."""
+        async with get_session() as session:
+            ahead = await repo.count_jobs_ahead(session, job.job_id)
+            counts = await repo.count_jobs_by_lane(session)
+        return self._scheduler.position(job.lane, ahead, counts)
+
+    # -------- LISTEN jobs_ready --------
+    def _on_notify(self, conn, pid, channel, payload) -> None:
+        self._wake.set()
+
+    async def _ensure_listening(self) -> None:
+        if self._listen_conn is not None and not self._listen_conn.is_closed():
+            return
+        try:
+            self._listen_conn = await connect_listener(repo.JOBS_CHANNEL, self._on_notify)
+        except Exception:
+            logger.warning("LISTEN %s unavailable, polling every %ss", repo.JOBS_CHANNEL, self.poll_seconds, exc_info=True)
+
+
+_QUEUE: JobQueue | None = None
+
+
+def get_queue() -> JobQueue:
     global _QUEUE
     if _QUEUE is None:
-        _QUEUE = asyncio.Queue()
+        if settings.QUEUE_BACKEND == "memory":
+            _QUEUE = MemoryQueue(settings.QUEUE_MAX_ATTEMPTS, settings.QUEUE_LANE_WEIGHTS)
+        else:
+            _QUEUE = PostgresQueue(
+                lease_seconds=settings.QUEUE_LEASE_SECONDS,
+                max_attempts=settings.QUEUE_MAX_ATTEMPTS,
+                backoff_seconds=settings.QUEUE_RETRY_BACKOFF_SECONDS,
+                poll_seconds=settings.QUEUE_POLL_SECONDS,
+                per_user_limit=settings.WORKER_PER_USER_LIMIT,
+                lane_weights=settings.QUEUE_LANE_WEIGHTS,
+            )
     return _QUEUE
 
 
@@ -29,14 +437,30 @@ async def enqueue_request(
     chat_id: int,
     image_file_ids: list[str],
     prompt: str,
-) -> None:
+    session: AsyncSession | None = None,
+    user=None,
+    image_unique_ids: list[str] | None = None,
+) -> EditJob:
+    """
+    session داده شود: job داخل همان تراکنش ثبت می‌شود (با commit caller قطعی می‌شود).
+    user (ردیف کاربر یا QuotaReservation) lane را تعیین می‌کند: vip > credit > free.
+    اگر صف به QUEUE_MAX_DEPTH رسیده باشد QueueFull (caller باید rollback کند).
+    """
     q = get_queue()
-    await q.put(
-        EditJob(
-            request_id=request_id,
-            user_tg_id=user_tg_id,
-            chat_id=chat_id,
-            image_file_ids=image_file_ids,
-            prompt=prompt,
-        )
+    if settings.QUEUE_MAX_DEPTH > 0:
+        # سقف نرم: چند put هم‌زمان ممکن است کمی از آن رد شوند
+        depth = await q.depth()
+        if depth >= settings.QUEUE_MAX_DEPTH:
+            raise QueueFull(depth)
+
+    job = EditJob(
+        request_id=request_id,
+        user_tg_id=user_tg_id,
+        chat_id=chat_id,
+        image_file_ids=image_file_ids,
+        prompt=prompt,
+        lane=lane_for_user(user),
+        image_unique_ids=list(image_unique_ids or []),
     )
+    await q.put(job, session=session)
+    return job
@@ -0,0 +1,203 @@
+from __future__ import annotations
+
+import time
+from dataclasses import dataclass
+from typing import Callable, Protocol
+
+from config import settings, runtime
+from config.database import get_session
+from db import repository as repo
+from db.cache import TTLCache
+
+# اکشن‌ها (هر کدوم بودجه جدا دارند)
+ACTION_MENU = "menu"
+ACTION_UPLOAD = "upload"
+ACTION_SUBMIT = "submit"
+
+TOKEN_BUCKET = "token_bucket"
+SLIDING_WINDOW = "sliding_window"
+
+
+@dataclass(frozen=True)
+class Budget:
+    """limit عمل در هر window ثانیه."""
+    limit: int
+    window: float
+    algorithm: str = TOKEN_BUCKET
+
+    @classmethod
+    def parse(cls, raw: str, algorithm: str = TOKEN_BUCKET) -> "Budget":
+        """فرمت: "limit/window_seconds" مثل "5/10"."""
+        limit, _, window = raw.partition("/")
+        return cls(limit=max(1, int(limit)), window=max(0.001, float(window or 1)), algorithm=algorithm)
+
+
+@dataclass(frozen=True)
+class Decision:
+    allowed: bool
+    retry_after: float = 0.0
+
+
+# -------- الگوریتم‌ها (pure) --------
+def token_bucket_retry(available: float, budget: Budget) -> float:
+    rate = budget.limit / budget.window
+    return max(0.0, (1 - available) / rate)
+
+
+def sliding_window_retry(cur: float, prev: float, elapsed: float, budget: Budget) -> float:
+    w = budget.window
+    if cur + 1 > budget.limit:
+        # تو این پنجره دیگه جا نیست؛ پنجره بعد cur میشه prev و باید به اندازه کافی decay بشه
+        t = w * max(0.0, 1 - (budget.limit - 1) / cur) if cur else 0.0
+        return (w - elapsed) + t
+    if prev <= 0:
+        return 0.0
+    # prev * (1 - e/w) + cur + 1 <= limit
+    e = w * (1 - (budget.limit - 1 - cur) / prev)
+    return max(0.0, e - elapsed)
+
+
+def _token_bucket(state: tuple | None, now: float, budget: Budget) -> tuple[tuple, Decision]:
+    rate = budget.limit / budget.window
+    if state is None:
+        level = float(budget.limit)
+    else:
+        level = min(budget.limit, state[0] + (now - state[1]) * rate)
+
+    if level >= 1:
+        return (level - 1, now), Decision(allowed=True)
+    return (level, now), Decision(allowed=False, retry_after=token_bucket_retry(level, budget))
+
+
+def _sliding_window(state: tuple | None, now: float, budget: Budget) -> tuple[tuple, Decision]:
+    w = budget.window
+    window_start = (now // w) * w
+    cur, prev = 0.0, 0.0
+    if state is not None:
+        s_cur, s_prev, s_start = state
+        if s_start == window_start:
+            cur, prev = s_cur, s_prev
+        elif s_start == window_start - w:
+            prev = s_cur
+
+    elapsed = now - window_start
+    estimate = prev * (1 - elapsed / w) + cur
+    if estimate + 1 <= budget.limit:
+        return (cur + 1, prev, window_start), Decision(allowed=True)
+    return (cur, prev, window_start), Decision(allowed=False, retry_after=sliding_window_retry(cur, prev, elapsed, budget))
+
+
+_ALGORITHMS: dict[str, Callable[[tuple | None, float, Budget], tuple[tuple, Decision]]] = {
+    TOKEN_BUCKET: _token_bucket,
+    SLIDING_WINDOW: _sliding_window,
+}
+
+
+# -------- Backendها --------
+class RateLimitBackend(Protocol):
+    async def hit(self, key: str, budget: Budget) -> Decision: ...
+
+
+class MemoryBackend:
+    """داخل RAM همین پروسه؛ تعداد کلیدها محدود است (LRU)."""
+
+    def __init__(self, max_keys: int, clock: Callable[[], float] = time.monotonic):
+        self._clock = clock
+        self._states: TTLCache[str, tuple] = TTLCache(max_keys, ttl=60, clock=clock)
+
+    async def hit(self, key: str, budget: Budget) -> Decision:
+        state, decision = _ALGORITHMS[budget.algorithm](self._states.get(key), self._clock(), budget)
+        # بعد از دو window وضعیت به حالت اولیه برگشته؛ نگه داشتنش لازم نیست
+        self._states.set(key, state, ttl=2 * budget.window)
+        return decision
+
+
+class PostgresBackend:
+    """مشترک بین چند instance؛ هر چک یک UPSERT اتمیک (و فقط موقع رد شدن یک SELECT)."""
+
+    PURGE_INTERVAL = 600.0
+
+    def __init__(self, max_window: float):
+        self._max_window = max_window
+        self._next_purge = time.monotonic() + self.PURGE_INTERVAL
+
+    async def hit(self, key: str, budget: Budget) -> Decision:
+        async with get_session() as session:
+            if budget.algorithm == SLIDING_WINDOW:
+                denied = await repo.rate_limit_sliding_window(session, key, budget.limit, budget.window)
+                decision = (
+                    Decision(allowed=False, retry_after=sliding_window_retry(*denied, budget))
+                    if denied is not None else Decision(allowed=True)
+                )
+            else:
+                available = await repo.rate_limit_token_bucket(session, key, budget.limit, budget.window)
+                decision = (
+                    Decision(allowed=False, retry_after=token_bucket_retry(available, budget))
+                    if available is not None else Decision(allowed=True)
+                )
+
+            if time.monotonic() >= self._next_purge:
+                self._next_purge = time.monotonic() + self.PURGE_INTERVAL
+                await repo.purge_rate_limits(session, 2 * self._max_window)
+
+            await session.commit()
+
+        return decision
+
+
+class RateLimiter:
+    """
+    budgets=None یعنی بودجه‌ها از runtime settings خوانده شوند
+    (و با تغییر snapshot دوباره ساخته شوند).
+    """
+
+    def __init__(self, backend: RateLimitBackend, budgets: dict[str, Budget] | None = None):
+        self.backend = backend
+        self._static = budgets is not None
+        self._budgets_version = -1
+        self.budgets = budgets if budgets is not None else {}
+
+        self.allowed = 0
+        self.denied = 0
+
+    async def hit(self, action: str, subject: int | str) -> Decision:
+        if not self._static:
+            rt = runtime.current()
+            if rt.version != self._budgets_version:
+                self.budgets = budgets_from_runtime(rt)
+                self._budgets_version = rt.version
+
+        budget = self.budgets.get(action)
+        if budget is None:
+            return Decision(allowed=True)
+
+        decision = await self.backend.hit(f"{action}:{subject}", budget)
+        if decision.allowed:
+            self.allowed += 1
+        else:
+            self.denied += 1
+        return decision
+
+
+def budgets_from_runtime(rt: runtime.Snapshot) -> dict[str, Budget]:
+    algo = rt.RATE_LIMIT_ALGORITHM if rt.RATE_LIMIT_ALGORITHM in _ALGORITHMS else TOKEN_BUCKET
+    return {
+        ACTION_MENU: Budget.parse(rt.RATE_LIMIT_MENU, algo),
+        ACTION_UPLOAD: Budget.parse(rt.RATE_LIMIT_UPLOAD, algo),
+        ACTION_SUBMIT: Budget.parse(rt.RATE_LIMIT_SUBMIT, algo),
+    }
+
+
+_LIMITER: RateLimiter | None = None
+
+
+def get_rate_limiter() -> RateLimiter:
+    global _LIMITER
+    if _LIMITER is None:
+        if settings.RATE_LIMIT_BACKEND == "postgres":
+            max_window = max(b.window for b in budgets_from_runtime(runtime.current()).values())
+            backend: RateLimitBackend = PostgresBackend(max_window)
+        else:
+            backend = MemoryBackend(settings.RATE_LIMIT_MAX_KEYS)
+        _LIMITER = RateLimiter(backend)
+    return _LIMITER
@@ -0,0 +1,217 @@
+"""
+Result cache: همان عکس(ها) + همان prompt + همان مدل = همان خروجی، بدون فراخوانی دوباره مدل.
+
+کلید: sha256 روی مدل، تنظیمات پیش‌پردازش، prompt نرمال‌شده و sha256 بایت‌های خام هر عکس ورودی (به ترتیب).
+hash روی بایت‌های دانلودشده است نه file_id/file_unique_id؛ پس همان عکس که دوباره فرستاده شود هم hit می‌دهد.
+alias: همان کلید ولی با file_unique_idها به جای hash محتوا (بدون دانلود حساب می‌شود)؛ worker بعد از هر
+hit/store ثبتش می‌کند و edit:go با آن قبل از صف جواب می‌دهد (تکرار همان عکس‌ها + همان prompt).
+
+- بایت‌های خروجی روی دیسک: RESULT_CACHE_DIR/ab/<key>-<i> (نوشتن اتمیک، قابل اشتراک بین پروسه‌های worker)
+- ایندکس در جدول result_cache: TTL با expires_at و حذف LRU با last_hit_at وقتی حجم کل از سقف رد شود
+- اول فایل‌ها نوشته می‌شوند بعد ردیف؛ اگر ردیفی به فایل گم‌شده اشاره کند، miss حساب و پاک می‌شود.
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import logging
+import time
+import unicodedata
+from pathlib import Path
+
+from config import settings
+from config.ai_client import EditResult
+from config.database import get_session
+from db import repository as repo
+from db.models import ResultCacheEntry
+from services.downloads import write_atomic
+
+logger = logging.getLogger("result_cache")
+
+_KEY_VERSION = "v1"
+
+
+def normalize_prompt(prompt: str) -> str:
+    """NFKC و یکی کردن فاصله‌ها؛ حروف کوچک/بزرگ عمداً دست نمی‌خورد (برای مدل معنی دارد)."""
+    return " ".join(unicodedata.normalize("NFKC", prompt).split())
+
+
+def cache_key(image_digests: list[str], prompt: str, model: str, variant: str = "") -> str:
+    h = hashlib.sha256()
+    for part in (_KEY_VERSION, model, variant, normalize_prompt(prompt), *image_digests):
+        h.update(part.encode())
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def alias_key(unique_ids: list[str], prompt: str, model: str, variant: str = "") -> str:
+    return cache_key([f"uid:{u}" for u in unique_ids], prompt, model, variant)
+
+
+def _digests(images: list[bytes]) -> list[str]:
+    return [hashlib.sha256(b).hexdigest() for b in images]
+
+
+class ResultCache:
+    PURGE_INTERVAL = 600.0
+
+    def __init__(self, root: str | Path, max_bytes: int, ttl_seconds: float, model: str, variant: str = ""):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.model = model
+        self.variant = variant  # تنظیمات پیش‌پردازش؛ با عوض شدنشان نتیجه‌های قبلی hit نمی‌دهند
+        self._next_purge = time.monotonic()
+
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.alias_hits = 0
+        self.alias_misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _path(self, key: str, index: int) -> Path:
+        return self.root / key[:2] / f"{key}-{index}"
+
+    async def key_for(self, images: list[bytes], prompt: str) -> str:
+        # sha256 چند مگابایت چند میلی‌ثانیه است؛ روی event loop نه
+        digests = await asyncio.to_thread(_digests, images)
+        return cache_key(digests, prompt, self.model, self.variant)
+
+    def alias_for(self, unique_ids: list[str], prompt: str) -> str:
+        return alias_key(unique_ids, prompt, self.model, self.variant)
+
+    def _read(self, key: str, count: int) -> list[bytes]:
+        return [self._path(key, i).read_bytes() for i in range(count)]
+
+    def _write(self, key: str, images: list[bytes]) -> None:
+        for i, data in enumerate(images):
+            write_atomic(self._path(key, i), data)
+
+    def _unlink(self, entries: list[tuple[str, int]]) -> None:
+        for key, count in entries:
+            for i in range(count):
+                self._path(key, i).unlink(missing_ok=True)
+
+    async def lookup(self, key: str) -> EditResult | None:
+        if not self.enabled:
+            return None
+        started = time.monotonic()
+        async with get_session() as session:
+            entry = await repo.hit_cached_result(session, key)
+            await session.commit()
+        if entry is None:
+            self.misses += 1
+            return None
+
+        try:
+            blobs = await asyncio.to_thread(self._read, key, len(entry.mime_types))
+        except FileNotFoundError:
+            # فایل‌ها evict شده‌اند (یا پوشه پاک شده)؛ ایندکس را هم پاک کن
+            async with get_session() as session:
+                await repo.delete_cached_result(session, key)
+                await session.commit()
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return self._result(entry, blobs, started)
+
+    async def lookup_alias(self, alias: str) -> EditResult | None:
+        """
+        lookup قبل از صف (پروسه bot). فایل گم‌شده فقط miss است و ایندکس پاک نمی‌شود:
+        ممکن است RESULT_CACHE_DIR روی ماشین workerها باشد نه اینجا.
+        """
+        if not self.enabled:
+            return None
+        started = time.monotonic()
+        async with get_session() as session:
+            entry = await repo.hit_cached_result_by_alias(session, alias)
+            await session.commit()
+        if entry is None:
+            self.alias_misses += 1
+            return None
+        try:
+            blobs = await asyncio.to_thread(self._read, entry.key, len(entry.mime_types))
+        except FileNotFoundError:
+            self.alias_misses += 1
+            return None
+        self.alias_hits += 1
+        return self._result(entry, blobs, started)
+
+    async def remember_alias(self, alias: str, key: str) -> None:
+        async with get_session() as session:
+            await repo.put_cache_alias(session, alias, key)
+            await session.commit()
+
+    @staticmethod
+    def _result(entry: ResultCacheEntry, blobs: list[bytes], started: float) -> EditResult:
+        return EditResult(
+            images=list(zip(blobs, entry.mime_types)),
+            text=entry.text,
+            attempts=0,
+            latency_ms=int((time.monotonic() - started) * 1000),
+        )
+
+    async def store(self, key: str, result: EditResult) -> None:
+        if not self.enabled or not result.images:
+            return
+        blobs = [data for data, _ in result.images]
+        await asyncio.to_thread(self._write, key, blobs)
+        async with get_session() as session:
+            await repo.put_cached_result(
+                session,
+                key,
+                model=self.model,
+                mime_types=[mime for _, mime in result.images],
+                text=result.text,
+                size_bytes=sum(len(b) for b in blobs),
+                ttl_seconds=int(self.ttl_seconds),
+            )
+            await session.commit()
+        self.stores += 1
+
+        if time.monotonic() >= self._next_purge:
+            self._next_purge = time.monotonic() + self.PURGE_INTERVAL
+            await self.purge()
+
+    async def purge(self) -> int:
+        """منقضی‌ها و اضافه‌ی حجم (LRU) از ایندکس و دیسک. هر پروسه فقط ردیف‌هایی را که خودش حذف کرده پاک می‌کند."""
+        async with get_session() as session:
+            removed = await repo.purge_result_cache(session, self.max_bytes)
+            await session.commit()
+        if removed:
+            await asyncio.to_thread(self._unlink, removed)
+            self.evictions += len(removed)
+            logger.info("Result cache: evicted %s entries", len(removed))
+        return len(removed)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "alias_hits": self.alias_hits,
+            "alias_misses": self.alias_misses,
+        }
+
+
+_CACHE: ResultCache | None = None
+
+
+def get_result_cache() -> ResultCache:
+    global _CACHE
+    if _CACHE is None:
+        _CACHE = ResultCache(
+            settings.RESULT_CACHE_DIR,
+            max_bytes=settings.RESULT_CACHE_MAX_MB * 1024 * 1024,
+            ttl_seconds=settings.RESULT_CACHE_TTL_HOURS * 3600,
+            model=settings.GEMINI_MODEL,
+            variant=f"{settings.IMAGE_MAX_SIDE}:{settings.IMAGE_FORMAT}:{settings.IMAGE_QUALITY}",
+        )
+    return _CACHE
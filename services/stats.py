@@ -0,0 +1,124 @@
+from __future__ import annotations
+
+import math
+from collections import deque
+
+
+def _nearest_rank(ordered: list[float], p: float) -> float:
+    k = max(0, min(len(ordered) - 1, math.ceil(p / 100 * len(ordered)) - 1))
+    return ordered[k]
+
+
+class RollingStats:
+    """آخرین maxlen نمونه (مثلاً زمان انتظار در صف) برای میانگین و صدک‌ها."""
+
+    def __init__(self, maxlen: int = 1000):
+        self._samples: deque[float] = deque(maxlen=maxlen)
+        self.count = 0  # کل نمونه‌ها از ابتدا (نه فقط داخل پنجره)
+
+    def add(self, value: float) -> None:
+        self._samples.append(value)
+        self.count += 1
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def mean(self) -> float:
+        return sum(self._samples) / len(self._samples) if self._samples else 0.0
+
+    def percentile(self, p: float) -> float:
+        """nearest-rank؛ p بین 0 و 100."""
+        return _nearest_rank(sorted(self._samples), p) if self._samples else 0.0
+
+    def fraction_at_most(self, limit: float) -> float:
+        """سهم نمونه‌هایی که <= limit هستند (مثلاً رعایت SLO)؛ بدون نمونه 1.0."""
+        if not self._samples:
+            return 1.0
+        return sum(1 for v in self._samples if v <= limit) / len(self._samples)
+
+    def summary(self) -> dict[str, float]:
+        if not self._samples:
+            return {"n": 0, "mean": 0.0, "p50": 0.0, "p95": 0.0, "p99": 0.0}
+        ordered = sorted(self._samples)
+        return {
+            "n": len(ordered),
+            "mean": sum(ordered) / len(ordered),
+            "p50": _nearest_rank(ordered, 50),
+            "p95": _nearest_rank(ordered, 95),
+            "p99": _nearest_rank(ordered, 99),
+        }
+
+
+class Histogram:
+    """
+    هیستوگرام log-linear به سبک HDR: حافظه ثابت (چند هزار bucket)، بدون نگه داشتن نمونه‌ها
+    و با خطای نسبی حدود 1٪ در هر بازه‌ای (میکروثانیه تا ساعت). برای عمر پروسه، نه پنجره متحرک.
+    مقدارها ثانیه‌اند؛ داخلش میکروثانیه صحیح.
+    """
+
+    def __init__(self, sub_bucket_bits: int = 7):
+        self._sub_bits = sub_bucket_bits  # 2^7=128 زیر-bucket در هر توان 2 → ~0.8٪ خطا
+        self._counts: dict[int, int] = {}
+        self.count = 0
+        self._sum = 0
+        self._max = 0
+
+    def _bucket(self, v: int) -> int:
+        shift = max(0, v.bit_length() - 1 - self._sub_bits)
+        return (v >> shift) << shift
+
+    def _upper(self, lowest: int) -> int:
+        """بالاترین مقدار هم‌ارز bucket (مثل HDR صدک‌ها را از بالا گزارش می‌کنیم)."""
+        shift = max(0, lowest.bit_length() - 1 - self._sub_bits)
+        return lowest + (1 << shift) - 1
+
+    def add(self, seconds: float) -> None:
+        v = max(0, int(seconds * 1_000_000))
+        b = self._bucket(v)
+        self._counts[b] = self._counts.get(b, 0) + 1
+        self.count += 1
+        self._sum += v
+        self._max = max(self._max, v)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def mean(self) -> float:
+        return self._sum / self.count / 1_000_000 if self.count else 0.0
+
+    def percentiles(self, ps: list[float]) -> list[float]:
+        if not self.count:
+            return [0.0 for _ in ps]
+        targets = sorted((max(1, math.ceil(p / 100 * self.count)), i) for i, p in enumerate(ps))
+        out = [0.0] * len(ps)
+        seen = 0
+        t = 0
+        for lowest in sorted(self._counts):
+            seen += self._counts[lowest]
+            while t < len(targets) and seen >= targets[t][0]:
+                out[targets[t][1]] = min(self._upper(lowest), self._max) / 1_000_000
+                t += 1
+            if t == len(targets):
+                break
+        return out
+
+    def percentile(self, p: float) -> float:
+        return self.percentiles([p])[0]
+
+    def merge(self, other: Histogram) -> None:
+        for b, n in other._counts.items():
+            self._counts[b] = self._counts.get(b, 0) + n
+        self.count += other.count
+        self._sum += other._sum
+        self._max = max(self._max, other._max)
+
+    def summary(self) -> dict[str, float]:
+        p50, p95, p99 = self.percentiles([50, 95, 99])
+        return {
+            "n": self.count,
+            "mean": self.mean(),
+            "p50": p50,
+            "p95": p95,
+            "p99": p99,
+            "max": self._max / 1_000_000,
+        }
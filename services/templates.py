@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+import asyncio
+from dataclasses import dataclass
+
+from telegram import InlineKeyboardMarkup
+
+from bot.keyboards import templates_inline_kb
+from config.database import get_session
+from db import repository as repo
+from db.models import Template
+
+
+@dataclass(frozen=True)
+class TemplateItem:
+    id: int
+    title: str
+    description: str
+    prompt: str
+    sample_file_id: str | None
+    is_active: bool
+    vip_only: bool
+
+    @classmethod
+    def from_row(cls, t: Template) -> "TemplateItem":
+        return cls(
+            id=t.id,
+            title=t.title,
+            description=t.description,
+            prompt=t.prompt,
+            sample_file_id=t.sample_file_id,
+            is_active=bool(t.is_active),
+            vip_only=bool(t.vip_only),
+        )
+
+
+@dataclass(frozen=True)
+class CatalogSnapshot:
+    version: int
+    all: tuple[TemplateItem, ...]
+    by_id: dict[int, TemplateItem]
+    active_public: tuple[TemplateItem, ...]
+    active_vip: tuple[TemplateItem, ...]
+    kb_public: InlineKeyboardMarkup | None
+    kb_vip: InlineKeyboardMarkup | None
+
+    def get(self, template_id: int) -> TemplateItem | None:
+        return self.by_id.get(template_id)
+
+    def active(self, for_vip: bool) -> tuple[TemplateItem, ...]:
+        return self.active_vip if for_vip else self.active_public
+
+    def keyboard(self, for_vip: bool) -> InlineKeyboardMarkup | None:
+        return self.kb_vip if for_vip else self.kb_public
+
+
+def _build(version: int, rows: list[Template]) -> CatalogSnapshot:
+    items = tuple(TemplateItem.from_row(t) for t in rows)
+    active_vip = tuple(t for t in items if t.is_active)
+    active_public = tuple(t for t in active_vip if not t.vip_only)
+    return CatalogSnapshot(
+        version=version,
+        all=items,
+        by_id={t.id: t for t in items},
+        active_public=active_public,
+        active_vip=active_vip,
+        kb_public=templates_inline_kb([(t.id, t.title) for t in active_public]) if active_public else None,
+        kb_vip=templates_inline_kb([(t.id, t.title) for t in active_vip]) if active_vip else None,
+    )
+
+
+class TemplateCatalog:
+    """
+    کاتالوگ تمپلیت‌ها داخل RAM؛ یک بار لود می‌شود و فقط بعد از تغییرات ادمین (invalidate) دوباره.
+    کیبوردهای لیست برای VIP و غیر VIP از قبل ساخته شده‌اند.
+    """
+
+    def __init__(self):
+        self._version = 0
+        self._snapshot: CatalogSnapshot | None = None
+        self._lock = asyncio.Lock()
+
+        self.loads = 0
+
+    async def snapshot(self) -> CatalogSnapshot:
+        snap = self._snapshot
+        if snap is not None and snap.version == self._version:
+            return snap
+
+        async with self._lock:
+            snap = self._snapshot
+            if snap is not None and snap.version == self._version:
+                return snap
+
+            # اگر وسط لود invalidate بشه، version عوض شده و دفعه بعد دوباره لود می‌شود
+            version = self._version
+            async with get_session() as session:
+                rows = await repo.list_all_templates(session)
+            self._snapshot = _build(version, rows)
+            self.loads += 1
+            return self._snapshot
+
+    def invalidate(self) -> None:
+        """بعد از commit تغییرات تمپلیت صدا زده شود."""
+        self._version += 1
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+
+_CATALOG: TemplateCatalog | None = None
+
+
+def get_template_catalog() -> TemplateCatalog:
+    global _CATALOG
+    if _CATALOG is None:
+        _CATALOG = TemplateCatalog()
+    return _CATALOG
@@ -0,0 +1,69 @@
+"""
+زمان‌بندی مرحله‌به‌مرحله jobها: queue، download، cache، preprocess، model، upload، total.
+
+- StageTimer داخل worker هر مرحله را اندازه می‌گیرد (میلی‌ثانیه).
+- TimingsBuffer (services.writebehind) در RAM جمع می‌کند و هر N ثانیه یا M ردیف
+  با یک INSERT چندردیفی در request_timings می‌نویسد (نه یک round-trip برای هر job).
+"""
+from __future__ import annotations
+
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import settings
+from db import repository as repo
+from services.writebehind import WriteBehindBuffer
+
+STAGES = ("queue", "download", "cache", "preprocess", "model", "upload", "total")
+
+
+class StageTimer:
+    def __init__(self):
+        self.ms: dict[str, int] = {}
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """مرحله‌ای که با خطا تمام شود هم ثبت می‌شود (تا جایی که طول کشید)."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.ms[name] = self.ms.get(name, 0) + int((time.perf_counter() - started) * 1000)
+
+    def set(self, name: str, seconds: float) -> None:
+        self.ms[name] = int(seconds * 1000)
+
+    def row(self, request_id: int, attempts: int, ok: bool) -> dict:
+        return {
+            "request_id": request_id,
+            "attempts": attempts,
+            "ok": ok,
+            **{f"{name}_ms": self.ms.get(name) for name in STAGES},
+        }
+
+
+async def _write(session: AsyncSession, batch: dict[int, dict]) -> None:
+    await repo.upsert_request_timings_bulk(session, list(batch.values()))
+
+
+class TimingsBuffer(WriteBehindBuffer[int, dict]):
+    """write-behind برای request_timings؛ هر request_id فقط آخرین تلاشش."""
+
+    def __init__(self, interval: float, max_pending: int):
+        super().__init__("timings", _write, interval, max_pending)
+
+    def add(self, row: dict) -> None:
+        self.put(row["request_id"], row)
+
+
+_BUFFER: TimingsBuffer | None = None
+
+
+def get_timings_buffer() -> TimingsBuffer:
+    global _BUFFER
+    if _BUFFER is None:
+        _BUFFER = TimingsBuffer(settings.TIMINGS_FLUSH_SECONDS, settings.TIMINGS_FLUSH_MAX)
+    return _BUFFER
@@ -0,0 +1,275 @@
+"""
+ورودی webhook: تلگرام آپدیت‌ها را POST می‌کند و Application آن‌ها را هم‌زمان پردازش می‌کند.
+با WEBHOOK_URL خالی همان run_polling قبلی (ترتیبی) اجرا می‌شود.
+
+- سرور: services.httpserver روی WEBHOOK_LISTEN_HOST:WEBHOOK_LISTEN_PORT (معمولاً پشت nginx با TLS)
+- امنیت: هدر X-Telegram-Bot-Api-Secret-Token باید با secret داده‌شده به setWebhook یکی باشد
+  (WEBHOOK_SECRET؛ خالی = تصادفی در هر بار اجرا)
+- هم‌زمانی: UPDATE_CONCURRENCY handler هم‌زمان؛ آپدیت‌های یک کاربر به ترتیب (state گفتگو per user است)
+- سقف in-flight: بیشتر از WEBHOOK_MAX_IN_FLIGHT آپدیتِ پذیرفته‌شده و تمام‌نشده نداریم؛ درخواست بعدی
+  منتظر می‌ماند و بعد از ADMIT_TIMEOUT با 503 رد می‌شود (تلگرام دوباره می‌فرستد)
+- تکراری: آپدیتی که تلگرام دوباره فرستاده (در جریان یا تازه تمام‌شده) فقط 200 می‌گیرد و دوباره اجرا نمی‌شود
+- چرخه عمر: setWebhook بعد از بالا آمدن سرور، deleteWebhook موقع خاموشی (آپدیت‌های بعدی نزد تلگرام می‌مانند)
+"""
+from __future__ import annotations
+
+import asyncio
+import hmac
+import json
+import logging
+import secrets
+import signal
+from collections import OrderedDict
+from typing import Any, Awaitable
+from urllib.parse import urlsplit
+
+from telegram import Update
+from telegram.ext import Application, BaseUpdateProcessor
+
+from config import settings
+from services.httpserver import HttpRequest, HttpResponse, HttpServer
+
+logger = logging.getLogger("webhook")
+
+SECRET_HEADER = "x-telegram-bot-api-secret-token"
+
+# نتیجه PerUserUpdateProcessor.admit
+ADMITTED = "admitted"
+DUPLICATE = "duplicate"
+BUSY = "busy"
+
+
+def _serial_key(update: object) -> int | None:
+    if isinstance(update, Update):
+        if update.effective_user:
+            return update.effective_user.id
+        if update.effective_chat:
+            return update.effective_chat.id
+    return None
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    آپدیت‌های کاربرهای مختلف هم‌زمان، آپدیت‌های یک کاربر به ترتیب ورود.
+    سقف PTB (max_concurrent_updates) همان سقف in-flight است؛ سقف handlerهای واقعاً در حال اجرا
+    بعد از قفل کاربر گرفته می‌شود تا آپدیتی که پشت آپدیت قبلی همان کاربر منتظر است جای کسی را نگیرد.
+    """
+
+    RECENT_IDS = 10_000  # update_idهای تمام‌شده‌ای که برای تشخیص ارسال دوباره نگه داشته می‌شوند
+
+    def __init__(self, concurrency: int, max_in_flight: int):
+        super().__init__(max(concurrency, max_in_flight))
+        self.concurrency = concurrency
+        self.max_in_flight = max_in_flight
+        self._running = asyncio.Semaphore(concurrency)
+        self._admission = asyncio.Semaphore(max_in_flight)
+        self._admitted: set[int] = set()
+        self._recent: OrderedDict[int, None] = OrderedDict()
+        self._locks: dict[int, tuple[asyncio.Lock, int]] = {}
+
+        self.processed = 0
+        self.rejected = 0
+        self.duplicates = 0
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._admitted)
+
+    def _seen(self, update_id: int) -> bool:
+        return update_id in self._admitted or update_id in self._recent
+
+    async def admit(self, update: Update, timeout: float) -> str:
+        """
+        جا برای یک آپدیت دیگر: ADMITTED، یا DUPLICATE اگر همین update_id در جریان است یا تازه تمام شده
+        (تلگرام دوباره فرستاده چون پاسخ قبلی نرسید؛ نباید دوباره اجرا شود)، یا BUSY اگر سقف in-flight
+        تا timeout پر ماند.
+        """
+        if self._seen(update.update_id):
+            self.duplicates += 1
+            return DUPLICATE
+        try:
+            await asyncio.wait_for(self._admission.acquire(), timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            return BUSY
+        # در همین فاصله ممکن است همان آپدیت از کانکشن دیگری پذیرفته شده باشد
+        if self._seen(update.update_id):
+            self._admission.release()
+            self.duplicates += 1
+            return DUPLICATE
+        self._admitted.add(update.update_id)
+        return ADMITTED
+
+    def _release(self, update: object) -> None:
+        update_id = getattr(update, "update_id", None)
+        if update_id in self._admitted:
+            self._admitted.discard(update_id)
+            self._admission.release()
+            self._recent[update_id] = None
+            if len(self._recent) > self.RECENT_IDS:
+                self._recent.popitem(last=False)
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key = _serial_key(update)
+        try:
+            if key is None:
+                async with self._running:
+                    await coroutine
+                return
+
+            lock, refs = self._locks.get(key) or (asyncio.Lock(), 0)
+            self._locks[key] = (lock, refs + 1)
+            try:
+                async with lock, self._running:
+                    await coroutine
+            finally:
+                lock, refs = self._locks[key]
+                if refs <= 1:
+                    del self._locks[key]
+                else:
+                    self._locks[key] = (lock, refs - 1)
+        finally:
+            self.processed += 1
+            self._release(update)
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "in_flight": self.in_flight,
+            "users_locked": len(self._locks),
+            "processed": self.processed,
+            "rejected": self.rejected,
+            "duplicates": self.duplicates,
+        }
+
+
+def build_update_processor() -> PerUserUpdateProcessor:
+    return PerUserUpdateProcessor(settings.UPDATE_CONCURRENCY, settings.WEBHOOK_MAX_IN_FLIGHT)
+
+
+class WebhookIngress:
+    ADMIT_TIMEOUT = 10.0
+    MAX_BODY = 1024 * 1024  # آپدیت‌های تلگرام چند کیلوبایت‌اند
+
+    def __init__(
+        self,
+        app: Application,
+        url: str,
+        host: str,
+        port: int,
+        secret: str = "",
+        max_connections: int = 40,
+    ):
+        self.app = app
+        self.url = url
+        self.path = urlsplit(url).path or "/"
+        self.secret = secret or secrets.token_urlsafe(32)
+        self.max_connections = max_connections
+        self._server = HttpServer(self._handle, host, port, max_body=self.MAX_BODY)
+
+        self.received = 0
+        self.forbidden = 0
+
+    @property
+    def server_url(self) -> str:
+        """آدرس محلی سرور (بدون path)."""
+        return self._server.url
+
+    @property
+    def port(self) -> int:
+        return self._server.port
+
+    @property
+    def processor(self) -> PerUserUpdateProcessor | None:
+        processor = self.app.update_processor
+        return processor if isinstance(processor, PerUserUpdateProcessor) else None
+
+    async def _handle(self, req: HttpRequest) -> HttpResponse:
+        if req.path != self.path:
+            return HttpResponse(404, b'{"error":"not found"}')
+        if req.method != "POST":
+            return HttpResponse(405, b'{"error":"method not allowed"}')
+        if not hmac.compare_digest(req.headers.get(SECRET_HEADER, "").encode(), self.secret.encode()):
+            self.forbidden += 1
+            return HttpResponse(403, b'{"error":"forbidden"}')
+
+        try:
+            update = Update.de_json(json.loads(req.body), self.app.bot)
+        except (ValueError, TypeError, KeyError):
+            return HttpResponse(400, b'{"error":"bad update"}')
+        if update is None:
+            return HttpResponse(400, b'{"error":"bad update"}')
+
+        processor = self.processor
+        if processor is not None:
+            admitted = await processor.admit(update, self.ADMIT_TIMEOUT)
+            if admitted == BUSY:
+                return HttpResponse(503, b'{"error":"busy"}', headers={"Retry-After": "1"})
+            if admitted == DUPLICATE:
+                return HttpResponse(200, b"")
+
+        self.received += 1
+        await self.app.update_queue.put(update)
+        return HttpResponse(200, b"")
+
+    async def start(self) -> None:
+        await self._server.start()
+        await self.app.bot.set_webhook(
+            self.url,
+            secret_token=self.secret,
+            max_connections=self.max_connections,
+            allowed_updates=Update.ALL_TYPES,
+        )
+        logger.info("Webhook set to %s (listening on %s%s)", self.url, self.server_url, self.path)
+
+    async def stop(self) -> None:
+        # اول تلگرام دیگر نفرستد؛ آپدیت‌های بعدی تا اجرای بعدی نزد تلگرام می‌مانند
+        try:
+            await self.app.bot.delete_webhook(drop_pending_updates=False)
+        except Exception:
+            logger.warning("deleteWebhook failed", exc_info=True)
+        await self._server.stop()
+
+
+async def serve_webhook(app: Application) -> None:
+    """معادل run_polling برای حالت webhook (همان post_init/post_stop/post_shutdown) تا SIGINT/SIGTERM."""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:  # ویندوز
+            pass
+
+    ingress = WebhookIngress(
+        app,
+        settings.WEBHOOK_URL,
+        settings.WEBHOOK_LISTEN_HOST,
+        settings.WEBHOOK_LISTEN_PORT,
+        secret=settings.WEBHOOK_SECRET,
+        max_connections=settings.WEBHOOK_MAX_CONNECTIONS,
+    )
+    await app.initialize()
+    try:
+        if app.post_init:
+            await app.post_init(app)
+        await app.start()
+        await ingress.start()
+        app.bot_data["webhook"] = ingress
+        await stop.wait()
+    finally:
+        logger.info("Stopping webhook ingress...")
+        await ingress.stop()
+        if app.running:
+            # آپدیت‌های پذیرفته‌شده تا آخر پردازش می‌شوند
+            await app.stop()
+        if app.post_stop:
+            await app.post_stop(app)
+        await app.shutdown()
+        if app.post_shutdown:
+            await app.post_shutdown(app)
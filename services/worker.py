@@ -1,44 +1,554 @@
 from __future__ import annotations
 
+from dotenv import load_dotenv
+load_dotenv()
+
+import argparse
 import asyncio
 import logging
+import multiprocessing
+import signal
+import time
 
-from telegram.ext import Application
+import httpx
+from sqlalchemy import exc as sa_exc
+from telegram import InputMediaPhoto
+from telegram import error as tg_error
+from telegram.ext import Application, ExtBot
+from telegram.request import HTTPXRequest
 
-from services.queue import get_queue, EditJob
+from config import settings
+from config.ai_client import RETRYABLE_STATUS, AIError, EditResult, get_ai_client
+from config.database import engine, get_session
+from db import repository as repo
+from services.downloads import get_downloader
+from services.imaging import get_image_processor
+from services.outbound import BULK, build_rate_limiter, worker_global_share
+from services.profiler import ProfileListener
+from services.queue import get_queue, EditJob, JobQueue, LANES, LANE_FREE
+from services.result_cache import get_result_cache
+from services.stats import Histogram, RollingStats
+from services.timings import STAGES, StageTimer, get_timings_buffer
 
 logger = logging.getLogger("worker")
 
+# خطاهای گذرا که تکرار job ممکن است درستشان کند
+_TRANSIENT_ERRORS = (
+    TimeoutError,
+    ConnectionError,
+    httpx.TransportError,
+    tg_error.NetworkError,
+    tg_error.RetryAfter,
+    sa_exc.OperationalError,
+    sa_exc.InterfaceError,
+)
 
-async def _worker_loop(app: Application):
-    q = get_queue()
-    bot = app.bot
 
-    logger.info("Worker started.")
+def _is_retryable(e: BaseException) -> bool:
+    """
+    پیش‌فرض غیرقابل تکرار (مثلاً عکس خراب، DecompressionBombError، ValueError)؛
+    فقط خطاهای گذرای شبکه/upstream/دیتابیس دوباره در صف می‌روند.
+    """
+    if isinstance(e, AIError):
+        return e.retryable
+    if isinstance(e, tg_error.BadRequest):  # زیرکلاس NetworkError است ولی تکرارش فایده ندارد
+        return False
+    if isinstance(e, httpx.HTTPStatusError):
+        return e.response.status_code in RETRYABLE_STATUS
+    return isinstance(e, _TRANSIENT_ERRORS)
 
-    while True:
-        job: EditJob = await q.get()
+
+async def _finish_success(q: JobQueue, job: EditJob, latency_ms: int | None = None, cache_hit: bool = False) -> None:
+    """وضعیت success و ack صف در یک تراکنش."""
+    try:
+        async with get_session() as session:
+            await repo.set_request_status(
+                session, job.request_id, "success", latency_ms=latency_ms, cache_hit=cache_hit
+            )
+            await q.ack(job, session=session)
+            await session.commit()
+    except Exception:
+        logger.exception("Status update failed (request_id=%s)", job.request_id)
+
+
+FAILED_TEXT = "❌ متأسفانه ویرایش #{request_id} انجام نشد. سهمیه‌ات برگشت داده شد؛ دوباره امتحان کن."
+
+
+async def _finish_failure(bot: ExtBot, q: JobQueue, job: EditJob, error: str, retryable: bool = True) -> None:
+    """
+    اگر تلاش باقی مانده (و خطا قابل تکرار است) job به صف برمی‌گردد؛
+    وگرنه وضعیت fail و برگشت سهمیه رزروشده در یک تراکنش، و بعد خبر به کاربر.
+    """
+    try:
+        async with get_session() as session:
+            retry = await q.fail(job, error, session=session, retryable=retryable)
+            if not retry:
+                await repo.set_request_status(session, job.request_id, "fail", error=error[:1000])
+                await repo.refund_daily_edit(session, job.request_id)
+            await session.commit()
+    except Exception:
+        logger.exception("Fail/refund update failed (request_id=%s)", job.request_id)
+        return
+
+    if not retry:
         try:
-            # فعلاً AI واقعی وصل نیست، فقط ساختار صف و ارسال پیام آماده است.
-            # مرحله بعد: دانلود فایل‌های تلگرام + ارسال به Gemini + دریافت تصویر + ارسال خروجی.
             await bot.send_message(
-                chat_id=job.chat_id,
-                text=(
-                    f"🧩 Job #{job.request_id}\n"
-                    f"📸 تصاویر: {len(job.image_file_ids)}\n"
-                    f"📝 prompt: {job.prompt[:120]}{'...' if len(job.prompt) > 120 else ''}\n\n"
-                    "✅ تو صف اجرا شد (AI رو مرحله بعد وصل می‌کنیم)."
-                ),
+                chat_id=job.chat_id, text=FAILED_TEXT.format(request_id=job.request_id), rate_limit_args=BULK
+            )
+        except Exception:
+            logger.warning("Failure notice not delivered (request_id=%s)", job.request_id, exc_info=True)
+
+
+async def _heartbeat(q: JobQueue, job: EditJob) -> None:
+    """تا وقتی job در حال اجراست lease رو تمدید کن."""
+    interval = max(1.0, settings.QUEUE_LEASE_SECONDS / 3)
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await q.heartbeat(job)
+        except Exception:
+            logger.exception("Heartbeat failed (job_id=%s)", job.job_id)
+
+
+async def _cached_result(raw: list[bytes], prompt: str) -> tuple[str | None, EditResult | None]:
+    """(کلید، نتیجه) از result cache؛ خطای کش هیچ‌وقت job را خراب نمی‌کند."""
+    cache = get_result_cache()
+    if not cache.enabled:
+        return None, None
+    try:
+        key = await cache.key_for(raw, prompt)
+        return key, await cache.lookup(key)
+    except Exception:
+        logger.warning("Result cache lookup failed", exc_info=True)
+        return None, None
+
+
+async def _remember_alias(job: EditJob, key: str) -> None:
+    """alias (file_unique_idها) -> key تا تکرار همین درخواست در edit:go بدون صف جواب بگیرد."""
+    if len(job.image_unique_ids) != len(job.image_file_ids) or not all(job.image_unique_ids):
+        return
+    cache = get_result_cache()
+    try:
+        await cache.remember_alias(cache.alias_for(job.image_unique_ids, job.prompt), key)
+    except Exception:
+        logger.warning("Result cache alias store failed (request_id=%s)", job.request_id, exc_info=True)
+
+
+async def _send_result(bot: ExtBot, chat_id: int, request_id: int, result: EditResult, rate_limit_args=None) -> None:
+    caption = f"✅ ویرایش #{request_id} آماده شد."
+    if result.text:
+        caption += "\n\n" + result.text[:900]
+
+    if len(result.images) == 1:
+        await bot.send_photo(chat_id=chat_id, photo=result.images[0][0], caption=caption, rate_limit_args=rate_limit_args)
+    else:
+        await bot.send_media_group(
+            chat_id=chat_id,
+            media=[
+                InputMediaPhoto(data, caption=caption if i == 0 else None)
+                for i, (data, _) in enumerate(result.images[:10])
+            ],
+            rate_limit_args=rate_limit_args,
+        )
+
+
+async def _process(bot: ExtBot, job: EditJob, timer: StageTimer) -> bool:
+    """خروجی: True اگر نتیجه از result cache آمد."""
+    with timer.stage("download"):
+        raw = await get_downloader().fetch_all(bot, job.image_file_ids, job.image_unique_ids)
+
+    with timer.stage("cache"):
+        key, result = await _cached_result(raw, job.prompt)
+    cache_hit = result is not None
+    if result is None:
+        with timer.stage("preprocess"):
+            images = await get_image_processor().preprocess_all(raw)
+        with timer.stage("model"):
+            result = await get_ai_client().edit_image([(img.data, img.mime_type) for img in images], job.prompt)
+        if key:
+            try:
+                await get_result_cache().store(key, result)
+            except Exception:
+                logger.warning("Result cache store failed (request_id=%s)", job.request_id, exc_info=True)
+                key = None
+    if key:
+        await _remember_alias(job, key)
+
+    with timer.stage("upload"):
+        await _send_result(bot, job.chat_id, job.request_id, result, rate_limit_args=BULK)
+    return cache_hit
+
+
+async def lookup_cached_result(image_unique_ids: list[str], images_count: int, prompt: str) -> EditResult | None:
+    """
+    برای edit:go قبل از صف: result cache از روی file_unique_idها (بدون دانلود).
+    فقط وقتی همه عکس‌ها unique id دارند؛ خطای کش = miss.
+    """
+    cache = get_result_cache()
+    if not cache.enabled or len(image_unique_ids) != images_count or not all(image_unique_ids):
+        return None
+    try:
+        return await cache.lookup_alias(cache.alias_for(image_unique_ids, prompt))
+    except Exception:
+        logger.warning("Result cache alias lookup failed", exc_info=True)
+        return None
+
+
+async def deliver_cached_result(bot: ExtBot, chat_id: int, request_id: int, result: EditResult) -> bool:
+    """
+    نتیجه‌ای که edit:go از result cache (alias) پیدا کرد: بدون صف تحویل و success با cache_hit.
+    تحویل ناموفق = fail و برگشت سهمیه، مثل job شکست‌خورده.
+    """
+    started = time.perf_counter()
+    try:
+        await _send_result(bot, chat_id, request_id, result)
+    except Exception as e:
+        logger.warning("Cached result not delivered (request_id=%s)", request_id, exc_info=True)
+        try:
+            async with get_session() as session:
+                await repo.set_request_status(session, request_id, "fail", error=repr(e)[:1000])
+                await repo.refund_daily_edit(session, request_id)
+                await session.commit()
+        except Exception:
+            logger.exception("Fail/refund update failed (request_id=%s)", request_id)
+        return False
+
+    try:
+        async with get_session() as session:
+            await repo.set_request_status(
+                session, request_id, "success",
+                latency_ms=result.latency_ms + int((time.perf_counter() - started) * 1000), cache_hit=True,
             )
+            await session.commit()
+    except Exception:
+        logger.exception("Status update failed (request_id=%s)", request_id)
+    return True
+
+
+class WorkerPool:
+    """
+    چند job هم‌زمان: حداکثر size در حال اجرا (سقف کل) و حداکثر per_user_limit برای هر کاربر.
+    یک dispatcher فقط وقتی slot آزاد باشد از صف برمی‌دارد و کاربران اشباع‌شده را رد می‌کند؛
+    خود صف بین بقیه کاربران round-robin می‌چرخد.
+    """
+
+    def __init__(self, bot: ExtBot, size: int, per_user_limit: int):
+        self.bot = bot
+        self.size = max(1, size)
+        self.per_user_limit = per_user_limit
+
+        self._slots = asyncio.Semaphore(self.size)
+        self._in_flight: dict[int, int] = {}
+        self._tasks: set[asyncio.Task] = set()
+        self._dispatcher: asyncio.Task | None = None
+        self._q: JobQueue | None = None
+
+        self.queue_wait = RollingStats(1000)  # ثانیه، از enqueue تا شروع اجرا
+        self.lane_wait = {lane: RollingStats(1000) for lane in LANES}
+        self.lane_slo = {lane: settings.QUEUE_LANE_SLO_SECONDS.get(lane, 0.0) for lane in LANES}
+        self.slo_breaches = {lane: 0 for lane in LANES}
+        self.service_time = RollingStats(200)  # ثانیه، مدت اجرای موفق هر job (برای ETA)
+        self.stage_time = {stage: Histogram() for stage in STAGES}  # ثانیه، هر تلاش (موفق یا نه)
+        self.processed = 0
+        self.failed = 0
+
+    @property
+    def active(self) -> int:
+        return len(self._tasks)
+
+    @property
+    def idle(self) -> int:
+        return self.size - self.active
+
+    def _saturated_users(self) -> set[int]:
+        if self.per_user_limit <= 0:
+            return set()
+        return {uid for uid, n in self._in_flight.items() if n >= self.per_user_limit}
+
+    def _record_wait(self, job: EditJob) -> float:
+        wait = max(0.0, time.time() - job.enqueued_at)
+        self.queue_wait.add(wait)
+        lane = job.lane if job.lane in self.lane_wait else LANE_FREE
+        self.lane_wait[lane].add(wait)
+        slo = self.lane_slo[lane]
+        if slo and wait > slo:
+            self.slo_breaches[lane] += 1
+            logger.warning("Lane %s SLO breached: request_id=%s waited %.1fs (slo %.0fs)", lane, job.request_id, wait, slo)
+        return wait
+
+    def _record_timings(self, job: EditJob, timer: StageTimer, ok: bool) -> None:
+        timer.set("total", max(0.0, time.time() - job.enqueued_at))
+        for stage, ms in timer.ms.items():
+            self.stage_time[stage].add(ms / 1000)
+        get_timings_buffer().add(timer.row(job.request_id, job.attempts, ok))
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.size,
+            "active": self.active,
+            "idle": self.idle,
+            "users_in_flight": len(self._in_flight),
+            "processed": self.processed,
+            "failed": self.failed,
+            "queue_wait": self.queue_wait.summary(),
+            "service_time": self.service_time.summary(),
+            "stages": {stage: h.summary() for stage, h in self.stage_time.items()},
+            "lanes": {
+                lane: {
+                    "wait": self.lane_wait[lane].summary(),
+                    "slo": self.lane_slo[lane],
+                    "within_slo": self.lane_wait[lane].fraction_at_most(self.lane_slo[lane]),
+                    "breaches": self.slo_breaches[lane],
+                }
+                for lane in LANES
+            },
+            "ai": get_ai_client().stats(),
+            "result_cache": get_result_cache().stats(),
+            "outbound": self.bot.rate_limiter.stats() if self.bot.rate_limiter else None,
+        }
+
+    def start(self) -> None:
+        if self._dispatcher is None:
+            self._dispatcher = asyncio.create_task(self._dispatch())
+            get_timings_buffer().start()
+
+    async def stop(self, grace: float = 0.0) -> None:
+        """
+        دیگر job جدید برداشته نمی‌شود؛ jobهای در حال اجرا تا grace ثانیه فرصت دارند تمام شوند.
+        بقیه cancel می‌شوند و lease آن‌ها بعد از انقضا دوباره برداشته می‌شود.
+        """
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            await asyncio.gather(self._dispatcher, return_exceptions=True)
+            self._dispatcher = None
+
+        if self._tasks and grace > 0:
+            await asyncio.wait(set(self._tasks), timeout=grace)
+
+        tasks = list(self._tasks)
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await get_timings_buffer().stop()
+
+    async def _dispatch(self) -> None:
+        q = self._q = get_queue()
+
+        # jobهای یتیم (worker قبلی وسط کار مرده) دوباره آزاد شوند
+        try:
+            await q.recover()
         except Exception:
-            logger.exception("Worker job failed (request_id=%s)", job.request_id)
+            logger.exception("Queue recovery failed")
+
+        logger.info("Worker pool started (size=%s, per_user=%s).", self.size, self.per_user_limit)
+
+        while True:
+            await self._slots.acquire()
+            try:
+                # وقتی upstream مدل خوابیده، job برداشتن فقط lease و retry هدر می‌دهد
+                await get_ai_client().breaker.wait_until_available()
+                job: EditJob = await q.get(exclude=self._saturated_users)
+            except asyncio.CancelledError:
+                self._slots.release()
+                raise
+            except Exception:
+                self._slots.release()
+                logger.exception("Queue get failed")
+                await asyncio.sleep(1)
+                continue
+
+            self._in_flight[job.user_tg_id] = self._in_flight.get(job.user_tg_id, 0) + 1
+            wait = self._record_wait(job)
+
+            task = asyncio.create_task(self._run(q, job, wait))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, q: JobQueue, job: EditJob, wait: float) -> None:
+        hb = asyncio.create_task(_heartbeat(q, job))
+        timer = StageTimer()
+        timer.set("queue", wait)
+        started = time.perf_counter()
+        try:
+            cache_hit = await _process(self.bot, job, timer)
+        except Exception as e:
+            self.failed += 1
+            self._record_timings(job, timer, ok=False)
+            retryable = _is_retryable(e)
+            if isinstance(e, AIError):
+                logger.warning("AI call failed (request_id=%s, attempt=%s): %s", job.request_id, job.attempts, e)
+            else:
+                logger.exception("Worker job failed (request_id=%s, attempt=%s)", job.request_id, job.attempts)
+            await _finish_failure(self.bot, q, job, repr(e), retryable=retryable)
+        else:
+            elapsed = time.perf_counter() - started
+            self.processed += 1
+            self.service_time.add(elapsed)
+            self._record_timings(job, timer, ok=True)
+            await _finish_success(q, job, latency_ms=int(elapsed * 1000), cache_hit=cache_hit)
         finally:
-            q.task_done()
+            hb.cancel()
+            n = self._in_flight.get(job.user_tg_id, 1) - 1
+            if n > 0:
+                self._in_flight[job.user_tg_id] = n
+            else:
+                self._in_flight.pop(job.user_tg_id, None)
+            self._slots.release()
+            # شاید dispatcher منتظر همین کاربر بود
+            q.wakeup()
+
+
+# میانگین زمان اجرا از DB وقتی pool در همین پروسه نیست (حالت ingest-only): (expires_at, seconds)
+_DB_SERVICE_TIME: tuple[float, float] = (0.0, 0.0)
+_DB_SERVICE_TIME_TTL = 30.0
+
+
+async def _avg_service_seconds(pool: WorkerPool | None) -> float:
+    global _DB_SERVICE_TIME
+    if pool and len(pool.service_time):
+        return pool.service_time.mean()
+
+    expires_at, avg = _DB_SERVICE_TIME
+    if time.monotonic() >= expires_at:
+        try:
+            async with get_session() as session:
+                avg = (await repo.avg_recent_latency_ms(session, limit=200) or 0) / 1000
+        except Exception:
+            logger.exception("Service time lookup failed")
+            avg = 0.0
+        _DB_SERVICE_TIME = (time.monotonic() + _DB_SERVICE_TIME_TTL, avg)
+    return avg or float(settings.QUEUE_DEFAULT_SERVICE_SECONDS)
+
+
+async def estimate_wait_seconds(app: Application, position: int) -> float:
+    """
+    ETA تقریبی برای job در جایگاه position: تعداد «دور»های workerها تا رسیدن نوبت
+    ضرب در میانگین متحرک زمان اجرای هر job.
+    """
+    pool: WorkerPool | None = app.bot_data.get("worker_pool")
+    size = pool.size if pool else max(1, settings.WORKER_CONCURRENCY * settings.WORKER_PROCESSES)
+    avg = await _avg_service_seconds(pool)
+    rounds = (max(1, position) - 1) // size + 1
+    return rounds * avg
 
 
 async def start_worker(app: Application):
-    # یک task پس‌زمینه داخل event loop همین bot
-    if app.bot_data.get("worker_task"):
+    # pool داخل event loop همین bot
+    if app.bot_data.get("worker_pool"):
         return
-    task = asyncio.create_task(_worker_loop(app))
-    app.bot_data["worker_task"] = task
+    pool = WorkerPool(app.bot, settings.WORKER_CONCURRENCY, settings.WORKER_PER_USER_LIMIT)
+    pool.start()
+    app.bot_data["worker_pool"] = pool
+
+
+async def stop_worker(app: Application):
+    pool: WorkerPool | None = app.bot_data.pop("worker_pool", None)
+    if pool:
+        await pool.stop(grace=settings.WORKER_SHUTDOWN_GRACE_SECONDS)
+        await get_downloader().close()
+        await get_image_processor().close()
+        await get_ai_client().close()
+
+
+# -------------------------
+# پروسه مستقل: python -m services.worker
+# -------------------------
+async def _serve(concurrency: int, processes: int = 1) -> None:
+    """یک پروسه worker: Bot مخصوص خودش برای تحویل نتیجه، بدون polling."""
+    # هر job هم‌زمان حداکثر یک درخواست به Bot API دارد؛ چند کانکشن اضافه برای heartbeat/خطا
+    # سقف سراسری ارسال بین پروسه bot و پروسه‌های worker تقسیم می‌شود
+    bot = ExtBot(
+        settings.BOT_TOKEN,
+        request=HTTPXRequest(connection_pool_size=concurrency + 4),
+        rate_limiter=build_rate_limiter(global_share=worker_global_share(processes)),
+    )
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:  # ویندوز
+            pass
+
+    async with bot:
+        pool = WorkerPool(bot, concurrency, settings.WORKER_PER_USER_LIMIT)
+        pool.start()
+        # /profile در پروسه bot از طریق NOTIFY به این پروسه هم می‌رسد
+        profile_listener = ProfileListener(bot, send_kwargs={"rate_limit_args": BULK})
+        await profile_listener.start()
+        await stop.wait()
+        logger.info("Stopping worker (grace=%ss)...", settings.WORKER_SHUTDOWN_GRACE_SECONDS)
+        await profile_listener.stop()
+        await pool.stop(grace=settings.WORKER_SHUTDOWN_GRACE_SECONDS)
+
+    await get_downloader().close()
+    await get_image_processor().close()
+    await get_ai_client().close()
+    await engine.dispose()
+
+
+def _process_main(concurrency: int, processes: int = 1) -> None:
+    load_dotenv()
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s | %(levelname)s | %(name)s[%(process)d] | %(message)s"
+    )
+    asyncio.run(_serve(concurrency, processes))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Edit job workers (without Telegram polling).")
+    parser.add_argument("--processes", type=int, default=settings.WORKER_PROCESSES)
+    parser.add_argument("--concurrency", type=int, default=settings.WORKER_CONCURRENCY, help="jobs per process")
+    args = parser.parse_args()
+
+    if settings.QUEUE_BACKEND == "memory":
+        raise SystemExit("QUEUE_BACKEND=memory is process-local; standalone workers need QUEUE_BACKEND=postgres")
+
+    if args.processes <= 1:
+        _process_main(args.concurrency)
+        return
+
+    # هر پروسه event loop، pool دیتابیس و Bot خودش را دارد
+    ctx = multiprocessing.get_context("spawn")
+    procs = [ctx.Process(target=_process_main, args=(args.concurrency, args.processes), daemon=False) for _ in range(args.processes)]
+    # بعد از این مهلت، پروسه‌ای که هنوز خاموش نشده kill می‌شود (jobهایش را reaper برمی‌گرداند)
+    stop_timeout = settings.WORKER_SHUTDOWN_GRACE_SECONDS + 15
+    stop_deadline: float | None = None
+
+    def _stopping() -> None:
+        nonlocal stop_deadline
+        if stop_deadline is None:
+            stop_deadline = time.monotonic() + stop_timeout
+
+    def _on_sigterm(signum, frame) -> None:
+        # docker stop / systemd فقط به پروسه اصلی SIGTERM می‌دهند؛ به فرزندها می‌رسانیم
+        _stopping()
+        for p in procs:
+            if p.is_alive():
+                p.terminate()
+
+    signal.signal(signal.SIGTERM, _on_sigterm)
+    for p in procs:
+        p.start()
+
+    while any(p.is_alive() for p in procs):
+        try:
+            for p in procs:
+                p.join(timeout=1.0)
+        except KeyboardInterrupt:
+            # SIGINT ترمینال به همه پروسه‌های گروه می‌رسد؛ فقط منتظر خاموش شدنشان می‌مانیم
+            _stopping()
+        if stop_deadline is not None and time.monotonic() >= stop_deadline:
+            for p in procs:
+                if p.is_alive():
+                    logger.warning("Worker process %s did not stop in %ss; killing", p.pid, stop_timeout)
+                    p.kill()
+            for p in procs:
+                p.join()
+            break
+
+
+if __name__ == "__main__":
+    main()
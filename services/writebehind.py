@@ -0,0 +1,101 @@
+"""
+بافر write-behind عمومی: آیتم‌ها با کلید در RAM جمع و یکی می‌شوند (آخرین مقدار هر کلید می‌ماند)،
+هر interval ثانیه یا max_pending کلید با یک فراخوانی دسته‌ای write(session, batch) نوشته می‌شوند.
+last_seen کاربرها و request_timings هر دو روی همین‌اند.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import Awaitable, Callable, Generic, TypeVar
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config.database import get_session
+
+K = TypeVar("K")
+V = TypeVar("V")
+
+
+class WriteBehindBuffer(Generic[K, V]):
+    def __init__(
+        self,
+        name: str,
+        write: Callable[[AsyncSession, dict[K, V]], Awaitable[None]],
+        interval: float,
+        max_pending: int,
+    ):
+        self.name = name
+        self.interval = interval
+        self.max_pending = max(1, max_pending)
+        self._write = write
+        self._logger = logging.getLogger(name)
+        self._pending: dict[K, V] = {}
+        self._wake = asyncio.Event()
+        self._stopping = False
+        self._task: asyncio.Task | None = None
+
+        self.flushes = 0
+        self.flushed_rows = 0
+
+    def put(self, key: K, value: V) -> None:
+        self._pending[key] = value
+        if len(self._pending) >= self.max_pending:
+            self._wake.set()
+
+    def pending(self) -> int:
+        return len(self._pending)
+
+    async def flush(self) -> int:
+        if not self._pending:
+            return 0
+
+        batch, self._pending = self._pending, {}
+        try:
+            async with get_session() as session:
+                await self._write(session, batch)
+                await session.commit()
+        except BaseException:
+            # برگردون تو بافر (CancelledError هم)؛ مقدارهای جدیدتر اولویت دارند
+            for key, value in batch.items():
+                self._pending.setdefault(key, value)
+            raise
+
+        self.flushes += 1
+        self.flushed_rows += len(batch)
+        return len(batch)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            if self._stopping:
+                return
+
+            try:
+                await self.flush()
+            except Exception:
+                self._logger.exception("%s flush failed (%s pending)", self.name, len(self._pending))
+
+    def start(self) -> None:
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """
+        shutdown: به حلقه بگو تمام شود و منتظرش بمان (cancel نه؛ flush در جریان نصفه نمی‌ماند)،
+        بعد هرچی مونده flush کن.
+        """
+        if self._task is not None:
+            self._stopping = True
+            self._wake.set()
+            await self._task
+            self._task = None
+        try:
+            await self.flush()
+        except Exception:
+            self._logger.exception("Final %s flush failed (%s dropped)", self.name, len(self._pending))
@@ -0,0 +1,63 @@
+from db.cache import TTLCache
+
+
+def test_get_returns_value_until_ttl_expires(clock):
+    cache = TTLCache(10, ttl=30, clock=clock)
+    cache.set("a", 1)
+
+    clock.advance(29.9)
+    assert cache.get("a") == 1
+
+    clock.advance(0.1)
+    assert cache.get("a") is None
+    assert "a" not in cache
+    assert cache.stats()["expirations"] == 1
+    assert len(cache) == 0
+
+
+def test_per_item_ttl_overrides_default(clock):
+    cache = TTLCache(10, ttl=30, clock=clock)
+    cache.set("short", 1, ttl=5)
+    cache.set("long", 2)
+
+    clock.advance(5)
+    assert cache.get("short") is None
+    assert cache.get("long") == 2
+
+
+def test_lru_evicts_least_recently_used(clock):
+    cache = TTLCache(2, ttl=60, clock=clock)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")  # a تازه‌تر از b می‌شود
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_set_existing_key_refreshes_recency_and_ttl(clock):
+    cache = TTLCache(2, ttl=10, clock=clock)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    clock.advance(8)
+    cache.set("a", 10)
+    cache.set("c", 3)
+
+    clock.advance(8)
+    assert cache.get("a") == 10
+    assert cache.get("b") is None
+
+
+def test_hit_miss_counters_and_pop(clock):
+    cache = TTLCache(4, ttl=10, clock=clock)
+    cache.set("a", 1)
+    cache.get("a")
+    cache.get("missing", "default")
+
+    assert cache.pop("a") == 1
+    assert cache.pop("a") is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["size"], stats["maxsize"]) == (1, 1, 0, 4)
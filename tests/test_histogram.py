@@ -0,0 +1,74 @@
+import math
+import random
+
+import pytest
+
+from services.stats import Histogram
+
+
+def _exact(samples: list[float], p: float) -> float:
+    ordered = sorted(samples)
+    return ordered[max(1, math.ceil(p / 100 * len(ordered))) - 1]
+
+
+def test_empty_histogram():
+    h = Histogram()
+    assert len(h) == 0
+    assert h.mean() == 0.0
+    assert h.percentiles([50, 99]) == [0.0, 0.0]
+    assert h.summary() == {"n": 0, "mean": 0.0, "p50": 0.0, "p95": 0.0, "p99": 0.0, "max": 0.0}
+
+
+@pytest.mark.parametrize("scale", [0.001, 1.0, 600.0])
+def test_percentiles_within_one_percent(scale):
+    rng = random.Random(42)
+    samples = [rng.lognormvariate(0, 1) * scale for _ in range(20_000)]
+    h = Histogram()
+    for s in samples:
+        h.add(s)
+    for p in (50, 90, 95, 99, 99.9):
+        exact = _exact(samples, p)
+        # گزارش از سقف bucket است: هیچ‌وقت کمتر از مقدار واقعی (جز گرد شدن میکروثانیه)
+        assert exact - 1e-6 <= h.percentile(p) <= exact * 1.01 + 1e-6
+
+
+def test_small_values_are_exact():
+    h = Histogram()
+    for us in range(1, 101):
+        h.add(us / 1_000_000)
+    assert h.percentile(50) == pytest.approx(50e-6)
+    assert h.percentile(100) == pytest.approx(100e-6)
+
+
+def test_percentile_never_exceeds_max():
+    h = Histogram()
+    h.add(1.2345)
+    assert h.percentile(100) == pytest.approx(1.2345)
+    assert h.summary()["max"] == pytest.approx(1.2345)
+
+
+def test_percentiles_order_independent_of_request_order():
+    h = Histogram()
+    for i in range(1, 1001):
+        h.add(i / 1000)
+    assert h.percentiles([99, 50]) == list(reversed(h.percentiles([50, 99])))
+
+
+def test_mean_and_negative_values():
+    h = Histogram()
+    for s in (0.5, 1.5, -3.0):
+        h.add(s)  # منفی صفر حساب می‌شود
+    assert len(h) == 3
+    assert h.mean() == pytest.approx(2.0 / 3)
+    assert h.percentile(1) == 0.0
+
+
+def test_merge_equals_single_histogram():
+    rng = random.Random(7)
+    samples = [rng.expovariate(2.0) for _ in range(5_000)]
+    whole, left, right = Histogram(), Histogram(), Histogram()
+    for i, s in enumerate(samples):
+        whole.add(s)
+        (left if i % 2 else right).add(s)
+    left.merge(right)
+    assert left.summary() == pytest.approx(whole.summary())
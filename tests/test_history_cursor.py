@@ -0,0 +1,38 @@
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pytest
+
+from bot.handlers import _decode_cursor, _encode_cursor
+
+
+@pytest.mark.parametrize(
+    "created_at, request_id",
+    [
+        (datetime(2026, 10, 18, 4, 39, 49, 123456, tzinfo=timezone.utc), 1),
+        (datetime(1970, 1, 1, tzinfo=timezone.utc), 0),
+        (datetime(2099, 12, 31, 23, 59, 59, 999999, tzinfo=timezone.utc), 2**31 - 1),
+    ],
+)
+def test_cursor_round_trip(created_at, request_id):
+    raw = _encode_cursor(SimpleNamespace(created_at=created_at, id=request_id))
+    assert _decode_cursor(raw) == (created_at, request_id)
+
+
+def test_cursor_fits_callback_data():
+    # callback_data تلگرام حداکثر 64 بایت است: acc:h:<f>:<o|n>:<cursor>
+    raw = _encode_cursor(SimpleNamespace(created_at=datetime(2099, 1, 1, tzinfo=timezone.utc), id=2**31 - 1))
+    assert len(f"acc:h:a:o:{raw}".encode()) <= 64
+
+
+def test_cursor_order_matches_keyset_order():
+    a = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    b = datetime(2026, 1, 1, 0, 0, 0, 1, tzinfo=timezone.utc)
+    first = _decode_cursor(_encode_cursor(SimpleNamespace(created_at=a, id=9)))
+    second = _decode_cursor(_encode_cursor(SimpleNamespace(created_at=b, id=1)))
+    assert first < second
+
+
+@pytest.mark.parametrize("raw", ["", "abc", "a.b.c", "zz!.1", "1."])
+def test_malformed_cursor_is_none(raw):
+    assert _decode_cursor(raw) is None
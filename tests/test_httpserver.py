@@ -0,0 +1,62 @@
+import asyncio
+
+from services.httpserver import HttpResponse, HttpServer
+
+
+async def _ok(req):
+    return HttpResponse(200, req.body)
+
+
+async def _exchange(chunks: list[bytes], pause: float = 0.0, **kwargs) -> bytes:
+    server = HttpServer(_ok, **kwargs)
+    await server.start()
+    try:
+        reader, writer = await asyncio.open_connection(server.host, server.port)
+        response = asyncio.create_task(reader.read())
+        for chunk in chunks:
+            if response.done():
+                break  # سرور جواب داده و کانکشن را بسته
+            try:
+                writer.write(chunk)
+                await writer.drain()
+            except ConnectionError:
+                break
+            await asyncio.sleep(pause)
+        data = await asyncio.wait_for(response, timeout=5)
+        writer.close()
+        return data
+    finally:
+        await server.stop()
+
+
+def test_request_roundtrip():
+    data = asyncio.run(_exchange([b"POST /x HTTP/1.1\r\nContent-Length: 2\r\nConnection: close\r\n\r\nhi"]))
+    assert data.startswith(b"HTTP/1.1 200 ")
+    assert data.endswith(b"hi")
+
+
+def test_trickled_headers_get_408():
+    # هر header زیر مهلت یک readline است؛ ولی کل درخواست از request_timeout بیشتر طول می‌کشد
+    chunks = [b"POST /x HTTP/1.1\r\n"] + [b"X-A: 1\r\n"] * 10
+    data = asyncio.run(_exchange(chunks, pause=0.05, request_timeout=0.2))
+    assert data.startswith(b"HTTP/1.1 408 ")
+
+
+def test_stalled_body_gets_408():
+    data = asyncio.run(_exchange([b"POST /x HTTP/1.1\r\nContent-Length: 10\r\n\r\nabc"], request_timeout=0.2))
+    assert data.startswith(b"HTTP/1.1 408 ")
+
+
+def test_too_many_headers_get_431():
+    head = b"GET / HTTP/1.1\r\n" + b"X-A: 1\r\n" * (HttpServer.MAX_HEADERS + 1) + b"\r\n"
+    assert asyncio.run(_exchange([head])).startswith(b"HTTP/1.1 431 ")
+
+
+def test_oversized_headers_get_431():
+    head = b"GET / HTTP/1.1\r\n" + (b"X-A: " + b"a" * 1000 + b"\r\n") * 40 + b"\r\n"
+    assert asyncio.run(_exchange([head])).startswith(b"HTTP/1.1 431 ")
+
+
+def test_body_over_limit_gets_413():
+    data = asyncio.run(_exchange([b"POST / HTTP/1.1\r\nContent-Length: 100\r\n\r\n"], max_body=10))
+    assert data.startswith(b"HTTP/1.1 413 ")
@@ -0,0 +1,113 @@
+import asyncio
+from collections import Counter
+from itertools import groupby
+from types import SimpleNamespace
+
+import pytest
+
+from services.queue import LANE_CREDIT, LANE_FREE, LANE_VIP, LANES, EditJob, LaneScheduler, MemoryQueue, lane_for_user
+
+
+def _picks(scheduler: LaneScheduler, eligible, n: int) -> list[str]:
+    out = []
+    for _ in range(n):
+        picked = scheduler.order(eligible)[0]
+        scheduler.commit(picked, eligible)
+        out.append(picked)
+    return out
+
+
+def test_weighted_ratio_over_each_round():
+    scheduler = LaneScheduler({"vip": 6, "credit": 3, "free": 1})
+    picks = _picks(scheduler, LANES, 100)
+    # smooth WRR: هر 10 برداشت دقیقاً 6/3/1
+    for i in range(0, 100, 10):
+        assert Counter(picks[i:i + 10]) == {LANE_VIP: 6, LANE_CREDIT: 3, LANE_FREE: 1}
+
+
+def test_picks_are_interleaved_not_bursty():
+    scheduler = LaneScheduler({"vip": 6, "credit": 3, "free": 1})
+    picks = _picks(scheduler, LANES, 10)
+    longest = max(len(list(run)) for _, run in groupby(picks))
+    assert longest < 6
+
+
+def test_only_eligible_lanes_are_picked():
+    scheduler = LaneScheduler({"vip": 6, "credit": 3, "free": 1})
+    picks = _picks(scheduler, {LANE_CREDIT, LANE_FREE}, 40)
+    assert Counter(picks) == {LANE_CREDIT: 30, LANE_FREE: 10}
+
+
+def test_idle_lane_does_not_bank_credit():
+    scheduler = LaneScheduler({"vip": 6, "credit": 3, "free": 1})
+    _picks(scheduler, {LANE_FREE}, 50)  # vip مدتی خالی بود
+    picks = _picks(scheduler, LANES, 10)
+    assert Counter(picks) == {LANE_VIP: 6, LANE_CREDIT: 3, LANE_FREE: 1}
+
+
+def test_order_ranks_all_eligible_lanes():
+    scheduler = LaneScheduler({"vip": 6, "credit": 3, "free": 1})
+    assert scheduler.order(LANES) == [LANE_VIP, LANE_CREDIT, LANE_FREE]
+    assert scheduler.order({LANE_FREE}) == [LANE_FREE]
+    assert scheduler.order(set()) == []
+
+
+@pytest.mark.parametrize(
+    "user, lane",
+    [
+        (None, LANE_FREE),
+        (SimpleNamespace(is_vip=True, credits=5), LANE_VIP),
+        (SimpleNamespace(is_vip=False, credits=5), LANE_CREDIT),
+        (SimpleNamespace(is_vip=False, credits=0), LANE_FREE),
+    ],
+)
+def test_lane_for_user(user, lane):
+    assert lane_for_user(user) == lane
+
+
+def test_position_scales_other_lanes_by_weight():
+    scheduler = LaneScheduler({"vip": 6, "credit": 3, "free": 1})
+    depths = {LANE_VIP: 500, LANE_CREDIT: 500, LANE_FREE: 500}
+    # VIP اول صف: فقط خودش (نه 501 به خاطر free‌های قدیمی‌تر)
+    assert scheduler.position(LANE_VIP, 0, {LANE_FREE: 500}) == 1
+    assert scheduler.position(LANE_FREE, 0, depths) == 10
+    assert scheduler.position(LANE_FREE, 9, depths) == 100
+    assert scheduler.position(LANE_CREDIT, 2, depths) == 3 + 6 + 1
+
+
+def test_position_caps_other_lanes_at_their_depth():
+    scheduler = LaneScheduler({"vip": 6, "credit": 3, "free": 1})
+    assert scheduler.position(LANE_FREE, 4, {LANE_VIP: 2, LANE_CREDIT: 0}) == 5 + 2
+
+
+def test_position_matches_actual_pick_order():
+    weights = {"vip": 6, "credit": 3, "free": 1}
+    depths = {LANE_VIP: 200, LANE_CREDIT: 200, LANE_FREE: 200}
+    picks = _picks(LaneScheduler(weights), LANES, 300)
+    for lane in LANES:
+        for ahead in (0, 4, 19):
+            actual = [i for i, p in enumerate(picks) if p == lane][ahead] + 1
+            estimate = LaneScheduler(weights).position(lane, ahead, depths)
+            assert abs(estimate - actual) <= 10
+
+
+def test_memory_queue_position_per_lane_and_user():
+    q = MemoryQueue(max_attempts=3, lane_weights={"vip": 6, "credit": 3, "free": 1})
+    for i in range(50):
+        q.put_nowait(EditJob(request_id=i, user_tg_id=100 + i % 5, chat_id=1, image_file_ids=[], prompt="", lane=LANE_FREE))
+    vip = EditJob(request_id=99, user_tg_id=7, chat_id=1, image_file_ids=[], prompt="", lane=LANE_VIP)
+    q.put_nowait(vip)
+    second = EditJob(request_id=100, user_tg_id=100, chat_id=1, image_file_ids=[], prompt="", lane=LANE_FREE)
+    q.put_nowait(second)
+
+    assert asyncio.run(q.position(vip)) == 1
+    # کاربر 100 یازده job دارد؛ یازدهمی بعد از 10 دور کامل 5 کاربر (50) + خودش، و 1 VIP
+    assert asyncio.run(q.position(second)) == 51 + 1
+
+
+def test_memory_queue_position_of_taken_job():
+    q = MemoryQueue(max_attempts=3)
+    job = EditJob(request_id=1, user_tg_id=1, chat_id=1, image_file_ids=[], prompt="")
+    q.put_nowait(job)
+    assert asyncio.run(q.get()) is job
+    assert asyncio.run(q.position(job)) == 1
@@ -0,0 +1,42 @@
+import asyncio
+from types import SimpleNamespace
+
+from services.membership import MembershipCache, matches_chat
+
+
+class _FakeBot:
+    def __init__(self, status: str):
+        self.status = status
+        self.calls = 0
+
+    async def get_chat_member(self, chat, user_id):
+        self.calls += 1
+        return SimpleNamespace(status=self.status)
+
+
+def test_matches_chat():
+    assert matches_chat(-100123, "MyChannel", "@mychannel")
+    assert matches_chat(-100123, None, "-100123")
+    assert not matches_chat(-100123, "Other", "@mychannel")
+    assert not matches_chat(-100999, "MyChannel", "-100123")
+    assert not matches_chat(-100123, None, "@mychannel")
+
+
+def test_join_update_clears_negative_entry():
+    async def scenario():
+        cache = MembershipCache(positive_ttl=3600, negative_ttl=60, maxsize=100)
+        bot = _FakeBot("left")
+        assert await cache.is_member(bot, "@chan", 1) is False
+
+        bot.status = "member"
+        assert await cache.is_member(bot, "@chan", 1) is False  # هنوز نتیجه منفی کش‌شده
+        assert bot.calls == 1
+
+        cache.on_member_update(-100, "other", "@chan", 1)  # کانال دیگر: بی‌اثر
+        assert await cache.is_member(bot, "@chan", 1) is False
+
+        cache.on_member_update(-100, "chan", "@chan", 1)
+        assert await cache.is_member(bot, "@chan", 1) is True
+        assert bot.calls == 2
+
+    asyncio.run(scenario())
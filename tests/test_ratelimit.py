@@ -0,0 +1,108 @@
+import asyncio
+
+import pytest
+
+from services.ratelimit import (
+    SLIDING_WINDOW,
+    TOKEN_BUCKET,
+    Budget,
+    MemoryBackend,
+    _sliding_window,
+    _token_bucket,
+)
+
+
+def _run(algorithm, budget: Budget, times: list[float]) -> list[bool]:
+    state, out = None, []
+    for now in times:
+        state, decision = algorithm(state, now, budget)
+        out.append(decision.allowed)
+    return out
+
+
+# -------- token bucket --------
+def test_token_bucket_allows_full_burst_then_denies():
+    budget = Budget(limit=5, window=10)  # 0.5 توکن در ثانیه
+    assert _run(_token_bucket, budget, [0.0] * 6) == [True] * 5 + [False]
+
+
+def test_token_bucket_retry_after_matches_refill():
+    budget = Budget(limit=5, window=10)
+    state = None
+    for _ in range(5):
+        state, _ = _token_bucket(state, 0.0, budget)
+
+    state, denied = _token_bucket(state, 0.0, budget)
+    assert not denied.allowed
+    assert denied.retry_after == pytest.approx(2.0)
+
+    _, early = _token_bucket(state, 1.99, budget)
+    assert not early.allowed
+    _, on_time = _token_bucket(state, 2.0, budget)
+    assert on_time.allowed
+
+
+def test_token_bucket_refill_is_capped_at_limit():
+    budget = Budget(limit=3, window=3)
+    state = None
+    for _ in range(3):
+        state, _ = _token_bucket(state, 0.0, budget)
+
+    # یک ساعت بیکاری هم فقط burst کامل (limit) را برمی‌گرداند
+    allowed = []
+    for _ in range(4):
+        state, decision = _token_bucket(state, 3600.0, budget)
+        allowed.append(decision.allowed)
+    assert allowed == [True, True, True, False]
+
+
+# -------- sliding window --------
+def test_sliding_window_limits_within_one_window():
+    budget = Budget(limit=4, window=10, algorithm=SLIDING_WINDOW)
+    assert _run(_sliding_window, budget, [0.0, 1.0, 2.0, 3.0, 4.0]) == [True] * 4 + [False]
+
+
+def test_sliding_window_weights_previous_window():
+    budget = Budget(limit=4, window=10, algorithm=SLIDING_WINDOW)
+    state = None
+    for t in (0.0, 1.0, 2.0, 3.0):
+        state, _ = _sliding_window(state, t, budget)
+
+    state, denied = _sliding_window(state, 4.0, budget)
+    # پنجره بعد (t=10) از 4 شروع می‌شود و باید تا 3 decay کند: t = 10 + 10 * (1 - 3/4) = 12.5
+    assert 4.0 + denied.retry_after == pytest.approx(12.5)
+
+    _, early = _sliding_window(state, 12.4, budget)
+    assert not early.allowed
+    _, on_time = _sliding_window(state, 12.5, budget)
+    assert on_time.allowed
+
+
+def test_sliding_window_forgets_after_two_windows():
+    budget = Budget(limit=2, window=10, algorithm=SLIDING_WINDOW)
+    state = None
+    for t in (0.0, 0.0):
+        state, _ = _sliding_window(state, t, budget)
+    assert not _sliding_window(state, 5.0, budget)[1].allowed
+    # پنجره 20..30 پنجره قبلی 10..20 را دارد که خالی بود
+    assert _run(_sliding_window, budget, [0.0, 0.0, 25.0, 25.0, 25.0]) == [True, True, True, True, False]
+
+
+def test_budget_parse():
+    assert Budget.parse("5/10") == Budget(limit=5, window=10.0, algorithm=TOKEN_BUCKET)
+    assert Budget.parse("0/0", SLIDING_WINDOW) == Budget(limit=1, window=0.001, algorithm=SLIDING_WINDOW)
+
+
+def test_memory_backend_keys_are_independent(clock):
+    backend = MemoryBackend(100, clock=clock)
+    budget = Budget(limit=1, window=10)
+
+    async def scenario():
+        first = await backend.hit("menu:1", budget)
+        again = await backend.hit("menu:1", budget)
+        other = await backend.hit("menu:2", budget)
+        clock.advance(10)
+        refilled = await backend.hit("menu:1", budget)
+        return first.allowed, again.allowed, other.allowed, refilled.allowed
+
+    assert asyncio.run(scenario()) == (True, False, True, True)
@@ -0,0 +1,53 @@
+import asyncio
+
+from config.runtime import RuntimeConfig
+
+
+class _GatedConfig(RuntimeConfig):
+    """reload تا باز شدن gate طول می‌کشد؛ خواندن‌ها شمرده می‌شوند."""
+
+    def __init__(self):
+        super().__init__(poll_seconds=3600)
+        self.reloads = 0
+        self.gate = asyncio.Event()
+        self.values: dict[str, str] = {}
+
+    async def reload(self):
+        self.reloads += 1
+        await self.gate.wait()
+        self.gate.clear()
+        return self.apply(dict(self.values))
+
+
+def test_notify_during_reload_triggers_another_reload():
+    async def scenario():
+        cfg = _GatedConfig()
+        cfg._on_notify(None, 0, "settings", "")
+        await asyncio.sleep(0)
+        assert cfg.reloads == 1
+
+        # تغییر بعد از شروع reload اول: دو NOTIFY یکی می‌شوند
+        cfg.values["MAX_IMAGES"] = "7"
+        cfg._on_notify(None, 0, "settings", "")
+        cfg._on_notify(None, 0, "settings", "")
+        cfg.gate.set()
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        assert cfg.reloads == 2
+        cfg.gate.set()
+        await cfg._reload_task
+        assert cfg.reloads == 2
+        assert cfg.current().MAX_IMAGES == 7
+
+    asyncio.run(scenario())
+
+
+def test_single_notify_reloads_once():
+    async def scenario():
+        cfg = _GatedConfig()
+        cfg.gate.set()
+        cfg._on_notify(None, 0, "settings", "")
+        await cfg._reload_task
+        assert cfg.reloads == 1
+
+    asyncio.run(scenario())